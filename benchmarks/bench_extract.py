@@ -0,0 +1,142 @@
+"""Compare the streaming extractor against the original BeautifulSoup html.parser path.
+
+Usage:
+    python benchmarks/bench_extract.py [--fixtures DIR] [--max-chars 25000] [--repeat 3]
+
+Saved pages (*.html) in --fixtures are used as the corpus. Without it, the real pages saved in
+benchmarks/fixtures (Sphinx, mdBook and rustdoc documentation with navigation, sidebars,
+tables and scripts) are used together with synthetic pages from a few KB up to several MB.
+For every page the script reports wall time, peak traced memory, how many input bytes each
+path had to consume, and how closely the streaming output matches the BeautifulSoup output.
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'function'))
+
+from bs4 import BeautifulSoup  # noqa: E402
+from html_extract import CHUNK_SIZE, StreamingTextExtractor  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+WORDS = ('agent bedrock lambda search scrape content page model token budget stream parser '
+         'cache network latency result query answer document section heading').split()
+
+
+def bs4_extract(html_content, max_size):
+    # The extraction path used by both Lambdas before the streaming extractor
+    soup = BeautifulSoup(html_content, 'html.parser')
+    for script_or_style in soup(["script", "style"]):
+        script_or_style.decompose()
+    text = soup.get_text()
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    cleaned_text = '\n'.join(chunk for chunk in chunks if chunk)
+    if max_size is not None and len(cleaned_text) > max_size:
+        cleaned_text = cleaned_text[:max_size]
+    return cleaned_text, len(html_content.encode('utf-8'))
+
+
+def streaming_extract(html_content, max_size):
+    # Feed the page in network-sized chunks, the way extract_document reads a response
+    extractor = StreamingTextExtractor(max_size)
+    for start in range(0, len(html_content), CHUNK_SIZE):
+        chunk = html_content[start:start + CHUNK_SIZE]
+        extractor.bytes_read += len(chunk.encode('utf-8'))
+        extractor.feed(chunk)
+        if extractor.done:
+            break
+    extractor.close()
+    return extractor.text(), extractor.bytes_read
+
+
+def synthetic_page(rng, paragraphs):
+    parts = ['<html><head><title>Synthetic page</title><style>body { color: #333; }</style>',
+             '<script>window.analytics = {"id": 42};</script></head><body>',
+             '<nav><ul>' + ''.join(f'<li><a href="/p{i}">Menu {i}</a></li>' for i in range(30)) + '</ul></nav>']
+    for index in range(paragraphs):
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 120)))
+        parts.append(f'<div class="section"><h2>Section {index}</h2>\n<p>{sentence}.</p>\n</div>\n')
+        if index % 25 == 0:
+            parts.append('<script>var tracking = "' + 'x' * 2000 + '";</script>')
+    parts.append('<footer>Copyright</footer></body></html>')
+    return ''.join(parts)
+
+
+def saved_pages(fixtures_dir):
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, '*.html'))):
+        with open(path, 'r', encoding='utf-8', errors='replace') as file:
+            corpus.append((os.path.basename(path), file.read()))
+    return corpus
+
+
+def load_corpus(fixtures_dir):
+    if fixtures_dir:
+        return saved_pages(fixtures_dir)
+    rng = random.Random(1234)
+    synthetic = [(f'synthetic_{count}p.html', synthetic_page(rng, count)) for count in (20, 200, 2000, 8000)]
+    return synthetic + saved_pages(FIXTURES_DIR)
+
+
+def measure(func, html_content, max_size, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(html_content, max_size)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    output, bytes_consumed = func(html_content, max_size)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return output, {'seconds': min(timings), 'peak_bytes': peak, 'bytes_consumed': bytes_consumed}
+
+
+def line_overlap(reference, candidate):
+    # Share of the reference lines the candidate also produced
+    reference_lines = set(reference.splitlines())
+    if not reference_lines:
+        return 1.0
+    return len(reference_lines & set(candidate.splitlines())) / len(reference_lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fixtures', help='Directory of saved *.html pages')
+    parser.add_argument('--max-chars', type=int, default=25000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='Write results to this file as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for name, html_content in load_corpus(args.fixtures):
+        bs4_output, bs4_stats = measure(bs4_extract, html_content, args.max_chars, args.repeat)
+        stream_output, stream_stats = measure(streaming_extract, html_content, args.max_chars, args.repeat)
+        results.append({
+            'page': name,
+            'page_bytes': len(html_content.encode('utf-8')),
+            'bs4': bs4_stats,
+            'streaming': stream_stats,
+            'output_line_overlap': round(line_overlap(bs4_output, stream_output), 4)
+        })
+
+    print(f"{'page':<28}{'size KB':>10}{'bs4 ms':>10}{'stream ms':>11}{'bs4 peak KB':>13}"
+          f"{'stream peak KB':>16}{'read KB':>10}{'overlap':>9}")
+    for result in results:
+        print(f"{result['page']:<28}{result['page_bytes'] / 1024:>10.0f}"
+              f"{result['bs4']['seconds'] * 1000:>10.1f}{result['streaming']['seconds'] * 1000:>11.1f}"
+              f"{result['bs4']['peak_bytes'] / 1024:>13.0f}{result['streaming']['peak_bytes'] / 1024:>16.0f}"
+              f"{result['streaming']['bytes_consumed'] / 1024:>10.0f}{result['output_line_overlap']:>9.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""Load test the webscrape and internet search Lambda handlers offline.
+
+Usage:
+    python benchmarks/bench_handlers.py [--fixtures DIR] [--invocations 20] [--concurrency 4]
+        [--latency 0.05] [--scenario NAME ...] [--host-rate 1000] [--warm-cache] [--json results.json]
+        [--compare baseline.json]
+
+A local fixture server (fixture_server.py) serves the page corpus and the internet search
+handler gets its results from the fixture search provider, so no network access is needed.
+Each scenario calls lambda_handler --invocations times from --concurrency threads and reports
+p50/p95/p99 latency, throughput, errors, bytes downloaded from the fixture server and the
+process's peak RSS so far. With --json the results are written for later runs to --compare.
+"""
+import argparse
+import contextlib
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_extract import load_corpus
+from fixture_server import start_server
+
+SCENARIOS = ('webscrape_page', 'webscrape_slow_drip', 'webscrape_redirect', 'webscrape_error',
+             'webscrape_rate_limited', 'webscrape_robots_disallowed', 'webscrape_documents', 'webscrape_binary',
+             'webscrape_spa', 'webscrape_batch', 'internet_search')
+DOCUMENTS = ('report.pdf', 'notes.txt', 'notes.md', 'data.json', 'feed.xml')
+BINARY_DOCUMENTS = ('photo.png', 'photo-unlabelled')
+
+
+def configure_environment(base_url, page_names, warm_cache, host_rate):
+    # The handler modules read their settings at import time, so this runs before importing them
+    work_dir = tempfile.mkdtemp(prefix='bench_handlers_')
+    fixtures_path = os.path.join(work_dir, 'search_fixtures.json')
+    results = [f'{base_url}/page/{name}' for name in page_names]
+    results += [f'{base_url}/page/{page_names[0]}?drip=0.02', f'{base_url}/status/500']
+    with open(fixtures_path, 'w') as file:
+        json.dump({'*': results}, file)
+    os.environ.setdefault('PAGE_CACHE_DIR', os.path.join(work_dir, 'page_cache'))
+    if not warm_cache:
+        os.environ['PAGE_CACHE_TTL_SECONDS'] = '0'
+    os.environ['SEARCH_PROVIDER'] = 'fixture'
+    os.environ['SEARCH_FIXTURES'] = fixtures_path
+    os.environ.setdefault('METRICS_ENABLED', 'false')
+    # Every fixture URL is on one host, so the per-host rate limit would otherwise set the pace
+    os.environ['HOST_RATE_PER_SECOND'] = str(host_rate)
+    os.environ['HOST_BURST'] = str(max(1, int(host_rate)))
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'function'))
+
+
+def webscrape_event(api_path, name, value):
+    return {'actionGroup': 'webscrape', 'apiPath': api_path, 'httpMethod': 'GET',
+            'parameters': [{'name': name, 'value': value}], 'inputText': 'benchmark'}
+
+
+def build_events(scenario, base_url, page_names, invocations):
+    events = []
+    for index in range(invocations):
+        name = page_names[index % len(page_names)]
+        if scenario == 'webscrape_page':
+            events.append(webscrape_event('/search', 'inputURL', f'{base_url}/page/{name}'))
+        elif scenario == 'webscrape_slow_drip':
+            events.append(webscrape_event('/search', 'inputURL', f'{base_url}/page/{name}?drip=0.02'))
+        elif scenario == 'webscrape_redirect':
+            events.append(webscrape_event('/search', 'inputURL', f'{base_url}/redirect/2/{name}'))
+        elif scenario == 'webscrape_rate_limited':
+            # Each URL answers 429 once; the handler should wait out Retry-After and succeed
+            events.append(webscrape_event('/search', 'inputURL', f'{base_url}/limited/1/{name}?retry_after=1&n={index}'))
+        elif scenario == 'webscrape_robots_disallowed':
+            events.append(webscrape_event('/search', 'inputURL', f'{base_url}/private/{name}'))
+        elif scenario == 'webscrape_documents':
+            events.append(webscrape_event('/search', 'inputURL', f'{base_url}/doc/{DOCUMENTS[index % len(DOCUMENTS)]}'))
+        elif scenario == 'webscrape_binary':
+            # Refused from the headers or the first bytes; every call is expected to fail
+            events.append(webscrape_event('/search', 'inputURL', f'{base_url}/doc/{BINARY_DOCUMENTS[index % 2]}'))
+        elif scenario == 'webscrape_spa':
+            # The visible text is a loading shell; the content comes from the embedded data fallback
+            events.append(webscrape_event('/search', 'inputURL', f'{base_url}/doc/app.html'))
+        elif scenario == 'webscrape_error':
+            events.append(webscrape_event('/search', 'inputURL', f'{base_url}/status/503'))
+        elif scenario == 'webscrape_batch':
+            urls = ','.join(f'{base_url}/page/{page}' for page in page_names)
+            events.append(webscrape_event('/batch', 'inputURLs', urls))
+        elif scenario == 'internet_search':
+            # A distinct query per invocation keeps the aggregate files and search cache apart
+            events.append({'actionGroup': 'internet_search', 'apiPath': '/search', 'httpMethod': 'POST',
+                           'inputText': f'benchmark query {index}'})
+    return events
+
+
+def is_error(api_response):
+    body = api_response['response']['responseBody']['application/json']['body']
+    if isinstance(body, str):
+        try:
+            body = json.loads(body)
+        except ValueError:
+            return True
+    return not isinstance(body, dict) or 'error' in body
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.4999)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KB on Linux
+
+
+def run_scenario(scenario, handler, events, concurrency, server):
+    def invoke(event):
+        start = time.perf_counter()
+        try:
+            failed = is_error(handler(event, None))
+        except Exception:
+            failed = True
+        return time.perf_counter() - start, failed
+
+    server.reset_counters()
+    started = time.perf_counter()
+    # Handler logging goes to stdout; keep it out of the report
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(invoke, events))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(seconds for seconds, _ in outcomes)
+    return {
+        'scenario': scenario,
+        'invocations': len(events),
+        'concurrency': concurrency,
+        'errors': sum(1 for _, failed in outcomes if failed),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2),
+        'throughput_per_second': round(len(events) / wall, 2),
+        'wall_seconds': round(wall, 3),
+        'bytes_downloaded': server.bytes_sent,
+        'http_requests': server.requests,
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path) as file:
+        baseline = {result['scenario']: result for result in json.load(file)['results']}
+    print(f"\nCompared with {baseline_path}:")
+    print(f"{'scenario':<30}{'p50':>10}{'p95':>10}{'p99':>10}{'throughput':>12}{'bytes':>10}")
+    for result in results:
+        before = baseline.get(result['scenario'])
+        if before is None:
+            continue
+
+        def change(key):
+            if not before[key]:
+                return '-'
+            return f"{(result[key] - before[key]) / before[key] * 100:+.1f}%"
+
+        print(f"{result['scenario']:<30}{change('p50_ms'):>10}{change('p95_ms'):>10}{change('p99_ms'):>10}"
+              f"{change('throughput_per_second'):>12}{change('bytes_downloaded'):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fixtures', help='Directory of saved *.html pages')
+    parser.add_argument('--invocations', type=int, default=20, help='Handler calls per scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='Simulated concurrent invocations')
+    parser.add_argument('--latency', type=float, default=0.05, help='Fixture server seconds before each response')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='Run only these scenarios')
+    parser.add_argument('--host-rate', type=float, default=1000, help='Per-host requests per second allowed')
+    parser.add_argument('--warm-cache', action='store_true', help='Keep the page cache TTL so repeats are cache hits')
+    parser.add_argument('--json', help='Write results to this file as JSON')
+    parser.add_argument('--compare', help='Earlier --json output to compare against')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.fixtures)
+    page_names = [name for name, _ in corpus]
+    server = start_server(corpus, latency=args.latency)
+    configure_environment(server.base_url, page_names, args.warm_cache, args.host_rate)
+
+    import lambda_internet_search
+    import lambda_webscrape
+    # The search handler empties /tmp before each run; keep the machine's /tmp intact
+    lambda_internet_search.empty_tmp_directory = lambda: None
+
+    results = []
+    for scenario in args.scenario or SCENARIOS:
+        handler = lambda_internet_search.lambda_handler if scenario == 'internet_search' else lambda_webscrape.lambda_handler
+        events = build_events(scenario, server.base_url, page_names, args.invocations)
+        results.append(run_scenario(scenario, handler, events, max(1, args.concurrency), server))
+
+    print(f"{'scenario':<30}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>8}{'errors':>8}"
+          f"{'MB down':>9}{'RSS MB':>8}")
+    for result in results:
+        print(f"{result['scenario']:<30}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+              f"{result['throughput_per_second']:>8.1f}{result['errors']:>8}"
+              f"{result['bytes_downloaded'] / (1024 * 1024):>9.1f}{result['peak_rss_mb']:>8.0f}")
+
+    if args.compare:
+        print_comparison(results, args.compare)
+
+    if args.json:
+        config = {key: value for key, value in vars(args).items() if key not in ('json', 'compare')}
+        with open(args.json, 'w') as file:
+            json.dump({'config': config, 'python': sys.version.split()[0], 'results': results}, file, indent=2)
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Measure Lambda cold-start cost: per-module import time and handler init duration.
+
+Usage:
+    python benchmarks/bench_startup.py [--layer LAYER.zip ...] [--runs 10] [--top 15] [--json results.json]
+
+Every run starts a fresh interpreter, imports a handler module the way the Lambda runtime does
+and calls it once with an unrecognized api path (a request that needs no network), then builds
+the HTTP session the first real request would need. Reported per handler: the handler import
+(init duration), the first call, building the session (the deferred requests import), the
+whole process, and the modules with the largest cumulative import time from -X importtime.
+
+Pass one or more --layer zips (e.g. the shipped layer and the output of
+lambda-layer/build_layer.py) to compare them; each is unpacked and used instead of the
+installed packages, as Lambda does with /opt/python. To compare against an older revision
+of the functions, point --function-dir at a checkout of it (e.g. a git worktree).
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+FUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'function')
+HANDLERS = ('lambda_webscrape', 'lambda_internet_search')
+
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+module = __import__(sys.argv[1])
+imported = time.perf_counter()
+module.lambda_handler({"actionGroup": "bench", "apiPath": "/unknown", "httpMethod": "GET"}, None)
+called = time.perf_counter()
+import fetch_client
+fetch_client.get_session()
+session_built = time.perf_counter()
+sys.stderr.write("PROBE " + json.dumps({"import_ms": (imported - started) * 1000,
+                                         "first_call_ms": (called - imported) * 1000,
+                                         "session_ms": (session_built - called) * 1000}) + "\\n")
+'''
+
+
+def run_probe(handler, python_path, isolated):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(python_path), METRICS_ENABLED='false',
+               PYTHONDONTWRITEBYTECODE='1')  # Like Lambda's read-only file system
+    # With a layer, -S keeps the local site-packages (and its .pth hooks) out of the measurement
+    flags = ['-S'] if isolated else []
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, *flags, '-X', 'importtime', '-c', PROBE, handler],
+                               env=env, capture_output=True, text=True, check=True)
+    process_ms = (time.perf_counter() - started) * 1000
+    probe = {}
+    modules = {}
+    for line in completed.stderr.splitlines():
+        if line.startswith('PROBE '):
+            probe = json.loads(line[len('PROBE '):])
+        elif line.startswith('import time:') and 'self [us]' not in line:
+            # 'import time:       157 |      73430 |   fetch_client'
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            modules[name.strip()] = (int(self_us), int(cumulative_us))
+    probe['process_ms'] = process_ms
+    return probe, modules
+
+
+def measure(handler, python_path, isolated, runs, top):
+    probes = []
+    cumulative = {}
+    for _ in range(runs):
+        probe, modules = run_probe(handler, python_path, isolated)
+        probes.append(probe)
+        for name, (_, cumulative_us) in modules.items():
+            cumulative.setdefault(name, []).append(cumulative_us / 1000)
+    slowest = sorted(((statistics.median(times), name) for name, times in cumulative.items()), reverse=True)
+    return {
+        'handler': handler,
+        'runs': runs,
+        'process_ms': round(statistics.median(p['process_ms'] for p in probes), 2),
+        'import_ms': round(statistics.median(p['import_ms'] for p in probes), 2),
+        'first_call_ms': round(statistics.median(p['first_call_ms'] for p in probes), 2),
+        'session_ms': round(statistics.median(p['session_ms'] for p in probes), 2),
+        'slowest_imports_ms': [(name, round(ms, 2)) for ms, name in slowest[:top]]
+    }
+
+
+def unpack_layer(path, work_dir):
+    target = os.path.join(work_dir, os.path.splitext(os.path.basename(path))[0])
+    with zipfile.ZipFile(path) as archive:
+        archive.extractall(target)
+    return os.path.join(target, 'python')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--layer', action='append', help='Layer zip to measure against (repeatable)')
+    parser.add_argument('--runs', type=int, default=10, help='Fresh interpreters per handler')
+    parser.add_argument('--top', type=int, default=15, help='Slowest imports to list')
+    parser.add_argument('--function-dir', default=FUNCTION_DIR, help='Folder with the handler modules')
+    parser.add_argument('--json', help='Write results to this file as JSON')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    results = []
+    try:
+        for layer in args.layer or [None]:
+            python_path = [os.path.abspath(args.function_dir)] + ([unpack_layer(layer, work_dir)] if layer else [])
+            for handler in HANDLERS:
+                result = measure(handler, python_path, bool(layer), args.runs, args.top)
+                result['layer'] = os.path.basename(layer) if layer else 'installed packages'
+                results.append(result)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for result in results:
+        print(f"\n{result['handler']} with {result['layer']} (median of {result['runs']} runs)")
+        print(f"  handler import (init)                     {result['import_ms']:8.1f} ms")
+        print(f"  first call (unrecognized api path)        {result['first_call_ms']:8.1f} ms")
+        print(f"  HTTP session for the first fetch          {result['session_ms']:8.1f} ms")
+        print(f"  whole process                             {result['process_ms']:8.1f} ms")
+        print("  slowest imports (cumulative ms):")
+        for name, ms in result['slowest_imports_ms']:
+            print(f"    {name:<40}{ms:8.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
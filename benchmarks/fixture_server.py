@@ -0,0 +1,241 @@
+"""Local HTTP fixture server for the handler benchmarks.
+
+Usage:
+    python benchmarks/fixture_server.py [--fixtures DIR] [--port 8765] [--latency 0.05]
+
+Serves a corpus of HTML pages (saved *.html files from --fixtures, or the synthetic and saved
+real pages of bench_extract.py) with behaviour chosen per request:
+
+    /page/<name>                  the page, after the server's default latency
+    /page/<name>?latency=0.5      the page after 0.5 s before the response headers
+    /page/<name>?drip=0.05        the page in 4 KB pieces with 0.05 s between them
+    /redirect/<hops>/<name>       <hops> 302 redirects, then the page
+    /limited/<n>/<name>           429 with Retry-After (?retry_after=1) for the first n requests
+    /private/<name>               the page, but disallowed by the server's robots.txt
+    /status/<code>                an empty response with that status code
+    /doc/<name>                   a document from sample_documents(): report.pdf, notes.txt,
+                                  notes.md, data.json, feed.xml, photo.png, photo-unlabelled and
+                                  app.html, a JavaScript rendered page with its text in embedded data
+    /robots.txt                   ROBOTS_TXT, or the robots_txt given to the server
+
+Every byte of response body sent is counted so benchmarks can report bytes downloaded.
+"""
+import argparse
+import json
+import struct
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from bench_extract import load_corpus
+
+DRIP_CHUNK_BYTES = 4096
+ROBOTS_TXT = 'User-agent: *\nDisallow: /private/\n'
+
+
+def pdf_document(pages):
+    # A small but well-formed PDF: one Flate-compressed content stream of Tj lines per page
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None,
+               b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    page_ids = []
+    for lines in pages:
+        commands = ['BT /F1 11 Tf 72 720 Td 14 TL']
+        for line in lines:
+            escaped = line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+            commands.append(f'({escaped}) Tj T*')
+        commands.append('ET')
+        stream = zlib.compress('\n'.join(commands).encode('latin-1'))
+        objects.append(b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(stream) + stream + b'\nendstream')
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] '
+                       b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % len(objects))
+        page_ids.append(len(objects))
+    kids = ' '.join(f'{number} 0 R' for number in page_ids)
+    objects[1] = f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>'.encode()
+    body = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, content in enumerate(objects, 1):
+        offsets.append(len(body))
+        body += b'%d 0 obj\n' % number + content + b'\nendobj\n'
+    xref = len(body)
+    body += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    body += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    body += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(body)
+
+
+def sample_documents(corpus):
+    # name -> (content type, body), built from the text of the first corpus page
+    name, html = corpus[0]
+    words = [word for word in html.replace('<', ' <').split() if not word.startswith('<') and word.isalpha()]
+    lines = [' '.join(words[start:start + 12]) for start in range(0, len(words), 12)] or ['Empty page']
+    text = '\n\n'.join('\n'.join(lines[start:start + 4]) for start in range(0, len(lines), 4))
+    png = b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + bytes(17) + bytes(256 * 1024)
+    feed = ''.join(f'<item><title>{line[:40]}</title><link>https://example.com/{index}</link>'
+                   f'<description><![CDATA[<p>{line}</p>]]></description></item>'
+                   for index, line in enumerate(lines[:50]))
+    # Like a Next.js page: an empty shell, a large inline bundle, and the content in meta tags,
+    # JSON-LD and __NEXT_DATA__ (with < escaped the way Next.js does)
+    linked_data = {'@context': 'https://schema.org', '@type': 'Article', 'headline': name,
+                   'description': lines[0], 'author': {'@type': 'Person', 'name': 'Benchmark'}}
+    state = json.dumps({'props': {'pageProps': {'article': {
+        'id': 1, 'slug': name, 'title': name, 'body': ''.join(f'<p>{line}</p>' for line in lines[:60])}}},
+        'page': '/[slug]', 'buildId': 'benchmark'}).replace('<', '\\u003c')
+    bundle = 'function render(){' + 'var node=document.createElement("div");' * 4000 + '}'
+    app = (f'<!DOCTYPE html><html><head><title>{name}</title><meta name="description" content="{lines[0]}">'
+           f'<meta property="og:title" content="{name}">'
+           f'<script type="application/ld+json">{json.dumps(linked_data)}</script><script>{bundle}</script></head>'
+           '<body><div id="__next">Loading...</div><noscript>You need to enable JavaScript to run this app.</noscript>'
+           f'<script id="__NEXT_DATA__" type="application/json">{state}</script></body></html>')
+    return {
+        'app.html': ('text/html; charset=utf-8', app.encode('utf-8')),
+        'report.pdf': ('application/pdf', pdf_document([lines[start:start + 40] for start in range(0, len(lines), 40)])),
+        'notes.txt': ('text/plain', text.encode('utf-8')),
+        'notes.md': ('text/markdown; charset=utf-8', f'# {name}\n\n{text}'.encode('utf-8')),
+        'data.json': ('application/json', json.dumps({'source': name, 'paragraphs': [{'index': index, 'text': line}
+                                                                                     for index, line in enumerate(lines)]}).encode('utf-8')),
+        'feed.xml': ('application/rss+xml', f'<?xml version="1.0"?><rss><channel><title>{name}</title>{feed}</channel></rss>'.encode('utf-8')),
+        'photo.png': ('image/png', png),
+        'photo-unlabelled': ('application/octet-stream', png)
+    }
+
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, corpus, latency=0.0, robots_txt=ROBOTS_TXT):
+        super().__init__(address, FixtureHandler)
+        self.pages = {name: html.encode('utf-8') for name, html in corpus}
+        self.documents = sample_documents(corpus)
+        self.latency = latency
+        self.robots_txt = robots_txt.encode('utf-8')
+        self.bytes_sent = 0
+        self.requests = 0
+        self.path_requests = {}  # path and query -> requests seen, for /limited/
+        self.lock = threading.Lock()
+
+    def count(self, sent):
+        with self.lock:
+            self.bytes_sent += sent
+
+    def handle_error(self, request, client_address):
+        # Clients drop connections once their text budget is filled; only report real failures
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+    def reset_counters(self):
+        with self.lock:
+            self.bytes_sent = 0
+            self.requests = 0
+            self.path_requests = {}
+
+    def count_path(self, path):
+        with self.lock:
+            self.path_requests[path] = self.path_requests.get(path, 0) + 1
+            return self.path_requests[path]
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like real sites
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+        parsed = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        parts = [part for part in parsed.path.split('/') if part]
+        try:
+            time.sleep(float(params.get('latency', self.server.latency)))
+            if parts == ['robots.txt']:
+                self.send_body(self.server.robots_txt, 'text/plain')
+            elif len(parts) == 2 and parts[0] == 'status':
+                self.send_empty(int(parts[1]))
+            elif len(parts) == 3 and parts[0] == 'limited' and self.server.count_path(self.path) <= int(parts[1]):
+                self.send_response(429)
+                self.send_header('Retry-After', params.get('retry_after', '1'))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            elif len(parts) == 3 and parts[0] == 'limited' and parts[2] in self.server.pages:
+                self.send_page(self.server.pages[parts[2]], float(params.get('drip', 0)))
+            elif len(parts) == 3 and parts[0] == 'redirect':
+                hops = int(parts[1])
+                target = f'/redirect/{hops - 1}/{parts[2]}' if hops > 1 else f'/page/{parts[2]}'
+                self.send_response(302)
+                self.send_header('Location', target + (f'?{parsed.query}' if parsed.query else ''))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            elif len(parts) == 2 and parts[0] == 'doc' and parts[1] in self.server.documents:
+                content_type, body = self.server.documents[parts[1]]
+                self.send_page(body, float(params.get('drip', 0)), content_type)
+            elif len(parts) == 2 and parts[0] in ('page', 'private') and parts[1] in self.server.pages:
+                self.send_page(self.server.pages[parts[1]], float(params.get('drip', 0)))
+            else:
+                self.send_empty(404)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client stopped reading, e.g. once its text budget was filled
+
+    def send_empty(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(len(body))
+
+    def send_page(self, body, drip, content_type='text/html; charset=utf-8'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not drip:
+            self.wfile.write(body)
+            self.server.count(len(body))
+            return
+        for start in range(0, len(body), DRIP_CHUNK_BYTES):
+            piece = body[start:start + DRIP_CHUNK_BYTES]
+            self.wfile.write(piece)
+            self.wfile.flush()
+            self.server.count(len(piece))
+            time.sleep(drip)
+
+
+def start_server(corpus, latency=0.0, host='127.0.0.1', port=0):
+    # Start the server on a background thread; port 0 picks a free port
+    server = FixtureServer((host, port), corpus, latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fixtures', help='Directory of saved *.html pages')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='Default seconds before each response')
+    args = parser.parse_args()
+
+    server = FixtureServer((args.host, args.port), load_corpus(args.fixtures), args.latency)
+    print(f"Serving {len(server.pages)} pages on {server.base_url}: {', '.join(sorted(server.pages))}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
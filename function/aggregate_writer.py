@@ -0,0 +1,102 @@
+import gzip
+import os
+
+from budget import allocate, char_budget, estimate_tokens, relevance_weights, response_bytes, truncate
+from html_extract import select_markdown, with_references
+
+# Incremental writer for the internet search aggregate. Each page is written to a buffered
+# (optionally gzip compressed) file in /tmp as soon as it has been extracted, so the full
+# aggregate is never held in memory; only a bounded excerpt of each page is kept, from which
+# the summary for the agent response is sized to the output budget once all pages are in.
+
+AGGREGATE_COMPRESS = os.environ.get('AGGREGATE_COMPRESS', 'false').lower() == 'true'
+AGGREGATE_SUMMARY_CHARS = int(os.environ.get('AGGREGATE_SUMMARY_CHARS', '20000'))
+AGGREGATE_EXCERPT_CHARS = int(os.environ.get('AGGREGATE_EXCERPT_CHARS', '8000'))  # Most of one page the summary can use
+WRITE_BUFFER_BYTES = 64 * 1024
+SEPARATOR = '=' * 100
+
+
+class AggregateWriter:
+    # With path None no file is written and only the summary excerpts are kept
+
+    def __init__(self, path, compress=AGGREGATE_COMPRESS, summary_chars=AGGREGATE_SUMMARY_CHARS,
+                 excerpt_chars=AGGREGATE_EXCERPT_CHARS):
+        self.path = path + '.gz' if compress and path is not None else path
+        if path is None:
+            self.file = None
+        elif compress:
+            self.file = gzip.open(self.path, 'wt', encoding='utf-8', compresslevel=5)
+        else:
+            self.file = open(self.path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_BYTES)
+        self.summary_chars = summary_chars
+        self.excerpt_chars = excerpt_chars
+        self.excerpts = []  # (url, excerpt, page length, has link definitions)
+        self.pages = 0
+        self.chars_written = 0
+
+    def add_page(self, url, content, references=None):
+        # references are the {number: url} link definitions of Markdown content, kept apart from
+        # the body so that those the excerpt still cites survive its truncation
+        page = with_references(content, references) if references else content
+        if self.file is not None:
+            for part in (f"URL: {url}\n\n", page, f"\n\n{SEPARATOR}\n\n"):
+                self.file.write(part)
+                self.chars_written += len(part)
+        self.pages += 1
+        excerpt = content[:self.excerpt_chars]
+        if references:
+            excerpt = with_references(excerpt, references)
+        self.excerpts.append((url, excerpt, len(page), bool(references)))
+
+    def close(self):
+        # File details for the results, None when no file was written
+        if self.file is None:
+            return None
+        self.file.close()
+        return {
+            'aggregated_file': os.path.basename(self.path),
+            'pages': self.pages,
+            'chars_written': self.chars_written,
+            'file_bytes': os.path.getsize(self.path)
+        }
+
+    def summary(self, query='', max_tokens=None, max_bytes=None, encodings=1):
+        """Page excerpts sized to the budget, with more room for pages that match the query.
+        Returns the summary text and a report of how much of the pages it holds.
+        """
+        headers = [f"URL: {url}\n" for url, _, _, _ in self.excerpts]
+        texts = [excerpt for _, excerpt, _, _ in self.excerpts]
+        weights = relevance_weights(texts, query)
+        fixed_chars = sum(len(header) + 2 for header in headers)
+        char_shares = allocate([len(text) for text in texts], self.summary_chars - fixed_chars, weights)
+        token_shares = byte_shares = [None] * len(texts)
+        if max_tokens is not None:
+            fixed_tokens = sum(estimate_tokens(header) + 1 for header in headers)
+            token_shares = allocate([estimate_tokens(text) for text in texts], max_tokens - fixed_tokens, weights)
+        if max_bytes is not None:
+            fixed_bytes = sum(response_bytes(header + '\n\n', encodings) for header in headers)
+            byte_shares = allocate([response_bytes(text, encodings) for text in texts], max_bytes - fixed_bytes, weights)
+
+        parts = []
+        truncated_pages = 0
+        for (_, _, page_length, markdown), header, text, chars, tokens, size in zip(
+                self.excerpts, headers, texts, char_shares, token_shares, byte_shares):
+            limit = min(chars, char_budget(text, tokens, size, encodings))
+            if markdown:
+                # Cut the body and keep the definitions of the links it still uses
+                kept = select_markdown(text, lambda body, max_chars: truncate(body, max_chars)[0], limit)
+            else:
+                kept, _ = truncate(text, limit)
+            if len(kept) < page_length:
+                truncated_pages += 1
+            if kept:
+                parts.append(header + kept)
+        text = '\n\n'.join(parts)
+        return text, {'pages': len(parts), 'truncated_pages': truncated_pages, 'estimated_tokens': estimate_tokens(text)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.file is not None and not self.file.closed:
+            self.file.close()
@@ -0,0 +1,138 @@
+import json
+import math
+import os
+import re
+
+from relevance import bm25_scores
+
+# Output budgeting shared by both Lambdas. Text is measured the two ways that matter
+# downstream: approximate model tokens (what the agent's context pays for) and the bytes it
+# takes in the action group response, which Bedrock rejects above 25 KB. Text is only cut
+# at paragraph, sentence, line or word boundaries, and callers get the offset where the
+# returned text stops so the agent can ask for the rest instead of scraping again.
+
+OUTPUT_MAX_TOKENS = int(os.environ.get('OUTPUT_MAX_TOKENS', '6000'))
+RESPONSE_MAX_BYTES = int(os.environ.get('RESPONSE_MAX_BYTES', '24000'))  # Below the 25 KB limit, leaving room for the envelope
+CHARS_PER_TOKEN = 4  # Typical for English text; other scripts are counted per character
+MIN_SHARE_WEIGHT = 0.2  # Pages without any query terms still get this share of an average page's weight
+BOUNDARY_WINDOW = 0.3  # How far back from the limit a boundary is searched for, as a share of the limit
+
+SENTENCE_END_PATTERN = re.compile(r'[.!?。！？][)"\'\]”]*\s')
+
+
+def estimate_tokens(text):
+    # ASCII runs cost about a token per CHARS_PER_TOKEN characters, multibyte characters
+    # (accents, CJK, emoji) about one each. Extra UTF-8 bytes approximate their number.
+    multibyte = (len(text.encode('utf-8')) - len(text) + 1) // 2
+    return math.ceil((len(text) - multibyte) / CHARS_PER_TOKEN + multibyte)
+
+
+def response_bytes(text, encodings=1):
+    # Bytes text takes once JSON encoded `encodings` times (escapes, \uXXXX for non-ASCII);
+    # the internet search body is a JSON string inside the JSON response, so it is encoded twice
+    for _ in range(encodings):
+        text = json.dumps(text)[1:-1]
+    return len(text)
+
+
+def char_budget(text, max_tokens=None, max_bytes=None, encodings=1):
+    # Longest prefix of text, in characters, within both limits
+    def fits(length):
+        prefix = text[:length]
+        return ((max_tokens is None or estimate_tokens(prefix) <= max_tokens)
+                and (max_bytes is None or response_bytes(prefix, encodings) <= max_bytes))
+
+    # Every character is at least one byte and ASCII text is the cheapest in tokens, which
+    # bounds the search without measuring a long text in full
+    high = len(text)
+    if max_bytes is not None:
+        high = min(high, max(0, max_bytes))
+    if max_tokens is not None:
+        high = min(high, max(0, max_tokens) * CHARS_PER_TOKEN + CHARS_PER_TOKEN)
+    if fits(high):
+        return high
+    low = 0
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def boundary_end(text, limit):
+    # Largest end position up to limit that falls on a paragraph, sentence, line or word boundary
+    if limit >= len(text):
+        return len(text)
+    floor = int(limit * (1 - BOUNDARY_WINDOW))
+    position = text.rfind('\n\n', floor, limit)
+    if position > 0:
+        return position
+    sentence_end = None
+    for match in SENTENCE_END_PATTERN.finditer(text, floor, limit + 1):
+        sentence_end = match.end() - 1
+    if sentence_end:
+        return sentence_end
+    for separator in ('\n', ' '):
+        position = text.rfind(separator, floor, limit)
+        if position > 0:
+            return position
+    return limit
+
+
+def truncate(text, max_chars):
+    """Cut text to at most max_chars on a boundary.
+    Returns (kept text, offset in text where the rest starts), the offset being None if nothing was cut.
+    """
+    if len(text) <= max_chars:
+        return text, None
+    end = boundary_end(text, max_chars)
+    rest = text[end:]
+    return text[:end].rstrip(), end + len(rest) - len(rest.lstrip())
+
+
+def truncation_info(full_text, kept, next_offset=None, start=0, cut=None, source_truncated=False):
+    # Metadata returned next to truncated content; start is where full_text begins in the page.
+    # cut says whether the selection left text out, when kept and full_text lengths cannot tell;
+    # source_truncated whether full_text itself stopped short of the page (size cap or time budget).
+    info = {
+        'truncated': cut if cut is not None else next_offset is not None or len(kept) < len(full_text),
+        'source_truncated': source_truncated,
+        'total_chars': start + len(full_text),
+        'returned_chars': len(kept),
+        'estimated_tokens': estimate_tokens(kept)
+    }
+    if next_offset is not None:
+        info['next_offset'] = start + next_offset
+    return info
+
+
+def relevance_weights(texts, query, sample_chars=OUTPUT_MAX_TOKENS * CHARS_PER_TOKEN):
+    # Share weights for pages from the BM25 score of their first sample_chars (at most what
+    # could be returned of them) against the query
+    scores = bm25_scores([text[:sample_chars] for text in texts], query)
+    average = sum(scores) / len(scores) if scores else 0
+    if not average:
+        return [1.0] * len(texts)
+    return [score + MIN_SHARE_WEIGHT * average for score in scores]
+
+
+def allocate(sizes, budget, weights=None):
+    # Split budget between items of the given sizes in proportion to their weights. Items that
+    # need less than their share get exactly what they need and the rest is shared again.
+    weights = weights or [1.0] * len(sizes)
+    shares = [0] * len(sizes)
+    remaining = [index for index, size in enumerate(sizes) if size > 0]
+    while remaining and budget > 0:
+        total_weight = sum(weights[index] for index in remaining)
+        small = [index for index in remaining if sizes[index] <= budget * weights[index] / total_weight]
+        if not small:
+            for index in remaining:
+                shares[index] = int(budget * weights[index] / total_weight)
+            break
+        for index in small:
+            shares[index] = sizes[index]
+            budget -= sizes[index]
+        remaining = [index for index in remaining if index not in small]
+    return shares
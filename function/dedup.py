@@ -0,0 +1,135 @@
+import os
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+from fetch_client import canonical_url
+from page_cache import normalize_url
+
+# Duplicate removal for the internet search aggregate. Result URLs are collapsed by canonical
+# form before anything is fetched, and after extraction every paragraph is fingerprinted with
+# a 64-bit SimHash of its word shingles, so passages repeated by mirrors, syndicated copies and
+# pages of the same site are only written once, in the first (best ranked) page carrying them.
+
+DEDUP_ENABLED = os.environ.get('DEDUP_ENABLED', 'true').lower() == 'true'
+DEDUP_MAX_DISTANCE = int(os.environ.get('DEDUP_MAX_DISTANCE', '6'))  # Differing SimHash bits still counted as a repeat, below BANDS
+DEDUP_MIN_WORDS = int(os.environ.get('DEDUP_MIN_WORDS', '8'))  # Shorter paragraphs (headings, labels) are always kept
+DEDUP_PAGE_RATIO = float(os.environ.get('DEDUP_PAGE_RATIO', '0.8'))  # Pages at least this repeated are dropped whole
+SHINGLE_WORDS = 3
+HASH_BITS = 64
+BANDS = 8  # With at most BANDS - 1 differing bits, two fingerprints share at least one band
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+HASH_MASK = (1 << HASH_BITS) - 1
+
+WORD_RE = re.compile(r'\w+')
+
+
+def url_key(url):
+    # Collapse the forms of a URL that serve the same page: scheme, www., trailing slash,
+    # tracking parameters and fragments, plus any redirect already seen for it
+    parts = urlsplit(normalize_url(canonical_url(url)))
+    host = parts.netloc[4:] if parts.netloc.startswith('www.') else parts.netloc
+    return urlunsplit(('', host, parts.path.rstrip('/'), parts.query, ''))
+
+
+class UrlDeduper:
+    def __init__(self):
+        self.seen = {}  # url key -> first URL with it
+        self.duplicates = []  # (duplicate URL, URL kept)
+
+    def filter(self, urls):
+        # Yield each URL whose canonical form has not been seen yet
+        for url in urls:
+            key = url_key(url)
+            if key in self.seen:
+                self.duplicates.append((url, self.seen[key]))
+                continue
+            self.seen[key] = url
+            yield url
+
+
+def simhash(words):
+    # 64-bit SimHash over word shingles. hash() is salted per process, which is fine here:
+    # fingerprints are only compared within one invocation
+    if len(words) < SHINGLE_WORDS:
+        shingles = words
+    else:
+        shingles = [' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+    bits = [format(hash(shingle) & HASH_MASK, '064b') for shingle in shingles]
+    half = len(bits) / 2
+    # Column-wise majority vote over the shingle hashes
+    return int(''.join('1' if column.count('1') > half else '0' for column in zip(*bits)), 2)
+
+
+def split_paragraphs(text):
+    # Main content text separates blocks with blank lines, full text puts one text run per line
+    separator = '\n\n' if '\n\n' in text else '\n'
+    return text.split(separator), separator
+
+
+class ContentDeduper:
+    def __init__(self, max_distance=DEDUP_MAX_DISTANCE, min_words=DEDUP_MIN_WORDS, page_ratio=DEDUP_PAGE_RATIO):
+        self.max_distance = min(max_distance, BANDS - 1)
+        self.min_words = min_words
+        self.page_ratio = page_ratio
+        self.bands = [{} for _ in range(BANDS)]  # band value -> fingerprints
+        self.duplicate_pages = 0
+        self.duplicate_paragraphs = 0
+        self.removed_chars = 0
+
+    def seen(self, fingerprint):
+        checked = set()
+        for index, band in enumerate(self.bands):
+            for other in band.get((fingerprint >> (index * BAND_BITS)) & BAND_MASK, ()):
+                if other in checked:
+                    continue
+                if (fingerprint ^ other).bit_count() <= self.max_distance:
+                    return True
+                checked.add(other)
+        return False
+
+    def add(self, fingerprint):
+        for index, band in enumerate(self.bands):
+            band.setdefault((fingerprint >> (index * BAND_BITS)) & BAND_MASK, []).append(fingerprint)
+
+    def filter_page(self, text):
+        """Drop paragraphs already seen in earlier pages.
+        Returns the remaining text, or None if the page repeats earlier pages almost entirely.
+        """
+        paragraphs, separator = split_paragraphs(text)
+        kept = []
+        new_fingerprints = []
+        checked = repeated = removed_chars = 0
+        for paragraph in paragraphs:
+            words = WORD_RE.findall(paragraph.lower())
+            if len(words) < self.min_words:
+                kept.append(paragraph)
+                continue
+            checked += 1
+            fingerprint = simhash(words)
+            if self.seen(fingerprint):
+                repeated += 1
+                removed_chars += len(paragraph) + len(separator)
+                continue
+            new_fingerprints.append(fingerprint)
+            kept.append(paragraph)
+
+        if checked and repeated / checked >= self.page_ratio:
+            self.duplicate_pages += 1
+            self.removed_chars += len(text)
+            return None
+        # Repeats within the page itself are left alone; only earlier pages count
+        for fingerprint in new_fingerprints:
+            self.add(fingerprint)
+        self.duplicate_paragraphs += repeated
+        self.removed_chars += removed_chars
+        return separator.join(kept)
+
+
+def dedup_report(url_deduper, content_deduper):
+    return {
+        'duplicate_urls': len(url_deduper.duplicates),
+        'duplicate_pages': content_deduper.duplicate_pages,
+        'duplicate_paragraphs': content_deduper.duplicate_paragraphs,
+        'deduplicated_chars': content_deduper.removed_chars
+    }
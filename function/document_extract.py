@@ -0,0 +1,580 @@
+import codecs
+import io
+import json
+import os
+import re
+import time
+import zlib
+from xml.etree.ElementTree import ParseError, XMLPullParser
+
+from html_extract import CHUNK_SIZE, FORMAT_TEXT, MODE_FULL, extract_html_text, make_extractor, response_encoding
+
+# Content-type dispatch in front of the HTML extractors. The declared Content-Type picks an
+# extractor and the first bytes of the body can override it (PDFs served as octet-stream,
+# images served as text/html). Images, video, audio and archives are refused from the
+# headers alone, before any of the body is read; PDFs, plain text, JSON and XML get
+# dedicated extractors with the same interface as the HTML ones, so every kind streams
+# through the same read loop, budget and deadline.
+
+KIND_HTML = 'html'
+KIND_TEXT = 'text'
+KIND_JSON = 'json'
+KIND_XML = 'xml'
+KIND_PDF = 'pdf'
+KIND_BINARY = 'binary'
+
+PDF_MAX_PAGES = int(os.environ.get('PDF_MAX_PAGES', '30'))  # Pages of a PDF read before stopping
+PDF_MAX_BYTES = int(os.environ.get('PDF_MAX_BYTES', str(10 * 1024 * 1024)))  # Larger PDFs are cut off here
+PDF_MAX_STREAM_BYTES = 4 * 1024 * 1024  # Inflated size allowed for one PDF content stream
+JSON_MAX_BYTES = int(os.environ.get('JSON_MAX_BYTES', str(2 * 1024 * 1024)))  # JSON is parsed whole, up to this size
+XML_PATH_DEPTH = 3  # Element names kept in each flattened XML line, counted from the element
+
+BINARY_TYPE_PREFIXES = ('image/', 'video/', 'audio/', 'font/', 'model/')
+BINARY_TYPES = frozenset([
+    'application/zip', 'application/gzip', 'application/x-gzip', 'application/x-tar', 'application/x-bzip2',
+    'application/x-xz', 'application/x-7z-compressed', 'application/x-rar-compressed', 'application/vnd.rar',
+    'application/java-archive', 'application/x-msdownload', 'application/wasm', 'application/msword',
+    'application/vnd.ms-excel', 'application/vnd.ms-powerpoint', 'application/x-shockwave-flash'
+])
+# File signatures checked against the start of the body
+PDF_MAGIC = b'%PDF-'
+BINARY_MAGIC = (
+    b'\x89PNG', b'\xff\xd8\xff', b'GIF8', b'RIFF', b'PK\x03\x04', b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00',
+    b'7z\xbc\xaf\x27\x1c', b'Rar!', b'OggS', b'ID3', b'\x1a\x45\xdf\xa3', b'\x00asm', b'\x7fELF', b'MZ',
+    b'\xd0\xcf\x11\xe0'
+)
+
+
+class UnsupportedContent(Exception):
+    pass
+
+
+def declared_kind(content_type):
+    # Kind from the Content-Type header, or None when the body has to be sniffed
+    media_type = (content_type or '').split(';')[0].strip().lower()
+    if not media_type or media_type in ('application/octet-stream', 'binary/octet-stream', 'application/unknown'):
+        return None
+    if media_type in ('text/html', 'application/xhtml+xml'):
+        return KIND_HTML
+    if media_type == 'application/pdf' or media_type == 'application/x-pdf':
+        return KIND_PDF
+    if media_type.endswith(('/json', '+json')):
+        return KIND_JSON
+    if media_type.endswith(('/xml', '+xml')):
+        return KIND_XML
+    if media_type.startswith(BINARY_TYPE_PREFIXES) or media_type in BINARY_TYPES or 'openxmlformats' in media_type:
+        return KIND_BINARY
+    if media_type.startswith('text/'):
+        return KIND_TEXT
+    return None
+
+
+def sniff_kind(first_bytes, declared):
+    # Magic bytes win over the header; otherwise only undeclared bodies are guessed at
+    if first_bytes.startswith(PDF_MAGIC):
+        return KIND_PDF
+    if first_bytes.startswith(BINARY_MAGIC) or first_bytes[4:8] == b'ftyp' or first_bytes[257:262] == b'ustar':
+        return KIND_BINARY
+    head = first_bytes[:1024].lstrip(b'\xef\xbb\xbf \t\r\n').lower()
+    if declared in (KIND_XML, KIND_TEXT, None) and (head.startswith(b'<!doctype html') or b'<html' in head):
+        return KIND_HTML
+    if declared is not None:
+        return declared
+    if b'\x00' in first_bytes[:512] and not first_bytes.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return KIND_BINARY
+    if head.startswith((b'{', b'[')):
+        return KIND_JSON
+    if head.startswith(b'<?xml') or head.startswith(b'<rss') or head.startswith(b'<feed'):
+        return KIND_XML
+    return KIND_HTML  # What every response was treated as before
+
+
+class TextBudget:
+    # Output lines with the same budget handling as the HTML extractors
+
+    def __init__(self, max_chars=None):
+        self.max_chars = max_chars
+        self.chunks = []
+        self.size = 0
+        self.done = False
+        self.truncated = False
+        self.bytes_read = 0
+        self.timed_out = False
+        self.parse_seconds = 0.0
+
+    def add_line(self, line):
+        if self.done:
+            return
+        separator = 1 if self.chunks else 0
+        if self.max_chars is not None and self.size + separator + len(line) > self.max_chars:
+            remaining = self.max_chars - self.size - separator
+            if remaining > 0:
+                self.chunks.append(line[:remaining])
+                self.size = self.max_chars
+            self.truncated = True
+            self.done = True
+            return
+        self.chunks.append(line)
+        self.size += separator + len(line)
+
+    def text(self):
+        return '\n'.join(self.chunks)
+
+
+class PlainTextExtractor(TextBudget):
+    # text/plain and markdown are passed through as they are, with trailing spaces and runs
+    # of blank lines removed; blank lines still separate paragraphs for ranking and dedup
+
+    def __init__(self, max_chars=None):
+        super().__init__(max_chars)
+        self.pending = ''
+        self.blank = True  # Leading blank lines are dropped
+
+    def feed(self, data):
+        lines = (self.pending + data).split('\n')
+        self.pending = lines.pop()
+        for line in lines:
+            self.add_text_line(line)
+
+    def add_text_line(self, line):
+        line = line.rstrip()
+        if not line:
+            if not self.blank:
+                self.add_line('')
+            self.blank = True
+            return
+        self.blank = False
+        self.add_line(line)
+
+    def close(self):
+        if self.pending:
+            self.add_text_line(self.pending)
+        self.pending = ''
+        while self.chunks and not self.chunks[-1]:
+            self.chunks.pop()
+
+
+class JsonExtractor(TextBudget):
+    # JSON is flattened to one 'path: value' line per non-empty scalar. The stdlib parser
+    # needs the whole document, so the body is buffered up to JSON_MAX_BYTES
+    raw = True
+
+    def __init__(self, max_chars=None):
+        super().__init__(max_chars)
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        if len(self.buffer) >= JSON_MAX_BYTES:
+            self.truncated = True
+            self.done = True
+
+    def close(self):
+        try:
+            document = json.loads(bytes(self.buffer))
+        except ValueError:
+            # Not JSON after all, or cut off at JSON_MAX_BYTES: keep the raw text
+            fallback = PlainTextExtractor(self.max_chars)
+            fallback.feed(bytes(self.buffer).decode('utf-8', errors='replace'))
+            fallback.close()
+            self.chunks, self.size = fallback.chunks, fallback.size
+            self.truncated = self.truncated or fallback.truncated
+            return
+        finally:
+            self.buffer = bytearray()
+        self.flatten(document, '')
+
+    def flatten(self, value, path):
+        if self.done:
+            return
+        if isinstance(value, dict):
+            for key, item in value.items():
+                self.flatten(item, f"{path}.{key}" if path else str(key))
+        elif isinstance(value, list):
+            for index, item in enumerate(value):
+                self.flatten(item, f"{path}[{index}]")
+        elif isinstance(value, str):
+            value = ' '.join(value.split())
+            if value:
+                self.add_line(f"{path}: {value}" if path else value)
+        elif value is not None:
+            self.add_line(f"{path}: {json.dumps(value)}" if path else json.dumps(value))
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+class XmlExtractor(TextBudget):
+    # XML feeds and documents are flattened to 'parent.element: text' lines as they stream in.
+    # HTML inside RSS/Atom descriptions is reduced to its text; link-like elements without
+    # text contribute their href/url attribute
+    raw = True
+
+    def __init__(self, max_chars=None):
+        super().__init__(max_chars)
+        self.parser = XMLPullParser(events=('start', 'end'))
+        self.path = []
+        self.failed = False
+
+    def feed(self, data):
+        if self.failed:
+            return
+        try:
+            self.parser.feed(data)
+            self.read_events()
+        except ParseError as e:
+            print(f"Stopped reading malformed XML: {e}")
+            self.failed = True
+            self.done = True
+
+    def read_events(self):
+        for event, element in self.parser.read_events():
+            if event == 'start':
+                self.path.append(local_name(element.tag))
+                continue
+            text = ' '.join((element.text or '').split())
+            if '<' in text:
+                text = ' '.join(extract_html_text(text).split())
+            if not text and len(element) == 0:
+                text = element.get('href') or element.get('url') or ''
+            if text:
+                # The root element is left out: it is the same on every line
+                self.add_line(f"{'.'.join(self.path[1:][-XML_PATH_DEPTH:]) or self.path[-1]}: {text}")
+            self.path.pop()
+            element.clear()
+            if self.done:
+                return
+
+    def close(self):
+        if self.failed or self.done:
+            return
+        try:
+            self.parser.close()
+            self.read_events()
+        except ParseError:
+            pass  # A truncated document still keeps the lines read so far
+
+
+# Content stream parsing for PDFs. Streams are found as the body arrives, inflated and
+# scanned for text showing operators, so reading stops after PDF_MAX_PAGES pages without
+# downloading the rest of the file. This handles the common simple-font PDFs; when the
+# optional pypdf package is installed it is used instead for full font and layout support.
+# Font dictionaries, usually at the end of the file, are checked once it has been read:
+# ligature glyphs named in /Differences encodings are put back, and PDFs with Type0
+# Identity-H/V fonts, whose codes only map to text through a ToUnicode CMap, are refused.
+PDF_STREAM_RE = re.compile(rb'(?<![A-Za-z])stream\r?\n')
+PDF_SKIP_STREAM_KEYS = (
+    b'/Image', b'/FontFile', b'/Length1', b'/Length2', b'/XRef', b'/ObjStm', b'/Metadata', b'/EmbeddedFile',
+    b'/Type1C', b'/CIDFontType0C', b'/OpenType'
+)
+PDF_TEXT_OPERATOR_RE = re.compile(rb'\bBT\b[\s\S]*?(?:Tj|TJ|\'|")')
+PDF_IDENTITY_FONT_RE = re.compile(rb'/Encoding\s*/Identity-[HV]\b')
+PDF_DIFFERENCES_RE = re.compile(rb'/Differences\s*\[([^\]]*)\]')
+PDF_LIGATURES = {'ff': 'ff', 'fi': 'fi', 'fl': 'fl', 'ffi': 'ffi', 'ffl': 'ffl'}  # Glyph name -> text
+PDF_TOKEN_RE = re.compile(
+    rb'\((?:\\.|[^\\()]|\((?:\\.|[^\\()])*\))*\)'  # Literal string, one level of nested parentheses
+    rb'|<[0-9A-Fa-f\s]*>'  # Hex string
+    rb'|\[|\]'
+    rb'|[+-]?(?:\d+\.?\d*|\.\d+)'  # Number
+    rb'|/[^\s/\[\]()<>{}%]*'  # Name
+    rb'|[A-Za-z\'"*]+',  # Operator
+    re.S
+)
+PDF_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+PDF_ESCAPE_RE = re.compile(rb'\\([0-7]{1,3}|\r\n|.)', re.S)
+
+
+def pdf_string(token):
+    # Decode a literal or hex string token to text
+    if token.startswith(b'<'):
+        digits = re.sub(rb'\s', b'', token[1:-1]).decode('ascii')
+        data = bytes.fromhex(digits + '0' * (len(digits) % 2))
+        if data.startswith(b'\xfe\xff') or (len(data) >= 2 and len(data) % 2 == 0 and data[0::2].count(0) > len(data) // 4):
+            return data.decode('utf-16-be', errors='ignore').lstrip('\ufeff')
+        return data.decode('latin-1')
+
+    def unescape(match):
+        escape = match.group(1)
+        if escape[:1].isdigit():
+            return bytes([int(escape, 8) & 0xff])
+        if escape in (b'\n', b'\r', b'\r\n'):
+            return b''  # Line continuation
+        return PDF_ESCAPES.get(escape, escape)
+
+    return PDF_ESCAPE_RE.sub(unescape, token[1:-1]).decode('latin-1')
+
+
+def pdf_content_text(content):
+    # Text shown by Tj, TJ, ' and " operators, with line breaks where the text position moves down
+    lines = []
+    line = []
+    operands = []
+    last_y = None
+    for match in PDF_TOKEN_RE.finditer(content):
+        token = match.group()
+        first = token[:1]
+        if first in b'(<[]/' or first.isdigit() or first in b'+-.':
+            operands.append(token)
+            continue
+        operator = token
+        if operator in (b'Tj', b"'", b'"'):
+            strings = [operand for operand in operands if operand[:1] in b'(<']
+            if operator != b'Tj':
+                lines.append(''.join(line))
+                line = []
+            if strings:
+                line.append(pdf_string(strings[-1]))
+        elif operator == b'TJ':
+            for operand in operands:
+                if operand[:1] in b'(<':
+                    line.append(pdf_string(operand))
+                elif operand[:1] not in b'[]/':
+                    try:
+                        if float(operand) < -200:  # Wide negative kerning separates words
+                            line.append(' ')
+                    except ValueError:
+                        pass
+        elif operator in (b'Td', b'TD') and len(operands) >= 2:
+            try:
+                moved_down = float(operands[-1]) != 0
+            except ValueError:
+                moved_down = True
+            if moved_down:
+                lines.append(''.join(line))
+                line = []
+            elif line:
+                line.append(' ')
+        elif operator == b'Tm' and len(operands) >= 6:
+            y = operands[-1]
+            if last_y is not None and y != last_y:
+                lines.append(''.join(line))
+                line = []
+            elif line:
+                line.append(' ')
+            last_y = y
+        elif operator == b'T*':
+            lines.append(''.join(line))
+            line = []
+        operands = []
+    lines.append(''.join(line))
+    cleaned = []
+    for text in lines:
+        # Control characters are kept for now: fonts may name them as ligature glyphs
+        text = ' '.join(''.join(ch for ch in text if ch.isprintable() or ord(ch) < 0xa0).split())
+        if text:
+            cleaned.append(text)
+    return '\n'.join(cleaned)
+
+
+def pdf_ligature_codes(data):
+    # Character codes that /Differences encodings name as ligature glyphs, e.g. [2/fi/fl 33/exclam]
+    codes = {}
+    for match in PDF_DIFFERENCES_RE.finditer(data):
+        code = 0
+        for token in re.findall(rb'\d+|/[^\s/\[\]]+', match.group(1)):
+            if token[:1] != b'/':
+                code = int(token)
+                continue
+            name = token[1:].decode('latin-1')
+            if name in PDF_LIGATURES and not chr(code).isprintable() and not chr(code).isspace():
+                codes[code] = PDF_LIGATURES[name]  # Printable codes are ordinary text in other fonts
+            code += 1
+    return codes
+
+
+class PdfTextExtractor(TextBudget):
+    # Each content stream with text counts as a page; pages are separated by blank lines
+    raw = True
+
+    def __init__(self, max_chars=None):
+        super().__init__(max_chars)
+        self.buffer = bytearray()
+        self.position = 0  # Start of the part of the buffer not yet scanned for streams
+        self.pages = 0
+        self.use_pypdf = pypdf_available()
+        self.identity_fonts = False  # A Type0 font with Identity-H/V encoding was seen
+        self.ligatures = {}  # Character code -> ligature text
+
+    def feed(self, data):
+        self.buffer += data
+        if self.bytes_read >= PDF_MAX_BYTES:
+            print(f"PDF larger than {PDF_MAX_BYTES} bytes, reading only the start")
+            self.truncated = True
+            self.done = True
+        if not self.use_pypdf:
+            self.scan()
+
+    def scan(self):
+        while not self.done:
+            match = PDF_STREAM_RE.search(self.buffer, self.position)
+            if match is None:
+                return
+            end = self.buffer.find(b'endstream', match.end())
+            if end < 0:
+                return  # The rest of this stream has not arrived yet
+            dictionary = bytes(self.buffer[max(self.position, self.buffer.rfind(b'obj', self.position, match.start())):match.start()])
+            self.add_fonts(bytes(self.buffer[self.position:match.start()]))
+            data = bytes(self.buffer[match.end():end])
+            # Drop what has been scanned; the builtin parser never looks back
+            del self.buffer[:end + len(b'endstream')]
+            self.position = 0
+            self.add_stream(dictionary, data)
+
+    def add_fonts(self, data):
+        # Font dictionaries from plain objects or inflated object streams
+        self.identity_fonts = self.identity_fonts or bool(PDF_IDENTITY_FONT_RE.search(data))
+        self.ligatures.update(pdf_ligature_codes(data))
+
+    def add_stream(self, dictionary, data):
+        if b'/ObjStm' in dictionary and b'/FlateDecode' in dictionary:
+            try:
+                self.add_fonts(zlib.decompressobj().decompress(data, PDF_MAX_STREAM_BYTES))
+            except zlib.error:
+                pass
+            return
+        if any(key in dictionary for key in PDF_SKIP_STREAM_KEYS):
+            return
+        if b'/Filter' in dictionary:
+            filters = re.findall(rb'/(\w+)', dictionary[dictionary.find(b'/Filter') + len(b'/Filter'):])
+            if not filters or filters[0] not in (b'FlateDecode', b'Fl'):
+                return  # Content streams are almost always Flate; other encodings are skipped
+            try:
+                data = zlib.decompressobj().decompress(data, PDF_MAX_STREAM_BYTES)
+            except zlib.error:
+                return
+        if not PDF_TEXT_OPERATOR_RE.search(data):
+            return  # Images, fonts and other binary streams that slipped past the dictionary check
+        self.add_page(pdf_content_text(data))
+
+    def add_page(self, text):
+        if not text:
+            return
+        if self.chunks:
+            self.add_line('')
+        for line in text.split('\n'):
+            self.add_line(line)
+        self.pages += 1
+        if self.pages >= PDF_MAX_PAGES and not self.done:
+            self.truncated = True
+            self.done = True
+
+    def close(self):
+        if self.use_pypdf and self.buffer:
+            if self.extract_with_pypdf():
+                return
+            self.use_pypdf = False
+            self.done = False
+            self.scan()
+        self.add_fonts(bytes(self.buffer[self.position:]))
+        self.buffer = bytearray()
+        if self.identity_fonts:
+            raise UnsupportedContent("PDF text is not extractable: it uses Type0 fonts with Identity-H/V encoding, "
+                                     "which need a ToUnicode CMap that only pypdf can apply")
+        self.restore_ligatures()
+
+    def restore_ligatures(self):
+        # Put back the ligatures kept as control characters and drop the remaining ones
+        table = {code: self.ligatures.get(code) for code in range(0xa0)
+                 if not chr(code).isprintable() and not chr(code).isspace()}
+        text = '\n'.join(self.chunks).translate(table)
+        if self.max_chars is not None and len(text) > self.max_chars:
+            text = text[:self.max_chars]
+            self.truncated = True
+        self.chunks = text.split('\n') if text else []
+        self.size = len(text)
+
+    def extract_with_pypdf(self):
+        from pypdf import PdfReader
+        try:
+            reader = PdfReader(io.BytesIO(bytes(self.buffer)))
+            for page in reader.pages[:PDF_MAX_PAGES]:
+                self.add_page('\n'.join(' '.join(line.split()) for line in (page.extract_text() or '').splitlines() if line.strip()))
+                if self.done:
+                    break
+            if len(reader.pages) > PDF_MAX_PAGES:
+                self.truncated = True
+            return True
+        except Exception as e:
+            print(f"pypdf could not read the PDF, falling back to the builtin parser: {e}")
+            self.chunks, self.size, self.pages = [], 0, 0
+            return False
+
+
+_pypdf_available = None
+
+
+def pypdf_available():
+    # pypdf is optional and not part of the Lambda layer
+    global _pypdf_available
+    if _pypdf_available is None:
+        try:
+            import pypdf  # noqa: F401
+            _pypdf_available = True
+        except ImportError:
+            _pypdf_available = False
+    return _pypdf_available
+
+
+DOCUMENT_EXTRACTORS = {KIND_TEXT: PlainTextExtractor, KIND_JSON: JsonExtractor, KIND_XML: XmlExtractor, KIND_PDF: PdfTextExtractor}
+
+
+def text_encoding(response):
+    # Plain text without a charset is read as UTF-8, not the ISO-8859-1 HTTP default requests assumes
+    if 'charset=' in response.headers.get('Content-Type', '').lower():
+        return response_encoding(response)
+    return 'utf-8'
+
+
+def extract_document(response, max_chars=None, deadline=None, mode=MODE_FULL, chunk_size=CHUNK_SIZE,
+                     output_format=FORMAT_TEXT):
+    """Stream a response (fetched with stream=True) through the extractor for its content type.
+    Returns the extractor, with its kind set; raises UnsupportedContent for binary files.
+    output_format only changes HTML output; other documents are already plain lines.
+    """
+    content_type = response.headers.get('Content-Type', '')
+    declared = declared_kind(content_type)
+    if declared == KIND_BINARY:
+        # Refused from the headers alone, so none of the body is downloaded
+        response.close()
+        raise UnsupportedContent(f"Unsupported content type {content_type}")
+
+    chunks = response.iter_content(chunk_size=chunk_size)
+    try:
+        first_chunk = next(chunks, b'')
+        kind = sniff_kind(first_chunk, declared)
+        if kind == KIND_BINARY:
+            raise UnsupportedContent(f"Binary content ({content_type or 'no content type'}) is not supported")
+        if kind == KIND_HTML:
+            extractor = make_extractor(mode, max_chars, output_format, response.url)
+        else:
+            extractor = DOCUMENT_EXTRACTORS[kind](max_chars)
+        extractor.kind = kind
+        raw = getattr(extractor, 'raw', False)
+        encoding = text_encoding(response) if kind == KIND_TEXT else response_encoding(response)
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+
+        def feed(chunk, final=False):
+            extractor.bytes_read += len(chunk)
+            parse_start = time.monotonic()
+            extractor.feed(chunk if raw else decoder.decode(chunk, final=final))
+            extractor.parse_seconds += time.monotonic() - parse_start
+
+        feed(first_chunk, final=not first_chunk)
+        if first_chunk and not extractor.done:
+            for chunk in chunks:
+                feed(chunk)
+                if extractor.done:
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    extractor.timed_out = True
+                    break
+            else:
+                feed(b'', final=True)
+    finally:
+        # Closing a partially read response drops the connection instead of draining the body
+        response.close()
+    parse_start = time.monotonic()
+    extractor.close()
+    extractor.parse_seconds += time.monotonic() - parse_start
+    return extractor
@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urljoin, urlparse
+
+# Shared HTTP client for the webscrape and internet search Lambdas.
+# The session lives at module level so pooled keep-alive connections
+# survive between warm invocations of the same Lambda container.
+# requests is imported on first use, so cold starts that never fetch
+# (e.g. an unrecognized api path) do not pay for loading it.
+
+CONNECT_TIMEOUT = float(os.environ.get('FETCH_CONNECT_TIMEOUT', '3.05'))
+READ_TIMEOUT = float(os.environ.get('FETCH_READ_TIMEOUT', '10'))
+POOL_HOSTS = int(os.environ.get('FETCH_POOL_HOSTS', '32'))  # Number of hosts kept in the pool
+POOL_PER_HOST = int(os.environ.get('FETCH_POOL_PER_HOST', '4'))  # Keep-alive connections per host
+MAX_RETRIES = int(os.environ.get('FETCH_MAX_RETRIES', '2'))
+BACKOFF_FACTOR = float(os.environ.get('FETCH_BACKOFF_FACTOR', '0.3'))
+BACKOFF_JITTER = float(os.environ.get('FETCH_BACKOFF_JITTER', '0.3'))
+RETRY_STATUSES = (500, 502, 504)  # 429/503 come back to politeness.polite_fetch, which honors Retry-After
+PER_HOST_LIMIT = int(os.environ.get('PER_HOST_LIMIT', '2'))  # Concurrent fetches per host within a container
+USER_AGENT = os.environ.get('FETCH_USER_AGENT', 'Mozilla/5.0 (compatible; BedrockAgentWebscraper/1.0)')
+
+# Redirect policy applied by fetch_following
+MAX_REDIRECTS = int(os.environ.get('FETCH_MAX_REDIRECTS', '5'))
+REDIRECT_ALLOWED_SCHEMES = tuple(os.environ.get('REDIRECT_ALLOWED_SCHEMES', 'http,https').split(','))
+# Comma separated host suffixes redirects may lead to, e.g. "example.com,example.org"; empty allows any host
+REDIRECT_ALLOWED_HOSTS = tuple(filter(None, os.environ.get('REDIRECT_ALLOWED_HOSTS', '').lower().split(',')))
+REDIRECT_ALLOW_DOWNGRADE = os.environ.get('REDIRECT_ALLOW_DOWNGRADE', 'false').lower() == 'true'  # https -> http
+# Requested URL -> final URL after redirects, so repeat requests go straight to the canonical page
+CANONICAL_CACHE_TTL_SECONDS = int(os.environ.get('CANONICAL_CACHE_TTL_SECONDS', '3600'))
+CANONICAL_CACHE_MAX_ENTRIES = int(os.environ.get('CANONICAL_CACHE_MAX_ENTRIES', '1024'))
+# Hosts that failed over https are fetched over http for this long
+HTTP_ONLY_TTL_SECONDS = int(os.environ.get('HTTP_ONLY_TTL_SECONDS', '86400'))
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+_session = None
+_session_lock = threading.Lock()
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+_canonical_urls = OrderedDict()  # requested URL -> (recorded_at, final URL)
+_http_only_hosts = {}  # host -> recorded_at
+_url_state_lock = threading.Lock()
+
+
+class RedirectError(Exception):
+    pass
+
+
+def build_session():
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=MAX_RETRIES,
+        status=MAX_RETRIES,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        backoff_factor=BACKOFF_FACTOR,
+        backoff_jitter=BACKOFF_JITTER,
+        respect_retry_after_header=False,  # An uncapped Retry-After sleep could outlast the invocation
+        raise_on_status=False  # Hand the final 5xx response back instead of raising
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_PER_HOST, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update({'User-Agent': USER_AGENT})
+    return session
+
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def fetch(url, stream=False, headers=None, timeout=None):
+    # GET a URL through the pooled session with bounded connect/read timeouts
+    return get_session().get(
+        url,
+        stream=stream,
+        headers=headers,
+        timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT)
+    )
+
+
+def get_host_semaphore(url):
+    # Caps how many fetches run against the same host at once
+    host = urlparse(url).netloc.lower()
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(PER_HOST_LIMIT)
+        return _host_semaphores[host]
+
+
+def redirect_allowed(from_url, to_url):
+    # Returns None if the redirect may be followed, otherwise the reason it may not
+    source, target = urlparse(from_url), urlparse(to_url)
+    if target.scheme not in REDIRECT_ALLOWED_SCHEMES:
+        return f"scheme {target.scheme or '(none)'} is not allowed"
+    if source.scheme == 'https' and target.scheme == 'http' and not REDIRECT_ALLOW_DOWNGRADE:
+        return "redirect from https to http"
+    host = (target.hostname or '').lower()
+    if REDIRECT_ALLOWED_HOSTS and not any(host == allowed or host.endswith('.' + allowed)
+                                          for allowed in REDIRECT_ALLOWED_HOSTS):
+        return f"host {host} is not in the allow-list"
+    return None
+
+
+def canonical_url(url):
+    # The final URL a previous fetch of this URL was redirected to, or the URL itself
+    with _url_state_lock:
+        found = _canonical_urls.get(url)
+        if found is None:
+            return url
+        if time.time() - found[0] >= CANONICAL_CACHE_TTL_SECONDS:
+            del _canonical_urls[url]
+            return url
+        return found[1]
+
+
+def remember_canonical(url, final_url):
+    with _url_state_lock:
+        _canonical_urls[url] = (time.time(), final_url)
+        _canonical_urls.move_to_end(url)
+        while len(_canonical_urls) > CANONICAL_CACHE_MAX_ENTRIES:
+            _canonical_urls.popitem(last=False)
+
+
+def preferred_scheme(bare_url):
+    # Bare hosts are tried over https unless they recently failed over https
+    host = (urlparse('//' + bare_url).hostname or '').lower()
+    with _url_state_lock:
+        recorded_at = _http_only_hosts.get(host)
+    if recorded_at is not None and time.time() - recorded_at < HTTP_ONLY_TTL_SECONDS:
+        return 'http://'
+    return 'https://'
+
+
+def fetch_following(url, stream=False, headers=None, timeout=None, https_fallback=False,
+                    max_redirects=MAX_REDIRECTS, before_redirect=None):
+    """GET a URL, following redirects allowed by the redirect policy.
+    The returned response's url is the final URL and its history holds the redirect responses.
+    headers are only sent with the first request, since conditional headers belong to that URL.
+    With https_fallback, an https URL that cannot be connected to is retried over http and the
+    host is remembered as http only. before_redirect, if given, is called with each redirect
+    target before it is requested. Raises RedirectError if a redirect is not allowed.
+    """
+    from requests.exceptions import ConnectionError as RequestsConnectionError
+
+    requested_url = url
+    try:
+        response = get_session().get(url, stream=stream, headers=headers, allow_redirects=False,
+                                     timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT))
+    except RequestsConnectionError:
+        parsed = urlparse(url)
+        if not (https_fallback and parsed.scheme == 'https'):
+            raise
+        print(f"https connection to {parsed.hostname} failed, retrying over http")
+        with _url_state_lock:
+            _http_only_hosts[(parsed.hostname or '').lower()] = time.time()
+        url = 'http://' + url[len('https://'):]
+        response = get_session().get(url, stream=stream, headers=headers, allow_redirects=False,
+                                     timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT))
+
+    history = []
+    while response.status_code in REDIRECT_STATUSES and response.headers.get('location'):
+        target = urljoin(response.url, response.headers['location'])
+        response.close()
+        history.append(response)
+        if len(history) > max_redirects:
+            raise RedirectError(f"More than {max_redirects} redirects from {url}")
+        reason = redirect_allowed(response.url, target)
+        if reason:
+            raise RedirectError(f"Redirect from {response.url} to {target} refused: {reason}")
+        if before_redirect is not None:
+            before_redirect(target)
+        response = get_session().get(target, stream=stream, allow_redirects=False,
+                                     timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT))
+    response.history = history
+    if response.url != requested_url:
+        remember_canonical(requested_url, response.url)
+    return response
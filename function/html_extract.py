@@ -0,0 +1,825 @@
+import codecs
+import json
+import os
+import re
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+from budget import truncate
+
+# Streaming HTML to text extraction shared by the webscrape and internet search Lambdas.
+# The response body is fed through an incremental parser chunk by chunk; script, style and
+# navigation subtrees are dropped as they arrive and reading stops once the output budget is
+# reached, so large pages are never fully downloaded or held in memory as a tree.
+
+SKIP_TAGS = frozenset(['script', 'style', 'nav', 'template', 'svg', 'canvas'])
+CHUNK_SIZE = 16384
+
+# Extraction modes selectable by the agent
+MODE_FULL = 'full'  # Every text node on the page
+MODE_MAIN = 'main'  # Main content blocks only, with navigation and boilerplate removed
+MODES = (MODE_FULL, MODE_MAIN)
+
+# Output formats selectable by the agent
+FORMAT_TEXT = 'text'  # Plain text lines
+FORMAT_MARKDOWN = 'markdown'  # Compact Markdown keeping headings, lists, tables and link targets
+FORMATS = (FORMAT_TEXT, FORMAT_MARKDOWN)
+
+# Block-level elements that start a new text block in main content mode
+BLOCK_TAGS = frozenset([
+    'address', 'article', 'aside', 'blockquote', 'body', 'dd', 'details', 'div', 'dl', 'dt',
+    'figcaption', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'li', 'main',
+    'ol', 'p', 'pre', 'section', 'summary', 'table', 'td', 'th', 'tr', 'ul'
+])
+VOID_TAGS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'])
+HEADING_TAGS = frozenset(['h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+BOILERPLATE_TAGS = frozenset(['header', 'footer', 'aside', 'form'])
+BOILERPLATE_HINTS = frozenset([  # Whole id, class or role tokens marking a boilerplate container
+    'banner', 'breadcrumb', 'cookie', 'comment', 'consent', 'footer', 'header', 'menu', 'newsletter',
+    'popup', 'promo', 'related', 'share', 'sidebar', 'social', 'subscribe', 'toolbar'
+])
+PAGE_TAGS = frozenset(['html', 'body'])  # Hold the whole page, so never boilerplate whatever their class
+LINE_BREAK = '\x00'  # Stands in for <br> until whitespace has been collapsed
+IGNORED_LINK_PREFIXES = ('#', 'javascript:', 'data:')
+MAX_TABLE_CELL_CHARS = 300  # Tables with longer cells are page layout, not data, and become paragraphs
+LINK_REFERENCE_PATTERN = re.compile(r'^\[(\d+)\]: (\S+)$')
+LINK_USE_PATTERN = re.compile(r'\]\[(\d+)\]')
+PARTIAL_LINK_PATTERN = re.compile(r'(?<!\])\[[^\[\]]*(?:\](?:\[\d*)?)?$')  # A link cut off at the end of text
+MIN_BLOCK_WORDS = 10  # Blocks with fewer words are kept only next to a content block
+MAX_LINK_DENSITY = 0.33  # Share of a block's text that may sit inside links
+
+# Embedded data fallback for pages rendered by JavaScript, whose visible text is a near empty shell
+EMBEDDED_FALLBACK_MIN_CHARS = int(os.environ.get('EMBEDDED_FALLBACK_MIN_CHARS', '500'))  # Shorter visible text gets the fallback
+EMBEDDED_MAX_CHARS = int(os.environ.get('EMBEDDED_MAX_CHARS', str(2 * 1024 * 1024)))  # Script text kept per page
+EMBEDDED_TAGS = frozenset(['meta', 'script', 'noscript'])
+META_FIELDS = (  # (label, meta name or property), in output order
+    ('Title', 'og:title'), ('Title', 'twitter:title'), ('Description', 'description'),
+    ('Description', 'og:description'), ('Description', 'twitter:description'), ('Site', 'og:site_name'),
+    ('Author', 'author'), ('Published', 'article:published_time')
+)
+JSON_SCRIPT_TYPES = frozenset(['application/json', 'application/ld+json'])
+JAVASCRIPT_TYPES = frozenset(['', 'text/javascript', 'application/javascript', 'module'])
+# State handed from the server to the client bundle, e.g. window.__INITIAL_STATE__ = {...}
+STATE_ASSIGNMENT_PATTERN = re.compile(r'__[A-Z][A-Z0-9_]*__\s*=\s*(?=[{\[])')
+STATE_MIN_WORDS = 4  # Shorter strings in hydration data are ids, labels and class names rather than content
+HTML_TAG_PATTERN = re.compile(r'<[a-zA-Z/][^>]*>')
+HTML_BLOCK_START_PATTERN = re.compile(r'<(?=/?(?:%s|br)\b)' % '|'.join(sorted(BLOCK_TAGS)), re.I)
+NOSCRIPT_NOTICE_PATTERN = re.compile(r'enable javascript|javascript (?:is )?(?:disabled|required)', re.I)
+
+
+class EmbeddedData:
+    # Content a page carries outside its visible markup: meta descriptions, JSON-LD, hydration
+    # state of single page apps (__NEXT_DATA__ and window.__STATE__ = {...} scripts) and
+    # <noscript> text. Script text is only kept during the parse; it is decoded by blocks(),
+    # which the extractors call when the visible text came out too short.
+
+    def __init__(self):
+        self.meta = {}
+        self.scripts = []  # (type, text)
+        self.noscript = []
+        self.noscript_depth = 0
+        self.script_type = None  # Type of the script being kept, None when not keeping one
+        self.script_pieces = []
+        self.chars = 0
+
+    @property
+    def capturing(self):
+        return self.script_type is not None or self.noscript_depth > 0
+
+    def starttag(self, tag, attrs):
+        attributes = dict(attrs)
+        if tag == 'meta':
+            field = (attributes.get('property') or attributes.get('name') or '').lower()
+            content = ' '.join((attributes.get('content') or '').split())
+            if content and field not in self.meta:
+                self.meta[field] = content
+        elif tag == 'script':
+            script_type = (attributes.get('type') or '').split(';')[0].strip().lower()
+            if attributes.get('src') is None and self.chars < EMBEDDED_MAX_CHARS and (
+                    script_type in JSON_SCRIPT_TYPES or script_type in JAVASCRIPT_TYPES):
+                self.script_type = script_type
+                self.script_pieces = []
+        elif tag == 'noscript':
+            self.noscript_depth += 1
+
+    def endtag(self, tag):
+        if tag == 'script' and self.script_type is not None:
+            self.scripts.append((self.script_type, ''.join(self.script_pieces)))
+            self.script_type = None
+            self.script_pieces = []
+        elif tag == 'noscript' and self.noscript_depth:
+            self.noscript_depth -= 1
+
+    def data(self, data):
+        if self.script_type is not None:
+            if self.chars < EMBEDDED_MAX_CHARS:
+                self.script_pieces.append(data[:EMBEDDED_MAX_CHARS - self.chars])
+                self.chars += len(data)
+        elif self.noscript_depth:
+            self.noscript.append(data)
+
+    def blocks(self):
+        # Text blocks in order of usefulness: meta fields, JSON-LD, noscript, hydration state
+        meta = []
+        for label, field in META_FIELDS:
+            line = f"{label}: {self.meta[field]}" if field in self.meta else None
+            if line and line not in meta:
+                meta.append(line)
+        blocks = ['\n'.join(meta)] if meta else []
+        seen = set(self.meta.values())  # Text already added, often repeated between the sources
+        states = []
+        for script_type, text in self.scripts:
+            if script_type == 'application/ld+json':
+                for document in decode_json(text):
+                    lines = []
+                    flatten_linked_data(document, '', lines, seen)
+                    if lines:
+                        blocks.append('\n'.join(lines))
+            elif script_type == 'application/json':
+                states.extend(decode_json(text))
+            else:
+                states.extend(decode_json(text, STATE_ASSIGNMENT_PATTERN))
+        noscript = ' '.join(''.join(self.noscript).split())
+        if noscript and not NOSCRIPT_NOTICE_PATTERN.search(noscript):
+            blocks.append(noscript)
+        for state in states:
+            collect_state_text(state, blocks, seen)
+        return blocks
+
+
+def decode_json(text, pattern=None):
+    # JSON documents in a script: the whole text, or the values assigned where pattern matches
+    if pattern is None:
+        try:
+            return [json.loads(text)]
+        except ValueError:
+            return []
+    documents = []
+    decoder = json.JSONDecoder()
+    for match in pattern.finditer(text):
+        try:
+            documents.append(decoder.raw_decode(text, match.end())[0])
+        except ValueError:
+            continue  # A JavaScript object literal rather than JSON
+    return documents
+
+
+def embedded_text(value):
+    # One string value as plain lines, with any HTML markup in it extracted a block per line
+    if HTML_TAG_PATTERN.search(value):
+        value = extract_html_text(HTML_BLOCK_START_PATTERN.sub('\n<', value))
+    lines = (' '.join(line.split()) for line in value.split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+def flatten_linked_data(value, path, lines, seen):
+    # JSON-LD as 'path: value' lines; list indexes, @ keywords (@context, @id, @type), URLs and
+    # repeated values are left out
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if not key.startswith('@'):
+                flatten_linked_data(item, f"{path}.{key}" if path else key, lines, seen)
+    elif isinstance(value, list):
+        for item in value:
+            flatten_linked_data(item, path, lines, seen)
+    elif isinstance(value, str):
+        if not value.startswith(('http://', 'https://')) and value not in seen:
+            seen.add(value)
+            text = embedded_text(value).replace('\n', ' ')
+            if text:
+                lines.append(f"{path}: {text}" if path else text)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        lines.append(f"{path}: {value}")
+
+
+def collect_state_text(value, blocks, seen):
+    # Hydration state is mostly ids, flags and URLs; only strings that read as prose are kept
+    if isinstance(value, dict):
+        for item in value.values():
+            collect_state_text(item, blocks, seen)
+    elif isinstance(value, list):
+        for item in value:
+            collect_state_text(item, blocks, seen)
+    elif isinstance(value, str) and len(value.split()) >= STATE_MIN_WORDS and value not in seen:
+        seen.add(value)
+        text = embedded_text(value)
+        if text:
+            blocks.append(text)
+
+
+def embedded_fallback(embedded, visible, max_chars=None, separator='\n'):
+    """Blocks of a page's embedded data to add after visible text shorter than
+    EMBEDDED_FALLBACK_MIN_CHARS, leaving out those already in it and stopping at max_chars.
+    """
+    if len(visible) >= EMBEDDED_FALLBACK_MIN_CHARS:
+        return []
+    added = []
+    size = len(visible)
+    for block in embedded.blocks():
+        if block in visible:
+            continue
+        extra = (len(separator) if size else 0) + len(block)
+        if max_chars is not None and size + extra > max_chars:
+            remaining = max_chars - size - (len(separator) if size else 0)
+            if remaining > 0:
+                added.append(block[:remaining])
+            break
+        added.append(block)
+        size += extra
+    return added
+
+
+def is_boilerplate(tag, attrs):
+    # Header/footer/sidebar containers, by tag or by a whole id, class or role token: class="sidebar"
+    # matches, class="sidebar-visible" (set on <html> by mdBook) does not
+    if tag in PAGE_TAGS:
+        return False
+    if tag in BOILERPLATE_TAGS:
+        return True
+    attributes = dict(attrs)
+    tokens = f"{attributes.get('id') or ''} {attributes.get('class') or ''} {attributes.get('role') or ''}".lower().split()
+    return any(token in BOILERPLATE_HINTS for token in tokens)
+
+
+class StreamingTextExtractor(HTMLParser):
+    # Produces the same line cleanup as the original BeautifulSoup get_text() path:
+    # lines are stripped, split on double spaces and blank pieces are dropped.
+
+    def __init__(self, max_chars=None):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.skip_depth = 0
+        self.pending = []  # Text of the current, not yet complete, line
+        self.chunks = []
+        self.size = 0  # Characters in the joined output so far
+        self.done = False
+        self.truncated = False
+        self.bytes_read = 0
+        self.timed_out = False
+        self.parse_seconds = 0.0  # Time spent in the parser, excluding the download
+        self.embedded = EmbeddedData()
+        self.fallback = []  # Embedded data blocks added by close()
+
+    def handle_starttag(self, tag, attrs):
+        # Once the text is long enough the fallback cannot apply, so scripts are no longer kept
+        if tag in EMBEDDED_TAGS and self.size < EMBEDDED_FALLBACK_MIN_CHARS:
+            self.embedded.starttag(tag, attrs)
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        # Self-closing tags never open a skipped subtree
+        if tag in EMBEDDED_TAGS:
+            self.embedded.starttag(tag, attrs)
+            self.embedded.endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in EMBEDDED_TAGS:
+            self.embedded.endtag(tag)
+        if tag in SKIP_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+    def handle_data(self, data):
+        if self.embedded.capturing:
+            self.embedded.data(data)
+        if self.skip_depth or self.done:
+            return
+        if '\n' not in data:
+            self.pending.append(data)
+            return
+        lines = data.split('\n')
+        self.pending.append(lines[0])
+        self.flush_line(''.join(self.pending))
+        for line in lines[1:-1]:
+            self.flush_line(line)
+        self.pending = [lines[-1]]
+
+    def flush_line(self, line):
+        for phrase in line.strip().split('  '):
+            phrase = phrase.strip()
+            if phrase and not self.done:
+                self.add_chunk(phrase)
+
+    def add_chunk(self, phrase):
+        separator = 1 if self.chunks else 0
+        if self.max_chars is not None and self.size + separator + len(phrase) > self.max_chars:
+            remaining = self.max_chars - self.size - separator
+            if remaining > 0:
+                self.chunks.append(phrase[:remaining])
+                self.size = self.max_chars
+            self.truncated = True
+            self.done = True
+            return
+        self.chunks.append(phrase)
+        self.size += separator + len(phrase)
+
+    def close(self):
+        super().close()
+        if self.pending and not self.done:
+            self.flush_line(''.join(self.pending))
+        self.pending = []
+        if self.size < EMBEDDED_FALLBACK_MIN_CHARS:
+            self.fallback = embedded_fallback(self.embedded, '\n'.join(self.chunks), self.max_chars)
+
+    def text(self):
+        return '\n'.join(self.chunks + self.fallback)
+
+
+class MainContentExtractor(HTMLParser):
+    # Splits the page into text blocks and keeps those that look like main content: long,
+    # low link density blocks outside header/footer/sidebar containers, plus short blocks such
+    # as headings that sit directly next to one. Kept blocks are joined by blank lines. When
+    # nothing is kept, even from embedded data, every block is returned rather than nothing.
+
+    def __init__(self, max_chars=None):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.skip_depth = 0
+        self.stack = []  # (tag, is_boilerplate) for open elements
+        self.link_depth = 0
+        self.pieces = []
+        self.link_chars = 0
+        self.blocks = []  # (text, link_density, is_boilerplate, is_heading)
+        self.size = 0
+        self.candidate_size = 0  # Characters in blocks kept_blocks() may keep, at most the kept text
+        self.done = False
+        self.truncated = False
+        self.bytes_read = 0
+        self.timed_out = False
+        self.parse_seconds = 0.0  # Time spent in the parser, excluding the download
+        self.embedded = EmbeddedData()
+        self.fallback = []  # Embedded data blocks added by close()
+        self.whole_page = False  # Set by close() when no block looked like main content
+
+    def in_boilerplate(self):
+        return any(flag for _, flag in self.stack)
+
+    def handle_starttag(self, tag, attrs):
+        # Once enough text may be kept the fallback cannot apply, so scripts are no longer kept
+        if tag in EMBEDDED_TAGS and self.candidate_size < EMBEDDED_FALLBACK_MIN_CHARS:
+            self.embedded.starttag(tag, attrs)
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+            return
+        if tag in BLOCK_TAGS:
+            self.flush_block()
+        if tag == 'a':
+            self.link_depth += 1
+        if tag in VOID_TAGS:
+            return
+        self.stack.append((tag, is_boilerplate(tag, attrs)))
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in EMBEDDED_TAGS:
+            self.embedded.starttag(tag, attrs)
+            self.embedded.endtag(tag)
+        if tag in BLOCK_TAGS:
+            self.flush_block()
+
+    def handle_endtag(self, tag):
+        if tag in EMBEDDED_TAGS:
+            self.embedded.endtag(tag)
+        if tag in SKIP_TAGS:
+            if self.skip_depth:
+                self.skip_depth -= 1
+            return
+        if tag == 'a' and self.link_depth:
+            self.link_depth -= 1
+        if tag in BLOCK_TAGS:
+            self.flush_block()
+        # Pop back to the matching element, tolerating unclosed tags such as <p> and <li>
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index][0] == tag:
+                del self.stack[index:]
+                break
+
+    def handle_data(self, data):
+        if self.embedded.capturing:
+            self.embedded.data(data)
+        if self.skip_depth or self.done:
+            return
+        self.pieces.append(data)
+        if self.link_depth:
+            self.link_chars += len(data.strip())
+
+    def flush_block(self):
+        if not self.pieces:
+            return
+        text = ' '.join(''.join(self.pieces).split())
+        link_chars = self.link_chars
+        self.pieces = []
+        self.link_chars = 0
+        if not text or self.done:
+            return
+        heading = bool(self.stack) and self.stack[-1][0] in HEADING_TAGS
+        link_density = min(1.0, link_chars / len(text))
+        boilerplate = self.in_boilerplate()
+        self.blocks.append((text, link_density, boilerplate, heading))
+        self.size += len(text) + 2
+        if not boilerplate and link_density <= MAX_LINK_DENSITY:
+            self.candidate_size += len(text) + 2
+        if self.max_chars is not None and self.size >= self.max_chars:
+            self.truncated = True
+            self.done = True
+
+    def close(self):
+        super().close()
+        self.flush_block()
+        # Boilerplate counts towards size but is dropped; embedded_fallback tests the kept text
+        if self.candidate_size < EMBEDDED_FALLBACK_MIN_CHARS:
+            self.fallback = embedded_fallback(self.embedded, '\n\n'.join(self.kept_blocks()), self.max_chars, '\n\n')
+        self.whole_page = not self.fallback and not self.kept_blocks()
+
+    def kept_blocks(self):
+        good = [
+            not boilerplate and link_density <= MAX_LINK_DENSITY and len(text.split()) >= MIN_BLOCK_WORDS
+            for text, link_density, boilerplate, _ in self.blocks
+        ]
+        kept = []
+        for index, (text, link_density, boilerplate, heading) in enumerate(self.blocks):
+            if good[index]:
+                kept.append(text)
+            elif not boilerplate and link_density <= MAX_LINK_DENSITY:
+                # Short blocks (headings, captions, list items) survive next to real content
+                following = index + 1 < len(good) and good[index + 1]
+                preceding = index > 0 and good[index - 1]
+                if following or (preceding and not heading):
+                    kept.append(text)
+        return kept
+
+    def text(self):
+        if self.whole_page:
+            return '\n\n'.join(text for text, _, _, _ in self.blocks)
+        return '\n\n'.join(self.kept_blocks() + self.fallback)
+
+
+class MarkdownExtractor(HTMLParser):
+    # Single pass HTML to compact Markdown: headings, nested lists, blockquotes, code blocks,
+    # pipe tables and reference-style links numbered once per distinct URL, with the link
+    # definitions collected at the end. Emphasis and images are dropped to save space. In
+    # main content mode header/footer/sidebar containers are skipped as MainContentExtractor does;
+    # until some content is kept the page is also read in full mode, whose output is used if
+    # main mode keeps nothing.
+
+    def __init__(self, max_chars=None, main=False, base_url=None):
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.main = main
+        self.base_url = base_url
+        self.skip_depth = 0
+        self.stack = []  # (tag, is_boilerplate) for open elements, main content mode only
+        self.inline = []  # Text of the block being read
+        self.blocks = []  # Emitted Markdown, separators included
+        self.last_kind = None
+        self.size = 0
+        self.done = False
+        self.truncated = False
+        self.bytes_read = 0
+        self.timed_out = False
+        self.parse_seconds = 0.0
+        self.heading = 0
+        self.lists = []  # [tag, items so far] for open lists
+        self.item_prefix = None  # List marker waiting for the item's first block
+        self.quote_depth = 0
+        self.pre_depth = 0
+        self.code_depth = 0
+        self.links = []  # (url, position in inline) for open links
+        self.references = {}  # url -> reference number
+        self.reference_chars = 0  # Size of the link definitions appended by text()
+        self.table = None  # Rows of cell texts of the outermost open table
+        self.table_depth = 0
+        self.in_cell = False
+        self.embedded = EmbeddedData()
+        self.fallback = []  # Embedded data blocks added by close()
+        self.full = MarkdownExtractor(max_chars, base_url=base_url) if main else None
+
+    def in_boilerplate(self):
+        return any(flag for _, flag in self.stack)
+
+    def feed(self, data):
+        super().feed(data)
+        if self.full is not None:
+            if self.blocks:
+                self.full = None  # Main content found, the whole page is no longer needed
+            elif not self.full.done:
+                self.full.feed(data)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in EMBEDDED_TAGS and self.size < EMBEDDED_FALLBACK_MIN_CHARS:
+            self.embedded.starttag(tag, attrs)
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+            return
+        if self.skip_depth or self.done:
+            return
+        if self.main and tag not in VOID_TAGS:
+            self.stack.append((tag, is_boilerplate(tag, attrs)))
+        if self.main and self.in_boilerplate():
+            return
+        if tag == 'br':
+            self.inline.append(LINE_BREAK)
+        elif tag == 'a':
+            self.links.append((dict(attrs).get('href'), len(self.inline)))
+        elif tag == 'code' and not self.pre_depth:
+            self.code_depth += 1
+            self.inline.append('`')
+        elif self.table is not None:
+            self.table_starttag(tag)
+        elif tag == 'table':
+            self.flush_block()
+            self.table = []
+            self.table_depth = 1
+        elif tag == 'pre':
+            self.flush_block()
+            self.pre_depth += 1
+        elif tag in HEADING_TAGS:
+            self.flush_block()
+            self.heading = int(tag[1])
+        elif tag in ('ul', 'ol'):
+            self.flush_block()
+            self.lists.append([tag, 0])
+        elif tag == 'li':
+            self.flush_block()
+            if self.lists:
+                self.lists[-1][1] += 1
+                kind, count = self.lists[-1]
+                self.item_prefix = '  ' * (len(self.lists) - 1) + ('- ' if kind == 'ul' else f"{count}. ")
+        elif tag == 'blockquote':
+            self.flush_block()
+            self.quote_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.flush_block()
+
+    def table_starttag(self, tag):
+        # Nested tables and block elements inside cells only separate words
+        if tag == 'table':
+            self.table_depth += 1
+        elif tag == 'tr' and self.table_depth == 1:
+            self.finish_cell()
+            self.table.append([])
+        elif tag in ('td', 'th') and self.table_depth == 1:
+            self.finish_cell()
+            if not self.table:
+                self.table.append([])
+            self.in_cell = True
+        elif tag in BLOCK_TAGS:
+            self.inline.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag in EMBEDDED_TAGS:
+            self.embedded.endtag(tag)
+        if tag in SKIP_TAGS:
+            if self.skip_depth:
+                self.skip_depth -= 1
+            return
+        if self.skip_depth or self.done:
+            return
+        if self.main:
+            boilerplate = self.in_boilerplate()
+            for index in range(len(self.stack) - 1, -1, -1):
+                if self.stack[index][0] == tag:
+                    del self.stack[index:]
+                    break
+            if boilerplate:
+                return
+        if tag == 'a':
+            self.close_link()
+        elif tag == 'code' and self.code_depth:
+            self.code_depth -= 1
+            self.inline.append('`')
+        elif self.table is not None:
+            if tag == 'table':
+                self.table_depth -= 1
+                if not self.table_depth:
+                    self.finish_cell()
+                    self.flush_table()
+            elif tag in ('td', 'th') and self.table_depth == 1:
+                self.finish_cell()
+            elif tag in BLOCK_TAGS:
+                self.inline.append(' ')
+        elif tag == 'pre' and self.pre_depth:
+            self.flush_block()
+            self.pre_depth -= 1
+        elif tag in HEADING_TAGS:
+            self.flush_block()
+            self.heading = 0
+        elif tag in ('ul', 'ol'):
+            self.flush_block()
+            if self.lists:
+                self.lists.pop()
+        elif tag == 'blockquote':
+            self.flush_block()
+            self.quote_depth = max(0, self.quote_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self.flush_block()
+
+    def handle_data(self, data):
+        if self.embedded.capturing:
+            self.embedded.data(data)
+        if self.skip_depth or self.done or (self.main and self.in_boilerplate()):
+            return
+        self.inline.append(data)
+
+    def close_link(self):
+        if not self.links:
+            return
+        href, start = self.links.pop()
+        start = min(start, len(self.inline))
+        text = ''.join(self.inline[start:]).replace(LINE_BREAK, ' ')
+        label = ' '.join(text.split()).replace(']', '\\]')
+        if not href or not label or href.startswith(IGNORED_LINK_PREFIXES):
+            return
+        url = urljoin(self.base_url, href) if self.base_url else href
+        if url not in self.references:
+            self.references[url] = len(self.references) + 1
+            # Each definition takes its line break; the first one the blank line before the list
+            self.reference_chars += len(f"[{self.references[url]}]: {url}") + (2 if len(self.references) == 1 else 1)
+        # Keep the spaces around the link text so neighbouring words stay apart
+        lead = ' ' if text[:1].isspace() else ''
+        trail = ' ' if text[-1:].isspace() else ''
+        self.inline[start:] = [f"{lead}[{label}][{self.references[url]}]{trail}"]
+
+    def collapse_inline(self):
+        text = ''.join(self.inline)
+        self.inline = []
+        self.links = [(href, 0) for href, _ in self.links]
+        lines = (' '.join(line.split()) for line in text.split(LINE_BREAK))
+        return '\n'.join(line for line in lines if line)
+
+    def finish_cell(self):
+        text = self.collapse_inline()
+        if self.in_cell:
+            self.table[-1].append(text.replace('\n', ' ').replace('|', '\\|'))
+        self.in_cell = False
+
+    def flush_table(self):
+        rows = [row for row in self.table if any(row)]
+        self.table = None
+        if not rows:
+            return
+        columns = max(len(row) for row in rows)
+        if columns == 1 or max(len(cell) for row in rows for cell in row) > MAX_TABLE_CELL_CHARS:
+            for row in rows:
+                for cell in row:
+                    if cell:
+                        self.emit(cell)
+            return
+        rows = [row + [''] * (columns - len(row)) for row in rows]
+        lines = ['| ' + ' | '.join(rows[0]) + ' |', '|' + '---|' * columns]
+        lines += ['| ' + ' | '.join(row) + ' |' for row in rows[1:]]
+        self.emit('\n'.join(lines))
+
+    def flush_block(self):
+        if self.pre_depth:
+            text = ''.join(self.inline).replace(LINE_BREAK, '\n').strip('\n')
+            self.inline = []
+            if text.strip():
+                self.emit(f"```\n{text}\n```")
+            return
+        text = self.collapse_inline()
+        if not text:
+            return
+        if self.heading:
+            self.emit('#' * self.heading + ' ' + text.replace('\n', ' '))
+        elif self.lists:
+            indent = '  ' * len(self.lists)
+            if self.item_prefix is not None:
+                text = self.item_prefix + text.replace('\n', '\n' + indent)
+                self.item_prefix = None
+            else:
+                text = indent + text.replace('\n', '\n' + indent)
+            self.emit(text, 'list')
+        else:
+            self.emit(text)
+
+    def emit(self, block, kind='text'):
+        if self.done:
+            return
+        if self.quote_depth:
+            block = '\n'.join('> ' * self.quote_depth + line for line in block.split('\n'))
+        separator = '' if not self.blocks else ('\n' if kind == 'list' and self.last_kind == 'list' else '\n\n')
+        # Link definitions are part of the output too, so they count against the budget
+        if self.max_chars is not None and self.size + self.reference_chars + len(separator) + len(block) > self.max_chars:
+            remaining = self.max_chars - self.size - self.reference_chars - len(separator)
+            if remaining > 0:
+                self.blocks.append(separator + block[:remaining])
+                self.size += len(separator) + remaining
+            self.truncated = True
+            self.done = True
+            return
+        self.blocks.append(separator + block)
+        self.size += len(separator) + len(block)
+        self.last_kind = kind
+
+    def close(self):
+        super().close()
+        if self.table is not None:
+            self.finish_cell()
+            self.flush_table()
+        self.flush_block()
+        if self.size < EMBEDDED_FALLBACK_MIN_CHARS:
+            max_chars = self.max_chars - self.reference_chars if self.max_chars is not None else None
+            self.fallback = embedded_fallback(self.embedded, ''.join(self.blocks), max_chars, '\n\n')
+        if self.full is not None and not self.blocks and not self.fallback:
+            # Nothing looked like main content: return the whole page rather than nothing
+            self.full.close()
+            self.blocks, self.references, self.fallback = self.full.blocks, self.full.references, self.full.fallback
+            self.truncated = self.full.truncated
+        self.full = None
+
+    def text(self):
+        references = {number: url for url, number in self.references.items()}
+        body = ''.join(self.blocks)
+        if self.fallback:
+            body = '\n\n'.join(([body] if body else []) + self.fallback)
+        return with_references(body, references)
+
+
+EXTRACTORS = {MODE_FULL: StreamingTextExtractor, MODE_MAIN: MainContentExtractor}
+
+
+def make_extractor(mode=MODE_FULL, max_chars=None, output_format=FORMAT_TEXT, base_url=None):
+    if output_format == FORMAT_MARKDOWN:
+        return MarkdownExtractor(max_chars, main=mode == MODE_MAIN, base_url=base_url)
+    return EXTRACTORS.get(mode, StreamingTextExtractor)(max_chars)
+
+
+def extraction_variant(mode=MODE_FULL, output_format=FORMAT_TEXT, max_chars=None):
+    # Page cache variant for an extraction; None for the default, uncapped full text. The cap is
+    # part of it so a shorter extraction is never read back where a longer one was asked for.
+    parts = [part for part in (mode if mode != MODE_FULL else None,
+                               output_format if output_format != FORMAT_TEXT else None,
+                               f"max{max_chars}" if max_chars is not None else None) if part]
+    return '+'.join(parts) or None
+
+
+def split_references(markdown):
+    # Separate the trailing link definitions of Markdown output: (body, {number: url})
+    lines = markdown.split('\n')
+    references = {}
+    while lines:
+        match = LINK_REFERENCE_PATTERN.match(lines[-1])
+        if not match:
+            break
+        references[int(match.group(1))] = match.group(2)
+        lines.pop()
+    return '\n'.join(lines).rstrip('\n'), references
+
+
+def with_references(body, references):
+    # Append the definitions of the links body still cites, renumbered in order of appearance
+    numbers = {}
+    for match in LINK_USE_PATTERN.finditer(body):
+        number = int(match.group(1))
+        if number in references and number not in numbers:
+            numbers[number] = len(numbers) + 1
+    if not numbers:
+        return body
+    body = LINK_USE_PATTERN.sub(lambda match: f"][{numbers.get(int(match.group(1)), match.group(1))}]", body)
+    return body + '\n\n' + '\n'.join(f"[{new}]: {references[old]}" for old, new in numbers.items())
+
+
+def select_markdown(markdown, select, max_chars):
+    # Apply a text selection (truncation or relevance ranking) to the body of Markdown output,
+    # keeping the definitions of the links that survive, all within max_chars
+    body, references = split_references(markdown)
+    budget = max_chars
+    for _ in range(3):
+        kept = select(body, max(0, budget))
+        selected = with_references(kept, references)
+        if len(selected) <= max_chars:
+            return selected
+        budget -= len(selected) - max_chars
+    # Still too long: cut the selection at a boundary, never inside a link, shrinking the cut
+    # until it and the definitions it still cites fit
+    size = max_chars
+    while len(selected) > max_chars:
+        cut, _ = truncate(kept, max(0, size))
+        match = PARTIAL_LINK_PATTERN.search(cut)
+        if match:
+            cut = cut[:match.start()].rstrip()
+        selected = with_references(cut, references)
+        size -= max(1, len(selected) - max_chars)
+    return selected
+
+
+def response_encoding(response):
+    # Avoid requests' charset detection, which needs the whole body in memory
+    encoding = response.encoding or 'utf-8'
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        encoding = 'utf-8'
+    return encoding
+
+
+def extract_html_text(html, max_chars=None, mode=MODE_FULL, chunk_size=CHUNK_SIZE, output_format=FORMAT_TEXT,
+                      base_url=None):
+    # Extract text from an HTML string already in memory, stopping at the budget
+    extractor = make_extractor(mode, max_chars, output_format, base_url)
+    for start in range(0, len(html), chunk_size):
+        extractor.feed(html[start:start + chunk_size])
+        if extractor.done:
+            break
+    extractor.close()
+    return extractor.text()
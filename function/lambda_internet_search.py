@@ -1,41 +1,108 @@
 import json
-import requests
+import logging
 import os
+import queue
+import re
 import shutil
-from googlesearch import search
-from bs4 import BeautifulSoup
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import metrics
+from aggregate_writer import AggregateWriter
+from budget import OUTPUT_MAX_TOKENS, RESPONSE_MAX_BYTES, estimate_tokens, response_bytes
+from dedup import DEDUP_ENABLED, ContentDeduper, UrlDeduper, dedup_report
+from fetch_client import canonical_url, get_host_semaphore
+from document_extract import UnsupportedContent, extract_document
+from html_extract import (FORMAT_MARKDOWN, FORMAT_TEXT, FORMATS, MODE_FULL, MODE_MAIN, MODES, extraction_variant,
+                          split_references)
+from page_cache import CACHE_DIR, get_page_cache
+from politeness import polite_fetch
+from relevance import select_relevant
+from search_providers import get_search_provider
 
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())  # DEBUG also logs events, responses and page content
 
-def get_page_content(url):
+# Concurrency and time budget for the search and page fetch stages, counted from the start of the search
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', '8'))
+FETCH_BUDGET_SECONDS = float(os.environ.get('FETCH_BUDGET_SECONDS', '20'))
+# Time kept back from the budget so partially read pages can still be parsed
+PARSE_RESERVE_SECONDS = float(os.environ.get('PARSE_RESERVE_SECONDS', '1'))
+# Reading a page stops once this many characters of text have been extracted
+PAGE_MAX_CHARS = int(os.environ.get('PAGE_MAX_CHARS', '25000'))
+# In main content mode more of each page is read so the most relevant passages can be picked
+MAIN_CONTENT_MAX_CHARS = int(os.environ.get('MAIN_CONTENT_MAX_CHARS', '100000'))
+# Start fetching each search result as soon as it arrives instead of waiting for the full list
+SEARCH_STREAM_RESULTS = os.environ.get('SEARCH_STREAM_RESULTS', 'true').lower() == 'true'
+# Characters of the query kept in the aggregate file name; anything but letters, digits, _ and - becomes _
+AGGREGATE_NAME_MAX_CHARS = 100
+UNSAFE_NAME_PATTERN = re.compile(r'[^A-Za-z0-9_-]+')
+
+def get_page_content(url, deadline=None, partial=None, mode=MODE_FULL, output_format=FORMAT_TEXT):
+    cache = get_page_cache()
+    max_chars = MAIN_CONTENT_MAX_CHARS if mode == MODE_MAIN else PAGE_MAX_CHARS
+    variant = extraction_variant(mode, output_format, max_chars)
+    url = canonical_url(url)  # Pages that redirected before are looked up under their final URL
+    entry = cache.get(url, variant)
+    if entry is not None and cache.is_fresh(entry):
+        print(f"Cache hit for {url}")
+        metrics.current().page(url, 'hit', chars=len(entry.content))
+        return entry.content
     try:
-        response = requests.get(url)
-        if response:
-            # Parse HTML content
-            soup = BeautifulSoup(response.text, 'html.parser')
-            # Remove script and style elements
-            for script_or_style in soup(["script", "style"]):
-                script_or_style.decompose()
-            # Get text
-            text = soup.get_text()
-            # Break into lines and remove leading and trailing space on each
-            lines = (line.strip() for line in text.splitlines())
-            # Break multi-headlines into a line each
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            # Drop blank lines
-            cleaned_text = '\n'.join(chunk for chunk in chunks if chunk)
+        # Read the body in chunks so a slow page can be cut off at the deadline
+        fetch_start = time.monotonic()
+        # Robots rules, per-host rate limits and Retry-After are applied by the politeness layer
+        response = polite_fetch(url, deadline=deadline, stream=True,
+                                headers=entry.conditional_headers() if entry else None)
+        fetch_seconds = time.monotonic() - fetch_start  # DNS, connect, redirects and time to the response headers
+        if response.history:
+            metrics.current().count('Redirects', len(response.history))
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            print(f"Not modified since last fetch, reusing cached content for {url}")
+            metrics.current().page(url, 'revalidated', fetch_seconds, chars=len(entry.content))
+            return cache.revalidated(entry).content
+        elif response:
+            # Parse the body as it streams in with the extractor for its content type;
+            # images, video and archives are refused before their body is downloaded
+            extraction = extract_document(response, max_chars=max_chars, deadline=deadline, mode=mode,
+                                          output_format=output_format)
+            cleaned_text = extraction.text()
+            metrics.current().page(response.url, 'miss', fetch_seconds, extraction, len(cleaned_text))
+            if extraction.timed_out:
+                print(f"Time budget reached while reading {url}, keeping partial content")
+                if partial is not None:
+                    partial.set()
+            # Only complete pages are cached
+            if not extraction.timed_out:
+                cache.put(response.url, cleaned_text, response.headers, variant, extraction.truncated)
             return cleaned_text
         else:
+            response.close()
             raise Exception("No response from the server.")
+    except UnsupportedContent as e:
+        print(f"Skipped {url}: {e}")
+        metrics.current().count('SkippedContent')
+        return None
     except Exception as e:
         print(f"Error while fetching and cleaning content from {url}: {e}")
+        metrics.current().count('FetchErrors')
         return None
 
 
+def aggregate_filename(query):
+    # The query goes into the file name, so path separators and other unsafe characters are replaced
+    name = UNSAFE_NAME_PATTERN.sub('_', query).strip('_')[:AGGREGATE_NAME_MAX_CHARS]
+    return f"aggregated_{name or 'query'}.txt"
+
+
 def empty_tmp_directory():
     try:
         folder = '/tmp'
         for filename in os.listdir(folder):
             file_path = os.path.join(folder, filename)
+            if file_path == CACHE_DIR:
+                continue  # Keep the page cache across invocations
             try:
                 if os.path.isfile(file_path) or os.path.islink(file_path):
                     os.unlink(file_path)
@@ -47,77 +114,221 @@ def empty_tmp_directory():
     except Exception as e:
         print(f"Error while emptying /tmp directory: {e}")
 
-def save_content_to_tmp(content, filename):
+def search_web(query, deadline=None):
+    # Yield result URLs from the configured search provider until the deadline. The provider runs
+    # on its own thread, so one that stalls without yielding (googlesearch keeps requesting result
+    # pages until it has enough) cannot hold the handler; it stops at its next result once abandoned.
+    provider = get_search_provider()
+    recorder = metrics.current()
+    results = queue.Queue()
+    stopped = threading.Event()
+    finished = object()
+
+    def produce():
+        urls = None
+        try:
+            urls = iter(provider.iter_results(query) if SEARCH_STREAM_RESULTS else provider.search(query))
+            for url in urls:
+                if stopped.is_set():
+                    break
+                results.put(url)
+        except Exception as e:
+            results.put(e)
+        finally:
+            if hasattr(urls, 'close'):
+                urls.close()  # An abandoned search is not cached
+            results.put(finished)
+
+    threading.Thread(target=produce, daemon=True).start()
+    search_seconds = 0.0  # Time spent waiting on the provider, not on the consumer
     try:
-        if content is not None:
-            with open(f'/tmp/{filename}', 'w', encoding='utf-8') as file:
-                file.write(content)
-            print(f"Saved {filename} to /tmp")
-            return f"Saved {filename} to /tmp"
-        else:
-            raise Exception("No content to save.")
-    except Exception as e:
-        print(f"Error while saving {filename} to /tmp: {e}")
+        while True:
+            start = time.monotonic()
+            try:
+                item = results.get(timeout=None if deadline is None else max(0, deadline - start))
+            except queue.Empty:
+                print(f"{provider.name} search stopped at the time budget")
+                recorder.count('SearchTimeouts')
+                return
+            finally:
+                search_seconds += time.monotonic() - start
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                print(f"Error during {provider.name} search: {item}")
+                recorder.count('SearchErrors')
+                return
+            recorder.count('SearchResults')
+            yield item
+    finally:
+        stopped.set()
+        if recorder.sampled('search'):
+            recorder.put('SearchTime', round(search_seconds * 1000, 3))
+
+def read_deadline_for(deadline):
+    # Pages stop reading a little before the deadline so their partial text is parsed in time
+    return deadline - min(PARSE_RESERVE_SECONDS, FETCH_BUDGET_SECONDS / 2)
 
-def search_google(query):
+def fetch_pages(urls, deadline=None, mode=MODE_FULL, output_format=FORMAT_TEXT):
+    # Fetch pages concurrently as the URLs arrive, returning (url, content, status) in search-rank order.
+    # The deadline is set before the search starts, so time spent waiting on results counts too.
+    deadline = deadline or time.monotonic() + FETCH_BUDGET_SECONDS
+    read_deadline = read_deadline_for(deadline)
+
+    def fetch_one(url, partial):
+        # Skip pages whose turn for the host comes after the budget is spent
+        with get_host_semaphore(url):
+            if time.monotonic() >= read_deadline:
+                return None
+            return get_page_content(url, deadline=read_deadline, partial=partial, mode=mode, output_format=output_format)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, FETCH_WORKERS))
+    submitted = []
     try:
-        search_results = []
-        for j in search(query, sleep_interval=5, num_results=10):
-            search_results.append(j)
-        return search_results
-    except Exception as e:
-        print(f"Error during Google search: {e}")
-        return []
+        for url in urls:
+            partial = threading.Event()
+            submitted.append((url, executor.submit(fetch_one, url, partial), partial))
+            if time.monotonic() >= read_deadline:
+                break
+        wait([future for _, future, _ in submitted], timeout=max(0, deadline - time.monotonic()))
+    finally:
+        # Do not block the action group response on pages that are still loading
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    pages = []
+    for url, future, partial in submitted:
+        if not future.done() or future.cancelled():
+            pages.append((url, None, 'timed out'))
+            continue
+        content = future.result()
+        if content is None:
+            pages.append((url, None, 'failed'))
+        elif partial.is_set():
+            pages.append((url, content, 'partial'))
+        else:
+            pages.append((url, content, 'complete'))
+    recorder = metrics.current()
+    for _, _, status in pages:
+        recorder.count('Pages' + status.title().replace(' ', ''))
+    return pages
+
+def get_request_property(event, name):
+    # Read a property from the action group requestBody
+    properties = event.get('requestBody', {}).get('content', {}).get('application/json', {}).get('properties', [])
+    return next((prop['value'] for prop in properties if prop['name'] == name), '')
 
 def handle_search(event):
     input_text = event.get('inputText', '')  # Extract 'inputText'
+    mode = get_request_property(event, 'mode') or MODE_FULL
+    if mode not in MODES:
+        return {"error": f"Unsupported mode: {mode}. Use one of {', '.join(MODES)}"}
+    output_format = get_request_property(event, 'format') or FORMAT_TEXT
+    if output_format not in FORMATS:
+        return {"error": f"Unsupported format: {output_format}. Use one of {', '.join(FORMATS)}"}
 
     # Empty the /tmp directory before saving new files
     print("Emptying temporary directory...")
-    empty_tmp_directory()
+    recorder = metrics.current()
+    with recorder.timer('TmpCleanupTime', 'tmp_io'):
+        empty_tmp_directory()
 
-    # Proceed with Google search
-    print("Performing Google search...")
-    urls_to_scrape = search_google(input_text)
+    # Proceed with the web search; results are fetched as they arrive, all within one time budget
+    print("Performing web search...")
+    deadline = time.monotonic() + FETCH_BUDGET_SECONDS
+    urls_to_scrape = search_web(input_text, read_deadline_for(deadline))
+    # Mirrors and alternate forms of the same URL are skipped before they are fetched
+    url_deduper = UrlDeduper()
+    content_deduper = ContentDeduper()
+    if DEDUP_ENABLED:
+        urls_to_scrape = url_deduper.filter(urls_to_scrape)
 
-    aggregated_content = ""
+    # Write each page to the aggregate file as it is processed
+    aggregated_filename = aggregate_filename(input_text)
     results = []
-    for url in urls_to_scrape:
-        print("URLs Used: ", url)
-        content = get_page_content(url)
-        if content:
-            print("CONTENT: ", content)
-            filename = url.split('//')[-1].replace('/', '_') + '.txt'  # Simple filename from URL
-            aggregated_content += f"URL: {url}\n\n{content}\n\n{'='*100}\n\n"
-            results.append({'url': url, 'status': 'Content aggregated'})
-        else:
-            results.append({'url': url, 'error': 'Failed to fetch content'})
-
-    # Define a single filename for the aggregated content
-    aggregated_filename = f"aggregated_{input_text.replace(' ', '_')}.txt"
-    # Save the aggregated content to /tmp
-    print("Saving aggregated content to /tmp...")
-    save_result = save_content_to_tmp(aggregated_content, aggregated_filename)
-    if save_result:
-        results.append({'aggregated_file': aggregated_filename, 'tmp_save_result': save_result})
-    else:
+    try:
+        writer = AggregateWriter(os.path.join('/tmp', aggregated_filename))
+    except Exception as e:
+        # Not fatal: the pages still make up the summary, only the file is missing
+        print(f"Error while creating {aggregated_filename} in /tmp: {e}")
         results.append({'aggregated_file': aggregated_filename, 'error': 'Failed to save aggregated content to /tmp'})
+        writer = AggregateWriter(None)
 
-    return {"results": results}
+    with writer, recorder.timer('FetchStageTime', 'fetch'):
+        for url, content, status in fetch_pages(urls_to_scrape, deadline, mode=mode, output_format=output_format):
+            logger.info("URL used: %s (%s)", url, status)
+            references = {}
+            if content and output_format == FORMAT_MARKDOWN:
+                # Dedup and ranking work on the page body; link definitions are added back after
+                content, references = split_references(content)
+            if content and DEDUP_ENABLED:
+                # Drop passages already written from a better ranked page
+                with recorder.timer('DedupTime', 'parse'):
+                    content = content_deduper.filter_page(content)
+                if content is None:
+                    results.append({'url': url, 'status': 'Duplicate of earlier results, skipped'})
+                    continue
+            if content and mode == MODE_MAIN:
+                # Keep the page's passages that best match the user's request
+                with recorder.timer('RankTime', 'parse'):
+                    content = select_relevant(content, input_text, PAGE_MAX_CHARS)
+            if content:
+                logger.debug("CONTENT from %s: %s", url, content)
+                with recorder.timer('TmpWriteTime', 'tmp_io'):
+                    writer.add_page(url, content, references)
+                if status == 'partial':
+                    results.append({'url': url, 'status': 'Partial content aggregated (time budget reached)'})
+                else:
+                    results.append({'url': url, 'status': 'Content aggregated'})
+            elif status == 'timed out':
+                results.append({'url': url, 'error': 'Timed out before content was fetched'})
+            else:
+                results.append({'url': url, 'error': 'Failed to fetch content'})
+
+        for url, kept_url in url_deduper.duplicates:
+            results.append({'url': url, 'status': f'Duplicate of {kept_url}, skipped'})
+        if DEDUP_ENABLED:
+            report = dedup_report(url_deduper, content_deduper)
+            for name, value in report.items():
+                recorder.count(''.join(part.title() for part in name.split('_')), value)
+            results.append({'dedup': report})
+
+        try:
+            with recorder.timer('TmpWriteTime', 'tmp_io'):
+                aggregate = writer.close()
+            if aggregate is not None:
+                recorder.count('AggregateBytes', aggregate['file_bytes'])
+                print(f"Saved {aggregate['aggregated_file']} to /tmp ({aggregate['file_bytes']} bytes)")
+                results.append(aggregate)
+        except Exception as e:
+            print(f"Error while saving {aggregated_filename} to /tmp: {e}")
+            results.append({'aggregated_file': aggregated_filename, 'error': 'Failed to save aggregated content to /tmp'})
+
+    # The summary gets what is left of the output budget once the results list is accounted for.
+    # The body is sent as a JSON string inside the JSON response, so its text is encoded twice.
+    skeleton = json.dumps({"results": results, "summary": "", "summary_report": {}})
+    with recorder.timer('SummaryTime', 'parse'):
+        summary, report = writer.summary(input_text, max_tokens=OUTPUT_MAX_TOKENS - estimate_tokens(skeleton),
+                                         max_bytes=RESPONSE_MAX_BYTES - response_bytes(skeleton) - 100, encodings=2)
+    return {"results": results, "summary": summary, "summary_report": report}
 
 def lambda_handler(event, context):
-    print("THE EVENT: ", event)
-    
+    logger.debug("THE EVENT: %s", event)
+    recorder = metrics.start('internet_search', event.get('apiPath'))
+    recorder.set_property('requestId', getattr(context, 'aws_request_id', None))
+
     response_code = 200
-    if event.get('apiPath') == '/search':
-        result = handle_search(event)
-    else:
-        response_code = 404
-        result = {"error": "Unrecognized api path"}
+    with recorder.timer('HandlerTime', 'handler'):
+        if event.get('apiPath') == '/search':
+            result = handle_search(event)
+        else:
+            response_code = 404
+            result = {"error": "Unrecognized api path"}
 
+    body = json.dumps(result)
+    recorder.count('OutputBytes', len(body.encode('utf-8')))
     response_body = {
         'application/json': {
-            'body': json.dumps(result)
+            'body': body
         }
     }
 
@@ -130,6 +341,7 @@ def lambda_handler(event, context):
     }
 
     api_response = {'messageVersion': '1.0', 'response': action_response}
-    print("RESPONSE: ", action_response)
-    
+    logger.debug("RESPONSE: %s", action_response)
+    recorder.flush()
+
     return api_response
@@ -1,126 +1,305 @@
-import requests
-import os
-import shutil
 import json
-from bs4 import BeautifulSoup
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import metrics
+from budget import (OUTPUT_MAX_TOKENS, RESPONSE_MAX_BYTES, allocate, char_budget, estimate_tokens, relevance_weights,
+                    response_bytes, truncate, truncation_info)
+from fetch_client import canonical_url, get_host_semaphore, preferred_scheme
+from document_extract import UnsupportedContent, extract_document
+from html_extract import (FORMAT_MARKDOWN, FORMAT_TEXT, FORMATS, MODE_FULL, MODE_MAIN, MODES, extraction_variant,
+                          select_markdown)
+from page_cache import get_page_cache
+from politeness import polite_fetch
+from relevance import select_relevant
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())  # DEBUG also logs events and responses
 
-# Fetch URL and extract text
-def get_page_content(url):
+# The whole extraction, up to this size, is cached so later calls can page through it by offset
+PAGE_STORE_MAX_CHARS = int(os.environ.get('PAGE_STORE_MAX_CHARS', '200000'))
+# In main content mode more of the page is read so the most relevant passages can be picked
+MAIN_CONTENT_MAX_CHARS = int(os.environ.get('MAIN_CONTENT_MAX_CHARS', '100000'))
+# Batch scrapes fetch several URLs concurrently and share the output budget between them
+MAX_BATCH_URLS = int(os.environ.get('MAX_BATCH_URLS', '10'))
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', '8'))
+BATCH_BUDGET_SECONDS = float(os.environ.get('BATCH_BUDGET_SECONDS', '25'))
+# Time a single scrape may spend, including rate limit waits, deferred 429/503 retries and reading the body
+SCRAPE_BUDGET_SECONDS = float(os.environ.get('SCRAPE_BUDGET_SECONDS', '25'))
+# Time kept back from the batch budget so partially read pages can still be parsed and returned
+PARSE_RESERVE_SECONDS = float(os.environ.get('PARSE_RESERVE_SECONDS', '1'))
+
+# Fetch URL and extract text, revalidating a stale cached copy with a conditional GET.
+# Redirects are followed within the fetch_client redirect policy and the page is cached under
+# its final URL, so http->https, www. and trailing-slash redirects all share one cache entry.
+# Continuation calls pass allow_stale so offsets keep pointing into the extraction they came from.
+# Reading stops at the deadline; the partial event is then set and the partial text is returned, not cached.
+# The truncated event is set when the extraction, fresh or cached, stopped at its size cap.
+# UnsupportedContent (binary files, PDFs whose text cannot be decoded) is raised so its reason reaches the agent.
+def get_page_content(url, mode=MODE_FULL, https_fallback=False, deadline=None, output_format=FORMAT_TEXT,
+                     allow_stale=False, partial=None, truncated=None):
+    cache = get_page_cache()
+    max_chars = MAIN_CONTENT_MAX_CHARS if mode == MODE_MAIN else PAGE_STORE_MAX_CHARS
+    variant = extraction_variant(mode, output_format, max_chars)
+    url = canonical_url(url)
+    entry = cache.get(url, variant)
+    if entry is not None and (allow_stale or cache.is_fresh(entry)):
+        print(f"Cache hit for {url}")
+        metrics.current().page(url, 'hit', chars=len(entry.content))
+        if entry.truncated and truncated is not None:
+            truncated.set()
+        return entry.content
+    deadline = deadline or time.monotonic() + SCRAPE_BUDGET_SECONDS
     try:
-        response = requests.get(url)
-        if response.history:  # Check if there were any redirects
-            print(f"Redirect detected for {url}")
-            return None  # Return None to indicate a redirect occurred
+        fetch_start = time.monotonic()
+        # Robots rules, per-host rate limits and Retry-After are applied by the politeness layer
+        response = polite_fetch(url, deadline=deadline, stream=True,
+                                headers=entry.conditional_headers() if entry else None, https_fallback=https_fallback)
+        fetch_seconds = time.monotonic() - fetch_start  # DNS, connect, redirects and time to the response headers
+        if response.history:
+            print(f"Followed {len(response.history)} redirect(s) from {url} to {response.url}")
+            metrics.current().count('Redirects', len(response.history))
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            print(f"Not modified since last fetch, reusing cached content for {url}")
+            metrics.current().page(url, 'revalidated', fetch_seconds, chars=len(entry.content))
+            if entry.truncated and truncated is not None:
+                truncated.set()
+            return cache.revalidated(entry).content
         elif response:
-            return response.text
+            # Stream the body through the extractor for its content type (HTML, PDF, text, JSON
+            # or XML), stopping once the output budget is filled
+            extraction = extract_document(response, max_chars=max_chars, deadline=deadline, mode=mode,
+                                          output_format=output_format)
+            cleaned_content = extraction.text()
+            metrics.current().page(response.url, 'miss', fetch_seconds, extraction, len(cleaned_content))
+            if extraction.truncated and truncated is not None:
+                truncated.set()
+            if extraction.timed_out:
+                print(f"Time budget reached while reading {url}, keeping partial content")
+                if partial is not None:
+                    partial.set()
+            else:
+                # Only complete pages are cached, so continuations never page through a cut-off read
+                cache.put(response.url, cleaned_content, response.headers, variant, extraction.truncated)
+            return cleaned_content
         else:
+            response.close()
             raise Exception("No response from the server.")
+    except UnsupportedContent as e:
+        print(f"Skipped {url}: {e}")
+        metrics.current().count('SkippedContent')
+        raise
     except Exception as e:
         print(f"Error while fetching content from {url}: {e}")
+        metrics.current().count('FetchErrors')
         return None
 
-def empty_tmp_folder():
-    try:
-        for filename in os.listdir('/tmp'):
-            file_path = os.path.join('/tmp', filename)
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.unlink(file_path)
-            elif os.path.isdir(file_path):
-                shutil.rmtree(file_path)
-        print("Temporary folder emptied.")
-        return "Temporary folder emptied."
-    except Exception as e:
-        print(f"Error while emptying /tmp folder: {e}")
-        return None
+def get_parameter(event, name):
+    parameters = event.get('parameters', [])
+    return next((param['value'] for param in parameters if param['name'] == name), '')
 
-def save_to_tmp(filename, content):
-    try:
-        if content is not None:
-            print(content)
-            with open(f'/tmp/{filename}', 'w') as file:
-                file.write(content)
-            print(f"Saved {filename} to /tmp")
-            return f"Saved {filename} to /tmp"
-        else:
-            raise Exception("No content to save.")
-    except Exception as e:
-        print(f"Error while saving {filename} to /tmp: {e}")
-        return None
+def has_scheme(input_url):
+    return input_url.startswith(('http://', 'https://'))
 
-def check_tmp_for_data(query):
-    try:
-        data = []
-        for filename in os.listdir('/tmp'):
-            if query in filename:
-                with open(f'/tmp/{filename}', 'r') as file:
-                    data.append(file.read())
-        print(f"Found {len(data)} file(s) in /tmp for query {query}")
-        return data if data else None
-    except Exception as e:
-        print(f"Error while checking /tmp for query {query}: {e}")
+def normalize_input_url(input_url):
+    # Bare hosts are tried over https first, unless the host is known to only serve http
+    if not has_scheme(input_url):
+        input_url = preferred_scheme(input_url) + input_url
+    return input_url
+
+def select_content(cleaned_content, mode, query, max_chars, output_format=FORMAT_TEXT):
+    # Returns the content to send, the offset in cleaned_content where the rest starts (None
+    # when nothing was cut or the passages were reordered by relevance) and whether text was left out
+    next_offset = None
+    cut = False
+
+    def select(text, size):
+        nonlocal next_offset, cut
+        if mode == MODE_MAIN:
+            # Rank main content passages against the user's request and keep the best ones
+            kept = select_relevant(text, query, size)
+            cut = len(kept) < len(text)
+            return kept
+        kept, next_offset = truncate(text, size)
+        cut = next_offset is not None
+        return kept
+
+    if output_format == FORMAT_MARKDOWN:
+        # Markdown link definitions sit at the end; keep the ones the selected text still uses
+        return select_markdown(cleaned_content, select, max_chars), next_offset, cut
+    return select(cleaned_content, max_chars), next_offset, cut
+
+def get_format(event):
+    return get_parameter(event, 'format') or FORMAT_TEXT
+
+def get_offset(event):
+    # None when no offset was given, -1 when it is not a usable number
+    value = str(get_parameter(event, 'offset')).strip()
+    if not value:
         return None
+    try:
+        return max(-1, int(value))
+    except ValueError:
+        return -1
 
-# Modify handle_search function to use tmp folder instead of S3
 def handle_search(event):
-    # Extract 'inputURL' from parameters
-    parameters = event.get('parameters', [])
-    input_url = next((param['value'] for param in parameters if param['name'] == 'inputURL'), '')
+    # Extract 'inputURL' and the optional extraction 'mode' from parameters
+    input_url = get_parameter(event, 'inputURL')
+    mode = get_parameter(event, 'mode') or MODE_FULL
+    output_format = get_format(event)
+    offset = get_offset(event)
 
     if not input_url:
         return {"error": "No URL provided"}
 
-    # Ensure URL starts with http:// or https://
-    if not input_url.startswith(('http://', 'https://')):
-        input_url = 'http://' + input_url
+    if offset == -1:
+        return {"error": "Invalid offset. Use the next_offset value of an earlier response"}
+
+    if mode not in MODES:
+        return {"error": f"Unsupported mode: {mode}. Use one of {', '.join(MODES)}"}
 
-    # Check /tmp directory first
-    tmp_data = check_tmp_for_data(input_url)
-    if tmp_data:
-        return {"results": tmp_data}
+    if output_format not in FORMATS:
+        return {"error": f"Unsupported format: {output_format}. Use one of {', '.join(FORMATS)}"}
 
-    # Empty the /tmp directory before saving new files
-    empty_tmp_result = empty_tmp_folder()
-    if empty_tmp_result is None:
-        return {"error": "Failed to empty /tmp folder"}
+    https_fallback = not has_scheme(input_url)
+    input_url = normalize_input_url(input_url)
 
-    # Scrape content from the provided URL
-    content = get_page_content(input_url)
-    if content is None:
+    # Scrape and clean content from the provided URL (served from the page cache when possible).
+    # A continuation reads the cached extraction even when it is stale, with no network request.
+    partial = threading.Event()
+    truncated = threading.Event()
+    try:
+        cleaned_content = get_page_content(input_url, mode, https_fallback, output_format=output_format,
+                                           allow_stale=offset is not None, partial=partial, truncated=truncated)
+    except UnsupportedContent as e:
+        return {"error": str(e)}
+    if cleaned_content is None:
         return {"error": "Failed to retrieve content"}
 
-    # Parse and clean HTML content
-    cleaned_content = parse_html_content(content)
+    url = canonical_url(input_url)  # Report the page's final URL, after any redirects
+    if offset is not None:
+        if offset and offset >= len(cleaned_content):
+            return {"error": f"Offset {offset} is past the end of the page ({len(cleaned_content)} characters)"}
+        metrics.current().count('Continuations')
+        # Continuations page through the extraction in page order, without relevance ranking
+        mode = MODE_FULL
+    text = cleaned_content[offset or 0:]
+    with metrics.current().timer('SelectTime', 'parse'):
+        # Fit the response to the token and response size budget, cutting at sentence boundaries
+        max_chars = char_budget(text, OUTPUT_MAX_TOKENS, RESPONSE_MAX_BYTES - response_bytes(url))
+        content, next_offset, cut = select_content(text, mode, event.get('inputText', ''), max_chars, output_format)
+    result = {'url': url, 'content': content,
+              'truncation': truncation_info(text, content, next_offset, start=offset or 0, cut=cut,
+                                            source_truncated=truncated.is_set() or partial.is_set())}
+    if partial.is_set():
+        result['status'] = 'partial'  # The time budget ran out while the page was being read
+    return {"results": result}
+
+def parse_url_list(value):
+    # The agent may send a JSON array, or URLs separated by commas, spaces or newlines
+    try:
+        urls = json.loads(value)
+        if isinstance(urls, str):
+            urls = [urls]
+    except (TypeError, ValueError):
+        urls = re.split(r'[\s,]+', value.strip().strip('[]'))
+    unique_urls = []
+    for url in urls:
+        url = str(url).strip().strip('\'"')
+        if url and url not in unique_urls:
+            unique_urls.append(url)
+    return unique_urls
 
-    filename = input_url.split('//')[-1].replace('/', '_') + '.txt'
-    save_result = save_to_tmp(filename, cleaned_content)
+def handle_batch(event):
+    # Scrape several URLs in one action group call
+    input_urls = parse_url_list(get_parameter(event, 'inputURLs'))
+    mode = get_parameter(event, 'mode') or MODE_FULL
+    output_format = get_format(event)
 
-    if save_result is None:
-        return {"error": "Failed to save to /tmp"}
+    if not input_urls:
+        return {"error": "No URLs provided"}
 
-    return {"results": {'url': input_url, 'content': cleaned_content}}
+    if mode not in MODES:
+        return {"error": f"Unsupported mode: {mode}. Use one of {', '.join(MODES)}"}
 
+    if output_format not in FORMATS:
+        return {"error": f"Unsupported format: {output_format}. Use one of {', '.join(FORMATS)}"}
 
-def parse_html_content(html_content):
-    soup = BeautifulSoup(html_content, 'html.parser')
-    # Remove script and style elements
-    for script_or_style in soup(["script", "style"]):
-        script_or_style.decompose()
-    # Get text
-    text = soup.get_text()
-    # Break into lines and remove leading and trailing space on each
-    lines = (line.strip() for line in text.splitlines())
-    # Break multi-headlines into a line each
-    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-    # Drop blank lines and concatenate into a single string
-    cleaned_text = '\n'.join(chunk for chunk in chunks if chunk)
-    
-    # Truncate to ensure it does not exceed 25KB
-    max_size = 25000  # Max size in characters
-    if len(cleaned_text) > max_size:
-        cleaned_text = cleaned_text[:max_size]  # Truncate to the max size
-    
-    return cleaned_text
+    skipped = input_urls[MAX_BATCH_URLS:]
+    bare = {normalize_input_url(url): not has_scheme(url) for url in input_urls[:MAX_BATCH_URLS]}
+    urls = list(bare)
+    query = event.get('inputText', '')
 
+    # Pages stop reading a little before the batch deadline, so their partial text is parsed in time
+    read_deadline = time.monotonic() + BATCH_BUDGET_SECONDS - min(PARSE_RESERVE_SECONDS, BATCH_BUDGET_SECONDS / 2)
+
+    def scrape(url, partial, truncated):
+        with get_host_semaphore(url):
+            start = time.monotonic()
+            try:
+                content = get_page_content(url, mode, https_fallback=bare[url], deadline=read_deadline,
+                                           output_format=output_format, partial=partial, truncated=truncated)
+                return content, time.monotonic() - start, None
+            except UnsupportedContent as e:
+                return None, time.monotonic() - start, str(e)
+
+    recorder = metrics.current()
+    executor = ThreadPoolExecutor(max_workers=max(1, min(BATCH_WORKERS, len(urls))))
+    try:
+        partials = [threading.Event() for _ in urls]
+        truncations = [threading.Event() for _ in urls]
+        futures = [executor.submit(scrape, url, partial, truncated)
+                   for url, partial, truncated in zip(urls, partials, truncations)]
+        with recorder.timer('FetchStageTime', 'fetch'):
+            wait(futures, timeout=BATCH_BUDGET_SECONDS)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    pages = []
+    source_truncated = []  # Whether each page with content was cut short by its size cap or the time budget
+    for url, future, partial, truncated in zip(urls, futures, partials, truncations):
+        if not future.done() or future.cancelled():
+            pages.append({'url': url, 'status': 'timed out', 'seconds': BATCH_BUDGET_SECONDS})
+            continue
+        content, seconds, error = future.result()
+        if content is None:
+            page = {'url': url, 'status': 'failed', 'seconds': round(seconds, 3)}
+            if error:
+                page['error'] = error
+            pages.append(page)
+        else:
+            status = 'partial' if partial.is_set() else 'ok'
+            pages.append({'url': canonical_url(url), 'status': status, 'seconds': round(seconds, 3), 'content': content})
+            source_truncated.append(truncated.is_set() or partial.is_set())
+
+    # Divide the shared output budget among the pages that returned content, giving pages
+    # that match the user's request more of it; short pages keep all their text
+    scraped = [page for page in pages if 'content' in page]
+    contents = [page['content'] for page in scraped]
+    weights = relevance_weights(contents, query)
+    # No page can get more characters than the whole response holds, so only that much is measured
+    heads = [content[:RESPONSE_MAX_BYTES] for content in contents]
+    # Room for the url, status and truncation fields of every entry
+    entries = [{key: value for key, value in page.items() if key != 'content'} for page in pages]
+    overhead = len(json.dumps(entries)) + 150 * len(scraped)
+    token_shares = allocate([estimate_tokens(head) for head in heads], OUTPUT_MAX_TOKENS, weights)
+    byte_shares = allocate([response_bytes(head) for head in heads], RESPONSE_MAX_BYTES - overhead, weights)
+    for page, content, max_tokens, max_bytes, source in zip(scraped, contents, token_shares, byte_shares,
+                                                            source_truncated):
+        max_chars = char_budget(content, max_tokens, max_bytes)
+        page['content'], next_offset, cut = select_content(content, mode, query, max_chars, output_format)
+        page['truncation'] = truncation_info(content, page['content'], next_offset, cut=cut, source_truncated=source)
+
+    for page in pages:
+        recorder.count('Pages' + page['status'].title().replace(' ', ''))
+    for url in skipped:
+        pages.append({'url': url, 'status': 'skipped', 'error': f"Only {MAX_BATCH_URLS} URLs are scraped per batch"})
+
+    return {"results": pages}
 
 
 def lambda_handler(event, context):
@@ -128,13 +307,19 @@ def lambda_handler(event, context):
     action_group = event['actionGroup']
     api_path = event['apiPath']
 
-    print("THE EVENT: ", event)
+    logger.debug("THE EVENT: %s", event)
+    recorder = metrics.start('webscrape', api_path)
+    recorder.set_property('requestId', getattr(context, 'aws_request_id', None))
 
-    if api_path == '/search':
-        result = handle_search(event)
-    else:
-        response_code = 404
-        result = f"Unrecognized api path: {action_group}::{api_path}"
+    with recorder.timer('HandlerTime', 'handler'):
+        if api_path == '/search':
+            result = handle_search(event)
+        elif api_path == '/batch':
+            result = handle_batch(event)
+        else:
+            response_code = 404
+            result = f"Unrecognized api path: {action_group}::{api_path}"
+    recorder.count('OutputBytes', len(json.dumps(result).encode('utf-8')))
 
     response_body = {
         'application/json': {
@@ -151,6 +336,6 @@ def lambda_handler(event, context):
     }
 
     api_response = {'messageVersion': '1.0', 'response': action_response}
-    print("action_response: ", action_response)
-    print("response_body: ", response_body)
+    logger.debug("action_response: %s", action_response)
+    recorder.flush()
     return api_response
@@ -0,0 +1,165 @@
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Lightweight instrumentation shared by the webscrape and internet search Lambdas.
+# Timings and counters are collected per invocation and written to stdout as CloudWatch
+# Embedded Metric Format (EMF) lines, which CloudWatch Logs turns into metrics without
+# any API calls from the function. Per-URL records are written as separate plain JSON lines
+# without a metric declaration, so each page is only counted once, by the invocation's line.
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'BedrockAgentWebscraper')
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '1.0'))  # Default for every stage
+# Per-stage overrides, e.g. METRICS_STAGE_SAMPLE_RATES="url=0.1,parse=0.5"
+METRICS_STAGE_SAMPLE_RATES = os.environ.get('METRICS_STAGE_SAMPLE_RATES', '')
+MAX_VALUES_PER_METRIC = 100  # EMF limit on values in one metric array
+
+UNITS = (('Time', 'Milliseconds'), ('Bytes', 'Bytes'))
+
+
+def parse_sample_rates(value):
+    rates = {}
+    for part in filter(None, (item.strip() for item in value.split(','))):
+        stage, _, rate = part.partition('=')
+        try:
+            rates[stage.strip()] = float(rate)
+        except ValueError:
+            print(f"Ignoring invalid metrics sample rate: {part}")
+    return rates
+
+
+STAGE_SAMPLE_RATES = parse_sample_rates(METRICS_STAGE_SAMPLE_RATES)
+
+
+def unit_for(name):
+    # Metric units follow the name: ...Time is milliseconds, ...Bytes is bytes, anything else a count
+    return next((unit for suffix, unit in UNITS if name.endswith(suffix)), 'Count')
+
+
+def log_record(values, dimensions, properties=None):
+    # Print a structured log line that CloudWatch does not turn into metrics (Logs Insights can query it)
+    record = dict(properties or {})
+    record.update(dimensions)
+    record.update(values)
+    print(json.dumps(record, default=str))
+
+
+def emit(values, dimensions, properties=None, namespace=METRICS_NAMESPACE):
+    # Print one EMF line; values maps metric name -> number or list of numbers
+    if not values:
+        return
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': namespace,
+                'Dimensions': [sorted(dimensions)],
+                'Metrics': [{'Name': name, 'Unit': unit_for(name)} for name in sorted(values)]
+            }]
+        }
+    }
+    record.update(properties or {})
+    record.update(dimensions)
+    record.update(values)
+    print(json.dumps(record, default=str))
+
+
+class Metrics:
+    # Metrics for one invocation; safe to use from the fetch worker threads
+
+    def __init__(self, function, api_path=None, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.dimensions = {'Function': function}
+        if api_path:
+            self.dimensions['ApiPath'] = api_path
+        self.values = {}
+        self.properties = {}
+        self.lock = threading.Lock()
+        self.stages = {}  # stage -> sampled for this invocation
+
+    def sampled(self, stage):
+        # Each stage is sampled once per invocation, so its numbers are all-or-nothing
+        if not self.enabled:
+            return False
+        with self.lock:
+            if stage not in self.stages:
+                rate = STAGE_SAMPLE_RATES.get(stage, METRICS_SAMPLE_RATE)
+                self.stages[stage] = rate >= 1 or random.random() < rate
+            return self.stages[stage]
+
+    def put(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            values = self.values.setdefault(name, [])
+            if len(values) < MAX_VALUES_PER_METRIC:
+                values.append(value)
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            counts = self.values.setdefault(name, [0])
+            counts[0] += value
+
+    def set_property(self, name, value):
+        with self.lock:
+            self.properties[name] = value
+
+    @contextmanager
+    def timer(self, name, stage=None):
+        # Record the wrapped block's duration under `name` (milliseconds) if its stage is sampled
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            if self.sampled(stage or name):
+                self.put(name, round((time.monotonic() - start) * 1000, 3))
+
+    def page(self, url, cache, fetch_seconds=None, extraction=None, chars=None):
+        # Record one page fetch: cache outcome, bytes downloaded and parse time
+        self.count(f"Cache{cache.capitalize()}")
+        values = {}
+        if fetch_seconds is not None:
+            values['FetchTime'] = round(fetch_seconds * 1000, 3)
+        if extraction is not None:
+            values['FetchBytes'] = extraction.bytes_read
+            values['ParseTime'] = round(extraction.parse_seconds * 1000, 3)
+            self.count('DownloadedBytes', extraction.bytes_read)
+            self.count(f"Content{getattr(extraction, 'kind', 'html').title()}")
+            if getattr(extraction, 'fallback', None):
+                self.count('EmbeddedFallback')  # Text recovered from a JavaScript rendered page's embedded data
+        if chars is not None:
+            values['PageChars'] = chars
+        for name, stage in (('FetchTime', 'fetch'), ('ParseTime', 'parse')):
+            if name in values and self.sampled(stage):
+                self.put(name, values[name])
+        if self.sampled('url'):
+            log_record(values, self.dimensions, {'url': url, 'cache': cache})
+
+    def flush(self):
+        if not self.enabled:
+            return
+        with self.lock:
+            values = {name: found[0] if len(found) == 1 else list(found) for name, found in self.values.items()}
+            properties = dict(self.properties)
+            self.values = {}
+        emit(values, self.dimensions, properties)
+
+
+_current = Metrics('unknown', enabled=False)
+
+
+def start(function, api_path=None):
+    # Begin collecting metrics for a new invocation
+    global _current
+    _current = Metrics(function, api_path)
+    return _current
+
+
+def current():
+    return _current
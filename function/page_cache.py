@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Cache of extracted page content shared by the webscrape and internet search Lambdas.
+# Entries are keyed by normalized URL and keep the ETag/Last-Modified validators so a
+# stale entry can be revalidated with a conditional GET instead of downloaded again.
+
+CACHE_BACKEND = os.environ.get('PAGE_CACHE_BACKEND', 'disk')  # 'disk' or 's3'
+CACHE_TTL_SECONDS = int(os.environ.get('PAGE_CACHE_TTL_SECONDS', '3600'))
+CACHE_DIR = os.environ.get('PAGE_CACHE_DIR', '/tmp/page_cache')
+CACHE_MAX_BYTES = int(os.environ.get('PAGE_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+CACHE_S3_BUCKET = os.environ.get('PAGE_CACHE_S3_BUCKET', '')
+CACHE_S3_PREFIX = os.environ.get('PAGE_CACHE_S3_PREFIX', 'page-cache/')
+CACHE_S3_ENDPOINT = os.environ.get('PAGE_CACHE_S3_ENDPOINT')  # e.g. a local S3-compatible stand-in
+
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid')
+
+
+def normalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and str(parts.port) != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    path = parts.path or '/'
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(TRACKING_PARAMS)
+    )
+    # The fragment never reaches the server, so it is dropped from the key
+    return urlunsplit((scheme, host, path, urlencode(query), ''))
+
+
+def cache_key(url, variant=None):
+    # The variant separates different extractions of the same page (e.g. full text vs main content)
+    key = normalize_url(url) if not variant else f"{normalize_url(url)}|{variant}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class CacheEntry:
+    def __init__(self, url, content, etag=None, last_modified=None, fetched_at=None, variant=None, truncated=False):
+        self.url = url
+        self.variant = variant
+        self.content = content
+        self.truncated = truncated  # The extraction stopped at its size cap before the end of the page
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+
+    def is_fresh(self, ttl=CACHE_TTL_SECONDS):
+        return time.time() - self.fetched_at < ttl
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def metadata(self):
+        return {
+            'url': self.url,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'fetched_at': self.fetched_at,
+            'truncated': self.truncated
+        }
+
+
+class DiskCacheBackend:
+    # Stores each entry as <key>.json (metadata) and <key>.body (content) under a /tmp quota,
+    # evicting least recently used entries once the total body size exceeds max_bytes.
+
+    def __init__(self, root=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.index = OrderedDict()  # key -> size in bytes, least recently used first
+        self.total_bytes = 0
+        os.makedirs(root, exist_ok=True)
+        self.load_index()
+
+    def load_index(self):
+        entries = []
+        for filename in os.listdir(self.root):
+            if filename.endswith('.body'):
+                path = os.path.join(self.root, filename)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, filename[:-len('.body')], stat.st_size))
+        for _, key, size in sorted(entries):
+            self.index[key] = size
+            self.total_bytes += size
+
+    def paths(self, key):
+        return os.path.join(self.root, key + '.json'), os.path.join(self.root, key + '.body')
+
+    def get(self, key):
+        meta_path, body_path = self.paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as file:
+                meta = json.load(file)
+            with open(body_path, 'rb') as file:
+                body = file.read()
+            os.utime(body_path)
+        except (OSError, ValueError):
+            return None
+        with self.lock:
+            if key in self.index:
+                self.index.move_to_end(key)
+        return meta, body
+
+    def put(self, key, meta, body):
+        meta_path, body_path = self.paths(key)
+        # Write to temporary files first so concurrent readers never see a partial entry
+        for path, data, mode in ((body_path, body, 'wb'), (meta_path, json.dumps(meta).encode('utf-8'), 'wb')):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, mode) as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        with self.lock:
+            self.total_bytes -= self.index.pop(key, 0)
+            self.index[key] = len(body)
+            self.total_bytes += len(body)
+            self.evict()
+
+    def put_metadata(self, key, meta):
+        meta_path, body_path = self.paths(key)
+        tmp_path = f"{meta_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(meta, file)
+        os.replace(tmp_path, meta_path)
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and len(self.index) > 1:
+            key, size = self.index.popitem(last=False)
+            self.total_bytes -= size
+            for path in self.paths(key):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            print(f"Evicted cache entry {key} ({size} bytes)")
+
+
+class S3CacheBackend:
+    # Stores entries in an S3 bucket (or an S3-compatible endpoint) so the cache is shared
+    # across concurrent Lambda containers. Size-bounded eviction is left to a bucket lifecycle rule.
+
+    def __init__(self, bucket=CACHE_S3_BUCKET, prefix=CACHE_S3_PREFIX, client=None, endpoint_url=CACHE_S3_ENDPOINT):
+        if client is None:
+            import boto3
+            client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        except Exception as e:
+            if 'NoSuchKey' not in str(e) and '404' not in str(e):
+                print(f"Error while reading cache entry {key} from S3: {e}")
+            return None
+        meta = json.loads(response['Metadata'].get('entry', '{}'))
+        return meta, response['Body'].read()
+
+    def put(self, key, meta, body):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self.prefix + key,
+            Body=body,
+            Metadata={'entry': json.dumps(meta)}
+        )
+
+    def put_metadata(self, key, meta):
+        self.client.copy_object(
+            Bucket=self.bucket,
+            Key=self.prefix + key,
+            CopySource={'Bucket': self.bucket, 'Key': self.prefix + key},
+            Metadata={'entry': json.dumps(meta)},
+            MetadataDirective='REPLACE'
+        )
+
+
+class PageCache:
+    def __init__(self, backend, ttl=CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+
+    def get(self, url, variant=None):
+        try:
+            found = self.backend.get(cache_key(url, variant))
+        except Exception as e:
+            print(f"Error while reading cache for {url}: {e}")
+            return None
+        if found is None:
+            return None
+        meta, body = found
+        return CacheEntry(
+            meta.get('url', url),
+            body.decode('utf-8'),
+            etag=meta.get('etag'),
+            last_modified=meta.get('last_modified'),
+            fetched_at=meta.get('fetched_at', 0),
+            variant=variant,
+            truncated=meta.get('truncated', False)
+        )
+
+    def is_fresh(self, entry):
+        return entry.is_fresh(self.ttl)
+
+    def put(self, url, content, headers=None, variant=None, truncated=False):
+        headers = headers or {}
+        entry = CacheEntry(
+            url, content, etag=headers.get('ETag'), last_modified=headers.get('Last-Modified'), variant=variant,
+            truncated=truncated
+        )
+        try:
+            self.backend.put(cache_key(url, variant), entry.metadata(), content.encode('utf-8'))
+        except Exception as e:
+            print(f"Error while writing cache for {url}: {e}")
+        return entry
+
+    def revalidated(self, entry):
+        # A 304 keeps the stored content and restarts its TTL
+        entry.fetched_at = time.time()
+        try:
+            self.backend.put_metadata(cache_key(entry.url, entry.variant), entry.metadata())
+        except Exception as e:
+            print(f"Error while refreshing cache for {entry.url}: {e}")
+        return entry
+
+
+_page_cache = None
+_page_cache_lock = threading.Lock()
+
+
+def get_page_cache():
+    global _page_cache
+    if _page_cache is None:
+        with _page_cache_lock:
+            if _page_cache is None:
+                if CACHE_BACKEND == 's3':
+                    backend = S3CacheBackend()
+                else:
+                    backend = DiskCacheBackend()
+                _page_cache = PageCache(backend)
+    return _page_cache
@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+from fetch_client import fetch, fetch_following
+
+# Politeness layer in front of fetch_following, used by both Lambdas. Every request, including
+# each redirect hop, first checks the host's robots.txt rules (downloaded once per
+# ROBOTS_TTL_SECONDS and kept for the life of the container) and takes a token from the host's
+# bucket. 429/503 responses pause the host and are retried after Retry-After, but only when
+# the retry still fits in the caller's deadline.
+
+POLITENESS_ENABLED = os.environ.get('POLITENESS_ENABLED', 'true').lower() == 'true'
+HOST_RATE_PER_SECOND = float(os.environ.get('HOST_RATE_PER_SECOND', '2'))  # Sustained requests per host
+HOST_BURST = int(os.environ.get('HOST_BURST', '4'))  # Requests a host may get back to back
+ROBOTS_ENABLED = os.environ.get('ROBOTS_ENABLED', 'true').lower() == 'true'
+ROBOTS_TTL_SECONDS = int(os.environ.get('ROBOTS_TTL_SECONDS', '3600'))
+ROBOTS_TIMEOUT = float(os.environ.get('ROBOTS_TIMEOUT', '3'))
+ROBOTS_USER_AGENT = os.environ.get('ROBOTS_USER_AGENT', 'BedrockAgentWebscraper')  # Token matched against robots.txt groups
+MAX_CRAWL_DELAY = float(os.environ.get('MAX_CRAWL_DELAY', '10'))  # Longer Crawl-delay values are capped
+RETRY_STATUSES = (429, 503)
+MAX_DEFERRED_RETRIES = int(os.environ.get('MAX_DEFERRED_RETRIES', '2'))
+RETRY_AFTER_MAX_SECONDS = float(os.environ.get('RETRY_AFTER_MAX_SECONDS', '10'))
+RETRY_DEFAULT_SECONDS = 0.5  # Wait for a 429/503 without a Retry-After header, doubled per retry
+
+
+class RobotsDisallowed(Exception):
+    pass
+
+
+class RateLimited(Exception):
+    pass
+
+
+class HostBucket:
+    # Token bucket for one host; reserve() hands out the wait before the next request may start
+
+    def __init__(self, rate=HOST_RATE_PER_SECOND, burst=HOST_BURST):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def slow_down(self, crawl_delay):
+        # Apply a robots.txt Crawl-delay: at most one request per delay
+        with self.lock:
+            self.rate = min(self.rate, 1 / crawl_delay)
+            self.capacity = 1
+            self.tokens = min(self.tokens, 1.0)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def reserve(self, deadline=None):
+        # Seconds to wait before sending, or None if the request could not start before the deadline
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.paused_until, self.updated)
+            tokens = min(self.capacity, self.tokens + (start - self.updated) * self.rate)
+            ready = start if tokens >= 1 else start + (1 - tokens) / self.rate
+            if deadline is not None and ready > deadline:
+                return None
+            self.tokens = max(tokens, 1.0) - 1
+            self.updated = ready
+            return ready - now
+
+
+class RobotsRules:
+    def __init__(self, parser, fetched_at):
+        self.parser = parser
+        self.fetched_at = fetched_at
+
+    def allowed(self, url):
+        return self.parser.can_fetch(ROBOTS_USER_AGENT, url)
+
+    def crawl_delay(self):
+        delay = self.parser.crawl_delay(ROBOTS_USER_AGENT)
+        rate = self.parser.request_rate(ROBOTS_USER_AGENT)
+        if rate and rate.requests:
+            delay = max(delay or 0, rate.seconds / rate.requests)
+        return min(float(delay), MAX_CRAWL_DELAY) if delay else None
+
+
+_buckets = {}
+_robots = {}  # scheme://host -> RobotsRules
+_robots_locks = {}
+_state_lock = threading.Lock()
+
+
+def get_bucket(host):
+    with _state_lock:
+        if host not in _buckets:
+            _buckets[host] = HostBucket()
+        return _buckets[host]
+
+
+def load_robots(origin):
+    parser = RobotFileParser(origin + '/robots.txt')
+    try:
+        response = fetch(origin + '/robots.txt', timeout=(ROBOTS_TIMEOUT, ROBOTS_TIMEOUT))
+        # Same rules as RobotFileParser.read(): 401/403 disallow everything, other errors allow everything
+        if response.status_code in (401, 403):
+            parser.disallow_all = True
+        elif 400 <= response.status_code < 500:
+            parser.allow_all = True
+        elif response.ok:
+            parser.parse(response.text.splitlines())
+        else:
+            parser.allow_all = True
+    except Exception as e:
+        print(f"Could not read {origin}/robots.txt, allowing all: {e}")
+        parser.allow_all = True
+    return RobotsRules(parser, time.time())
+
+
+def get_robots(origin):
+    # One download per origin and TTL; concurrent callers for the same origin wait for it
+    with _state_lock:
+        rules = _robots.get(origin)
+        if rules is not None and time.time() - rules.fetched_at < ROBOTS_TTL_SECONDS:
+            return rules
+        lock = _robots_locks.setdefault(origin, threading.Lock())
+    with lock:
+        with _state_lock:
+            rules = _robots.get(origin)
+        if rules is None or time.time() - rules.fetched_at >= ROBOTS_TTL_SECONDS:
+            rules = load_robots(origin)
+            with _state_lock:
+                _robots[origin] = rules
+    return rules
+
+
+def admit(url, deadline=None):
+    # Wait until a request to url may be sent; raises if robots.txt or the deadline forbid it
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    bucket = get_bucket(host)
+    if ROBOTS_ENABLED:
+        rules = get_robots(f"{parsed.scheme}://{parsed.netloc}")
+        if not rules.allowed(url):
+            raise RobotsDisallowed(f"robots.txt disallows {url}")
+        crawl_delay = rules.crawl_delay()
+        if crawl_delay:
+            bucket.slow_down(crawl_delay)
+    wait = bucket.reserve(deadline)
+    if wait is None:
+        raise RateLimited(f"Rate limit for {host} leaves no time before the deadline")
+    if wait > 0:
+        time.sleep(wait)
+
+
+def retry_after_seconds(response, attempt):
+    value = response.headers.get('retry-after', '').strip()
+    if value.isdigit():
+        return float(value)
+    if value:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    return RETRY_DEFAULT_SECONDS * 2 ** attempt
+
+
+def polite_fetch(url, deadline=None, stream=False, headers=None, https_fallback=False):
+    """fetch_following with robots.txt rules, per-host rate limits and deferred 429/503 retries.
+    deadline is a time.monotonic() value; waits that would pass it are not taken and the last
+    response is returned instead.
+    """
+    if not POLITENESS_ENABLED:
+        return fetch_following(url, stream=stream, headers=headers, https_fallback=https_fallback)
+
+    def before_hop(hop_url):
+        admit(hop_url, deadline)
+
+    for attempt in range(MAX_DEFERRED_RETRIES + 1):
+        admit(url, deadline)
+        response = fetch_following(url, stream=stream, headers=headers, https_fallback=https_fallback,
+                                   before_redirect=before_hop)
+        if response.status_code not in RETRY_STATUSES or attempt == MAX_DEFERRED_RETRIES:
+            return response
+        wait = retry_after_seconds(response, attempt)
+        host = (urlparse(response.url).hostname or '').lower()
+        # Everyone fetching from this host waits, not only this request
+        get_bucket(host).pause(min(wait, RETRY_AFTER_MAX_SECONDS))
+        if wait > RETRY_AFTER_MAX_SECONDS or (deadline is not None and time.monotonic() + wait >= deadline):
+            print(f"{response.status_code} from {host}, Retry-After {wait:.1f}s does not fit the time budget")
+            return response
+        print(f"{response.status_code} from {host}, retrying in {wait:.1f}s")
+        response.close()
+    return response
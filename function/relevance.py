@@ -0,0 +1,88 @@
+import math
+import re
+from collections import Counter
+
+# Lightweight lexical relevance ranking (BM25) used to fill the output budget with the
+# passages that best match the agent's query instead of the first characters of the page.
+
+CHUNK_CHARS = 1200
+BM25_K1 = 1.5
+BM25_B = 0.75
+STOPWORDS = frozenset(
+    'a an and are as at be but by do does for from how i in is it me of on or tell that the this '
+    'to was what when where which who why will with you your about search internet webscrape url'.split()
+)
+
+TOKEN_PATTERN = re.compile(r'\w+')
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+')
+
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def split_chunks(text, chunk_chars=CHUNK_CHARS):
+    # Group paragraphs (separated by blank lines) into chunks of roughly chunk_chars,
+    # splitting oversized paragraphs at sentence boundaries
+    chunks = []
+    current = ''
+    for paragraph in text.split('\n\n'):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        pieces = [paragraph] if len(paragraph) <= chunk_chars else SENTENCE_PATTERN.split(paragraph)
+        for position, piece in enumerate(pieces):
+            separator = '' if not current else (' ' if position else '\n\n')
+            if current and len(current) + len(separator) + len(piece) > chunk_chars:
+                chunks.append(current)
+                current = ''
+                separator = ''
+            current += separator + piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def bm25_scores(chunks, query, k1=BM25_K1, b=BM25_B):
+    query_terms = set(tokenize(query))
+    if not query_terms or not chunks:
+        return [0.0] * len(chunks)
+    chunk_terms = [Counter(tokenize(chunk)) for chunk in chunks]
+    average_length = sum(sum(terms.values()) for terms in chunk_terms) / len(chunks) or 1
+    document_frequency = Counter(term for terms in chunk_terms for term in query_terms if term in terms)
+    scores = []
+    for terms in chunk_terms:
+        length = sum(terms.values())
+        score = 0.0
+        for term in query_terms:
+            frequency = terms.get(term, 0)
+            if not frequency:
+                continue
+            idf = math.log(1 + (len(chunks) - document_frequency[term] + 0.5) / (document_frequency[term] + 0.5))
+            score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * length / average_length))
+        scores.append(score)
+    return scores
+
+
+def rank_chunks(chunks, query):
+    # Chunk indices ordered by descending score; ties keep page order
+    scores = bm25_scores(chunks, query)
+    return sorted(range(len(chunks)), key=lambda index: (-scores[index], index))
+
+
+def select_relevant(text, query, max_chars):
+    # Fill max_chars with the highest scoring chunks, most relevant first
+    chunks = split_chunks(text)
+    ranking = rank_chunks(chunks, query)
+    selected = []
+    size = 0
+    for index in ranking:
+        chunk = chunks[index]
+        separator = 2 if selected else 0
+        if size + separator + len(chunk) > max_chars:
+            continue  # A later, shorter chunk may still fit
+        selected.append(chunk)
+        size += separator + len(chunk)
+    if not selected and ranking:
+        return chunks[ranking[0]][:max_chars]
+    return '\n\n'.join(selected)
@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote_plus
+
+from fetch_client import fetch
+
+# Pluggable search backends for the internet search Lambda. Every provider exposes
+# iter_results(), a generator that yields result URLs as they arrive, so the fetch stage
+# can start on the first result instead of waiting for the whole list.
+
+SEARCH_PROVIDER = os.environ.get('SEARCH_PROVIDER', 'google')  # 'google', 'json_api' or 'fixture'
+SEARCH_NUM_RESULTS = int(os.environ.get('SEARCH_NUM_RESULTS', '10'))
+# Seconds between result pages. googlesearch requests pages until it has num_results, so with
+# no pause a results page it cannot parse turns into back-to-back requests to Google.
+SEARCH_SLEEP_INTERVAL = float(os.environ.get('SEARCH_SLEEP_INTERVAL', '5'))
+SEARCH_CACHE_TTL_SECONDS = int(os.environ.get('SEARCH_CACHE_TTL_SECONDS', '900'))
+SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get('SEARCH_CACHE_MAX_ENTRIES', '256'))
+
+# Generic JSON search API, e.g. SEARCH_API_URL="https://api.example.com/search?q={query}&count={num_results}"
+SEARCH_API_URL = os.environ.get('SEARCH_API_URL', '')
+SEARCH_API_KEY = os.environ.get('SEARCH_API_KEY', '')
+SEARCH_API_KEY_HEADER = os.environ.get('SEARCH_API_KEY_HEADER', 'Authorization')
+SEARCH_API_RESULTS_PATH = os.environ.get('SEARCH_API_RESULTS_PATH', 'results')  # Dotted path to the result list
+SEARCH_API_URL_FIELD = os.environ.get('SEARCH_API_URL_FIELD', 'url')
+
+SEARCH_FIXTURES = os.environ.get('SEARCH_FIXTURES', '')  # JSON file mapping query -> list of URLs
+
+
+def normalize_query(query):
+    return ' '.join(query.lower().split())
+
+
+class SearchProvider:
+    name = 'base'
+
+    def iter_results(self, query, num_results=SEARCH_NUM_RESULTS):
+        raise NotImplementedError
+
+    def search(self, query, num_results=SEARCH_NUM_RESULTS):
+        return list(self.iter_results(query, num_results))
+
+
+class GoogleSearchProvider(SearchProvider):
+    name = 'google'
+
+    def __init__(self, sleep_interval=SEARCH_SLEEP_INTERVAL):
+        self.sleep_interval = sleep_interval
+
+    def iter_results(self, query, num_results=SEARCH_NUM_RESULTS):
+        from googlesearch import search
+        yield from search(query, sleep_interval=self.sleep_interval, num_results=num_results)
+
+
+class JsonApiSearchProvider(SearchProvider):
+    name = 'json_api'
+
+    def __init__(self, url_template=SEARCH_API_URL, api_key=SEARCH_API_KEY, key_header=SEARCH_API_KEY_HEADER,
+                 results_path=SEARCH_API_RESULTS_PATH, url_field=SEARCH_API_URL_FIELD):
+        self.url_template = url_template
+        self.api_key = api_key
+        self.key_header = key_header
+        self.results_path = results_path
+        self.url_field = url_field
+
+    def iter_results(self, query, num_results=SEARCH_NUM_RESULTS):
+        url = self.url_template.format(query=quote_plus(query), num_results=num_results)
+        headers = {'Accept': 'application/json'}
+        if self.api_key:
+            headers[self.key_header] = self.api_key
+        response = fetch(url, headers=headers)
+        response.raise_for_status()
+        results = response.json()
+        for part in filter(None, self.results_path.split('.')):
+            results = results.get(part, []) if isinstance(results, dict) else []
+        for result in results[:num_results]:
+            result_url = result.get(self.url_field) if isinstance(result, dict) else result
+            if result_url:
+                yield result_url
+
+
+class FixtureSearchProvider(SearchProvider):
+    # Serves canned results for local runs, tests and benchmarks
+    name = 'fixture'
+
+    def __init__(self, fixtures=None, path=SEARCH_FIXTURES):
+        if fixtures is None:
+            fixtures = {}
+            if path:
+                with open(path, 'r', encoding='utf-8') as file:
+                    fixtures = json.load(file)
+        self.fixtures = {normalize_query(query): urls for query, urls in fixtures.items()}
+
+    def iter_results(self, query, num_results=SEARCH_NUM_RESULTS):
+        urls = self.fixtures.get(normalize_query(query), self.fixtures.get('*', []))
+        yield from urls[:num_results]
+
+
+class CachedSearchProvider(SearchProvider):
+    # Wraps a provider with a TTL cache keyed by normalized query, kept for the life of the container
+
+    def __init__(self, provider, ttl=SEARCH_CACHE_TTL_SECONDS, max_entries=SEARCH_CACHE_MAX_ENTRIES):
+        self.provider = provider
+        self.name = provider.name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (query, num_results) -> (stored_at, urls)
+        self.lock = threading.Lock()
+
+    def lookup(self, key):
+        with self.lock:
+            found = self.entries.get(key)
+            if found is None:
+                return None
+            if time.time() - found[0] >= self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return found[1]
+
+    def store(self, key, urls):
+        with self.lock:
+            self.entries[key] = (time.time(), urls)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def iter_results(self, query, num_results=SEARCH_NUM_RESULTS):
+        key = (normalize_query(query), num_results)
+        cached = self.lookup(key)
+        if cached is not None:
+            print(f"Search cache hit for query: {query}")
+            yield from cached
+            return
+        urls = []
+        for url in self.provider.iter_results(query, num_results):
+            urls.append(url)
+            yield url
+        # Only complete result lists are cached
+        if urls:
+            self.store(key, urls)
+
+
+PROVIDERS = {
+    GoogleSearchProvider.name: GoogleSearchProvider,
+    JsonApiSearchProvider.name: JsonApiSearchProvider,
+    FixtureSearchProvider.name: FixtureSearchProvider
+}
+
+_search_provider = None
+_search_provider_lock = threading.Lock()
+
+
+def get_search_provider():
+    global _search_provider
+    if _search_provider is None:
+        with _search_provider_lock:
+            if _search_provider is None:
+                _search_provider = CachedSearchProvider(PROVIDERS[SEARCH_PROVIDER]())
+    return _search_provider
@@ -0,0 +1,204 @@
+"""Build a trimmed Lambda layer zip for the webscrape and internet search functions.
+
+Usage:
+    python lambda-layer/build_layer.py [--source LAYER.zip | --requirements requirements.txt]
+        [--output lambda-layer/build/layer-trimmed.zip] [--exclude PACKAGE ...] [--keep-bs4]
+
+The layer contents come from an existing layer zip (by default the one shipped in this folder)
+or from a pip install of --requirements. Test suites, __pycache__ folders, stale bytecode,
+type stubs, console scripts and install metadata are removed. BeautifulSoup and soupsieve,
+which the functions no longer import (they parse HTML with the standard library), and any
+--exclude packages are removed too, but only if no package left in the layer imports them:
+googlesearch imports BeautifulSoup, which imports soupsieve, so both stay in a layer that
+ships googlesearch. Every module is then precompiled, since the Lambda file system is read
+only and the bytecode would otherwise be recompiled on every cold start.
+
+Run this with the same Python version as the Lambda runtime: the precompiled files are only
+used by a matching interpreter. The CloudFormation templates keep downloading the original
+layer, which their inline function code (still using BeautifulSoup) depends on.
+"""
+import argparse
+import ast
+import compileall
+import os
+import py_compile
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SOURCE = os.path.join(HERE, 'layer-python-requests-googlesearch-beatifulsoup.zip')
+DEFAULT_OUTPUT = os.path.join(HERE, 'build', 'layer-trimmed.zip')
+
+# Top-level import names the functions do not use -> their *.dist-info package name
+UNUSED_PACKAGES = {'bs4': 'beautifulsoup4', 'soupsieve': 'soupsieve'}
+STRIP_DIRS = ('tests', 'test', 'testing', '__pycache__')
+STRIP_SUFFIXES = ('.pyc', '.pyo', '.pyi', '.c', '.h', '.pxd', '.pyx')
+STRIP_METADATA = ('RECORD', 'INSTALLER', 'REQUESTED', 'direct_url.json')
+STRIP_TOP_LEVEL = ('bin',)
+
+
+def stage_source(source, requirements, staging):
+    if requirements:
+        subprocess.run([sys.executable, '-m', 'pip', 'install', '--no-compile', '--quiet',
+                        '-r', requirements, '-t', os.path.join(staging, 'python')], check=True)
+    else:
+        with zipfile.ZipFile(source) as archive:
+            archive.extractall(staging)
+
+
+def dist_info_package(name):
+    # 'beautifulsoup4-4.12.3.dist-info' -> 'beautifulsoup4'
+    return name.split('-')[0].lower().replace('_', '-')
+
+
+def remove(path, removed):
+    size = sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files) \
+        if os.path.isdir(path) else os.path.getsize(path)
+    shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+    removed.append((path, size))
+
+
+def strip(site_packages, excluded, excluded_dists):
+    removed = []
+    excluded_dists = {name.lower().replace('_', '-') for name in excluded_dists}
+    for name in sorted(os.listdir(site_packages)):
+        path = os.path.join(site_packages, name)
+        if name in STRIP_TOP_LEVEL or name.split('.')[0] in excluded:
+            remove(path, removed)
+        elif name.endswith('.dist-info') and (dist_info_package(name) in excluded_dists or
+                                             top_level_names(path) & set(excluded)):
+            remove(path, removed)
+
+    for root, dirs, files in os.walk(site_packages, topdown=True):
+        for name in list(dirs):
+            if name in STRIP_DIRS:
+                remove(os.path.join(root, name), removed)
+                dirs.remove(name)
+        for name in files:
+            if name.endswith(STRIP_SUFFIXES) or (root.endswith('.dist-info') and name in STRIP_METADATA):
+                remove(os.path.join(root, name), removed)
+    return removed
+
+
+def top_level_names(dist_info):
+    path = os.path.join(dist_info, 'top_level.txt')
+    if not os.path.exists(path):
+        return set()
+    with open(path) as file:
+        return {line.strip() for line in file if line.strip()}
+
+
+def module_imports(path):
+    # Top-level names a module imports, including imports inside functions and try blocks
+    try:
+        with open(path, 'rb') as file:
+            tree = ast.parse(file.read(), path)
+    except (SyntaxError, ValueError):
+        return set()
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module.split('.')[0])
+    return names
+
+
+def package_imports(site_packages):
+    # Top-level package or module name -> top-level names imported by its code
+    imports = {}
+    for root, dirs, files in os.walk(site_packages):
+        dirs[:] = [name for name in dirs if not name.endswith('.dist-info') and name not in STRIP_DIRS]
+        for name in files:
+            if name.endswith('.py'):
+                path = os.path.join(root, name)
+                package = os.path.relpath(path, site_packages).split(os.sep)[0]
+                package = package[:-3] if package.endswith('.py') else package
+                imports.setdefault(package, set()).update(module_imports(path))
+    return imports
+
+
+def removable(site_packages, excluded):
+    """Split excluded packages into those safe to remove and those a remaining package imports.
+    Returns (removable names, {kept name: importing package}). Keeping a package keeps what
+    it imports as well, so this repeats until nothing changes.
+    """
+    imports = package_imports(site_packages)
+    remove_names = set(excluded)
+    kept = {}
+    changed = True
+    while changed:
+        changed = False
+        for package, names in sorted(imports.items()):
+            if package in remove_names:
+                continue
+            for name in sorted(names & remove_names):
+                remove_names.discard(name)
+                kept[name] = package
+                changed = True
+    return [name for name in excluded if name in remove_names], kept
+
+
+def precompile(site_packages):
+    # Unchecked hash based pycs are used as is, without comparing source timestamps that
+    # change when Lambda unpacks the layer
+    return compileall.compile_dir(site_packages, quiet=1, workers=0,
+                                  invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+
+
+def write_zip(staging, output):
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as archive:
+        for root, dirs, files in os.walk(staging):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                archive.write(path, os.path.relpath(path, staging))
+
+
+def unpacked_size(path):
+    with zipfile.ZipFile(path) as archive:
+        return sum(info.file_size for info in archive.infolist())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help='Existing layer zip to trim')
+    parser.add_argument('--requirements', help='Build from a pip requirements file instead of --source')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--exclude', action='append', default=[],
+                        help='Another top-level package to drop, unless a remaining package imports it')
+    parser.add_argument('--keep-bs4', action='store_true', help='Keep BeautifulSoup and soupsieve')
+    args = parser.parse_args()
+
+    candidates = list(args.exclude) + ([] if args.keep_bs4 else list(UNUSED_PACKAGES))
+    staging = tempfile.mkdtemp(prefix='layer_build_')
+    try:
+        stage_source(args.source, args.requirements, staging)
+        site_packages = os.path.join(staging, 'python')
+        excluded, kept = removable(site_packages, candidates)
+        for name, package in kept.items():
+            print(f"Keeping {name}: imported by {package}")
+        excluded_dists = [UNUSED_PACKAGES.get(name, name) for name in excluded]
+        removed = strip(site_packages, excluded, excluded_dists)
+        if not precompile(site_packages):
+            print("Some modules failed to compile")
+            return 1
+        write_zip(staging, args.output)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    print(f"Removed {len(removed)} paths ({sum(size for _, size in removed) / 1024:.0f} KB)")
+    if not args.requirements:
+        print(f"Source:  {os.path.getsize(args.source) / 1024:>8.0f} KB zipped, "
+              f"{unpacked_size(args.source) / 1024:>8.0f} KB unpacked")
+    print(f"Trimmed: {os.path.getsize(args.output) / 1024:>8.0f} KB zipped, "
+          f"{unpacked_size(args.output) / 1024:>8.0f} KB unpacked (with bytecode) -> {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
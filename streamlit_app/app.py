@@ -1,12 +1,40 @@
 import invoke_agent as agenthelper
+from history import ChatHistory
+from trace_timeline import to_jsonl
 import streamlit as st
+import io
 import json
+import os
+import queue
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from PIL import Image, ImageOps, ImageDraw
 
 # Streamlit page configuration
 st.set_page_config(page_title="Wescrape Agent", page_icon=":robot_face:", layout="wide")
 
+AGENT_WORKERS = int(os.environ.get("AGENT_WORKERS", "32"))  # Agent calls running at once across all users
+HISTORY_MAX_ENTRIES = int(os.environ.get("HISTORY_MAX_ENTRIES", "50"))  # Older turns are dropped
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "5"))  # Turns rendered per "load more"
+IMAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+WEBSCRAPE_PROMPTS = (
+    "Webscrape this url and tell me the main features of pikachu 'https://www.pokemon.com/us/pokedex/pikachu'",
+    "Webscrape this url and tell me the main villians that Goku had to fight on planet earth 'https://en.wikipedia.org/wiki/Goku'",
+    "Webscrape this url and tell me about data modeling: https://schema.org/docs/datamodel.html"
+)
+INTERNET_SEARCH_PROMPTS = (
+    "Do an internet search and tell me the top 3 best traits about lebron james",
+    "Do an internet search and tell me how do I know what foods are healthy for me",
+    "Do an internet search and tell me the top 3 strongest features of charizard from pokemon"
+)
+
+# Agent calls run on a pool shared by every browser session instead of the script thread
+@st.cache_resource
+def get_agent_executor():
+    return ThreadPoolExecutor(max_workers=AGENT_WORKERS, thread_name_prefix="agent")
+
 # Function to crop image into a circle
 def crop_to_circle(image):
     mask = Image.new('L', image.size, 0)
@@ -16,6 +44,19 @@ def crop_to_circle(image):
     result.putalpha(mask)
     return result
 
+# Crop each avatar once per process and keep it as ready-to-serve PNG bytes
+@st.cache_data
+def load_avatar(filename):
+    image = crop_to_circle(Image.open(os.path.join(IMAGE_DIR, filename)))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+# Example prompt tables are built once and reused on every rerun
+@st.cache_data
+def example_prompts_table(prompts):
+    return pd.DataFrame({"Prompt": list(prompts)})
+
 # Title
 st.title("Wescrape Agent")
 
@@ -34,9 +75,23 @@ st.sidebar.title("Trace Data")
 
 # Session State Management
 if 'history' not in st.session_state:
-    st.session_state['history'] = []
+    st.session_state['history'] = ChatHistory(HISTORY_MAX_ENTRIES)
+if 'history_visible' not in st.session_state:
+    st.session_state['history_visible'] = HISTORY_PAGE_SIZE
+
+# Each browser session talks to its own agent session
+if 'agent_session_id' not in st.session_state:
+    st.session_state['agent_session_id'] = str(uuid.uuid4())
 
 # Function to parse and format response
+def latency_caption(latency):
+    # One-line per-turn breakdown of where the time went
+    return (f"Total {latency['total_seconds']:.2f}s | first byte {latency['time_to_first_byte'] or 0:.2f}s | "
+            f"Lambda {latency['lambda_seconds']:.2f}s ({latency['action_group_calls']} calls) | "
+            f"model {latency['model_seconds']:.2f}s ({latency['model_calls']} calls) | "
+            f"other {latency['other_seconds']:.2f}s")
+
+
 def format_response(response_body):
     try:
         # Try to load the response as JSON
@@ -53,10 +108,31 @@ def format_response(response_body):
 # Handling user input and responses
 if submit_button and prompt:
     event = {
-        "sessionId": "MYSESSION",
+        "sessionId": st.session_state['agent_session_id'],
         "question": prompt
     }
-    response = agenthelper.lambda_handler(event, None)
+    # Run the agent call on the shared pool; its events come back through a per-request queue
+    # and are rendered here, since Streamlit elements can only be updated from the script thread
+    agent_events = queue.Queue()
+    future = get_agent_executor().submit(agenthelper.lambda_handler, event, None, agent_events.put)
+
+    progress_placeholder = st.empty()
+    progress_placeholder.info("Agent working...")
+    answer_so_far = ""
+    trace_steps = 0
+    while not future.done() or not agent_events.empty():
+        try:
+            agent_event = agent_events.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if agent_event['type'] == 'chunk':
+            answer_so_far += agent_event['text']
+        elif agent_event['type'] == 'trace':
+            trace_steps += 1
+        progress_placeholder.info(f"Agent working... ({trace_steps} trace events)\n\n{answer_so_far}")
+
+    response = future.result()
+    progress_placeholder.empty()
     
     try:
         # Parse the JSON string
@@ -79,30 +155,43 @@ if submit_button and prompt:
 
     # Use trace_data and formatted_response as needed
     st.sidebar.text_area("", value=all_data, height=300)
-    st.session_state['history'].append({"question": prompt, "answer": the_response})
-    st.session_state['trace_data'] = the_response
+    timeline = response_data.get('timeline') if isinstance(response_data, dict) else None
+    if timeline:
+        latency = timeline['latency']
+        st.sidebar.write("### Latency")
+        st.sidebar.metric("Total", f"{latency['total_seconds']:.2f}s")
+        st.sidebar.metric("Time to first byte", f"{latency['time_to_first_byte'] or 0:.2f}s")
+        st.sidebar.metric("Webscrape/search Lambda", f"{latency['lambda_seconds']:.2f}s")
+        st.sidebar.metric("Model", f"{latency['model_seconds']:.2f}s")
+        st.session_state['history'].add(prompt, the_response, trace=to_jsonl(timeline['records']), latency=latency)
+    else:
+        st.session_state['history'].add(prompt, the_response)
+    st.session_state['history_visible'] = HISTORY_PAGE_SIZE
   
 
 if end_session_button:
-    st.session_state['history'].append({"question": "Session Ended", "answer": "Thank you for using AnyCompany Support Agent!"})
+    st.session_state['history'].add("Session Ended", "Thank you for using AnyCompany Support Agent!")
     event = {
-        "sessionId": "MYSESSION",
+        "sessionId": st.session_state['agent_session_id'],
         "question": "placeholder to end session",
         "endSession": True
     }
-    agenthelper.lambda_handler(event, None)
+    # Nothing is shown from this call, so it is not waited for
+    get_agent_executor().submit(agenthelper.lambda_handler, event, None)
+    st.session_state['agent_session_id'] = str(uuid.uuid4())
     st.session_state['history'].clear()
 
 # Display conversation history
 st.write("## Conversation History")
 
-# Load images outside the loop to optimize performance
-human_image = Image.open('/home/ubuntu/app/streamlit_app/human_face.png')
-robot_image = Image.open('/home/ubuntu/app/streamlit_app/robot_face.jpg')
-circular_human_image = crop_to_circle(human_image)
-circular_robot_image = crop_to_circle(robot_image)
+# Cached circular avatars, shared by every history entry
+circular_human_image = load_avatar('human_face.png')
+circular_robot_image = load_avatar('robot_face.jpg')
 
-for index, chat in enumerate(reversed(st.session_state['history'])):
+# Only the newest page(s) of the history are rendered
+history = st.session_state['history']
+for chat in history.newest(st.session_state['history_visible']):
+    index = chat["id"]
     # Creating columns for Question
     col1_q, col2_q = st.columns([2, 10])
     with col1_q:
@@ -126,26 +215,25 @@ for index, chat in enumerate(reversed(st.session_state['history'])):
             # Generate a unique key for each answer text area
             st.text_area("A:", value=chat["answer"], height=100, key=f"answer_{index}")
 
+    if chat.get("latency"):
+        _, col2_l = st.columns([2, 10])
+        with col2_l:
+            st.caption(latency_caption(chat["latency"]))
+            st.download_button("Export trace (JSON lines)", data=history.trace(index) or "",
+                               file_name=f"trace_{index}.jsonl", mime="application/x-ndjson",
+                               key=f"trace_{index}")
+
+if len(history) > st.session_state['history_visible']:
+    if st.button(f"Load more ({len(history) - st.session_state['history_visible']} older)"):
+        st.session_state['history_visible'] += HISTORY_PAGE_SIZE
+        st.rerun()
+
 # Example Prompts Section
 st.write("## Test URL Webscrape")
 
-# Creating a list of prompts for the Knowledge Base section
-knowledge_base_prompts = [
-    {"Prompt": "Webscrape this url and tell me the main features of pikachu 'https://www.pokemon.com/us/pokedex/pikachu'"},
-    {"Prompt": "Webscrape this url and tell me the main villians that Goku had to fight on planet earth 'https://en.wikipedia.org/wiki/Goku'"},
-    {"Prompt": "Webscrape this url and tell me about data modeling: https://schema.org/docs/datamodel.html"}
-]
-
 # Displaying the Knowledge Base prompts as a table
-st.table(knowledge_base_prompts)
+st.table(example_prompts_table(WEBSCRAPE_PROMPTS))
 
 st.write("## Test Internet Search")
-# Creating a list of prompts for the Knowledge Base section
-knowledge_base_prompts = [
-    {"Prompt": "Do an internet search and tell me the top 3 best traits about lebron james"},
-    {"Prompt": "Do an internet search and tell me how do I know what foods are healthy for me"},
-    {"Prompt": "Do an internet search and tell me the top 3 strongest features of charizard from pokemon"}
-]
-
 # Displaying the Knowledge Base prompts as a table
-st.table(knowledge_base_prompts)
+st.table(example_prompts_table(INTERNET_SEARCH_PROMPTS))
@@ -0,0 +1,94 @@
+import base64
+import json
+import sys
+
+from botocore.eventstream import EventStreamBuffer, ParserError
+
+# Incremental decoding of the AWS event stream encoding used by the bedrock-agent-runtime
+# InvokeAgent response. Each message is length prefixed:
+#
+#   total length (4) | headers length (4) | prelude CRC32 (4) | headers | payload | message CRC32 (4)
+#
+# The framing, typed headers and both CRC32 checks are handled by botocore's
+# EventStreamBuffer. botocore's EventStream wrapper is not used, because it expects a botocore
+# HTTP response and the request is signed and sent with requests. Bytes can be fed in
+# arbitrarily sized pieces; complete messages are returned as soon as their last byte
+# arrives, so chunk and trace events can be shown while the agent is running.
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class EventStreamError(Exception):
+    pass
+
+
+class EventStreamDecoder:
+    def __init__(self):
+        self.buffer = EventStreamBuffer()
+        self.pending = 0  # Bytes fed that are not part of a complete message yet
+
+    def feed(self, data):
+        # Add bytes and return every message that is now complete, as (headers, payload) tuples
+        self.buffer.add_data(bytes(data))
+        self.pending += len(data)
+        messages = []
+        try:
+            for message in self.buffer:
+                self.pending -= message.prelude.total_length
+                messages.append((message.headers, message.payload))
+        except ParserError as e:
+            raise EventStreamError(f"{type(e).__name__}: {e}") from e
+        return messages
+
+    def finished(self):
+        return self.pending == 0
+
+
+def to_event(headers, payload):
+    # Turn a raw message into a chunk, trace or other event dict
+    message_type = headers.get(':message-type', 'event')
+    if message_type in ('exception', 'error'):
+        error_type = headers.get(':exception-type') or headers.get(':error-code', 'Error')
+        try:
+            message = json.loads(payload).get('message', payload.decode('utf-8', errors='replace'))
+        except ValueError:
+            message = payload.decode('utf-8', errors='replace')
+        raise EventStreamError(f"{error_type}: {message}")
+
+    event_type = headers.get(':event-type', '')
+    body = json.loads(payload) if payload else {}
+    if event_type == 'chunk':
+        return {'type': 'chunk', 'text': base64.b64decode(body.get('bytes', '')).decode('utf-8'), 'body': body}
+    if event_type == 'trace':
+        return {'type': 'trace', 'trace': body}
+    return {'type': event_type, 'body': body}
+
+
+def iter_events(chunks):
+    # Decode an iterable of byte chunks into events as each message completes
+    decoder = EventStreamDecoder()
+    for data in chunks:
+        for headers, payload in decoder.feed(data):
+            yield to_event(headers, payload)
+    if not decoder.finished():
+        raise EventStreamError("Stream ended in the middle of a message")
+
+
+def iter_response_events(response, chunk_size=READ_CHUNK_SIZE):
+    # Decode a streamed requests response (sent with stream=True)
+    try:
+        yield from iter_events(response.iter_content(chunk_size=chunk_size))
+    finally:
+        response.close()
+
+
+def iter_file_events(path, chunk_size=READ_CHUNK_SIZE):
+    # Replay a recorded binary stream from disk
+    with open(path, 'rb') as file:
+        yield from iter_events(iter(lambda: file.read(chunk_size), b''))
+
+
+if __name__ == '__main__':
+    # Usage: python event_stream.py recorded_stream.bin
+    for event in iter_file_events(sys.argv[1]):
+        print(json.dumps(event, default=str))
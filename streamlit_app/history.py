@@ -0,0 +1,42 @@
+import itertools
+import zlib
+from collections import OrderedDict, deque
+
+# Bounded conversation history for one browser session. Only the newest max_entries turns are
+# kept; large trace blobs are stored zlib-compressed apart from the display text and are
+# evicted together with their turn, so session memory stays flat during long sessions.
+
+DEFAULT_MAX_ENTRIES = 50
+
+
+class ChatHistory:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = deque()
+        self.traces = OrderedDict()  # entry id -> compressed trace
+        self.ids = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, question, answer, trace=None, latency=None):
+        entry_id = next(self.ids)
+        self.entries.append({"id": entry_id, "question": question, "answer": answer, "latency": latency})
+        if trace:
+            self.traces[entry_id] = zlib.compress(trace.encode("utf-8"))
+        while len(self.entries) > self.max_entries:
+            evicted = self.entries.popleft()
+            self.traces.pop(evicted["id"], None)
+        return entry_id
+
+    def clear(self):
+        self.entries.clear()
+        self.traces.clear()
+
+    def newest(self, count):
+        # The newest `count` entries, newest first
+        return list(itertools.islice(reversed(self.entries), count))
+
+    def trace(self, entry_id):
+        compressed = self.traces.get(entry_id)
+        return zlib.decompress(compressed).decode("utf-8") if compressed is not None else None
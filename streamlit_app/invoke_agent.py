@@ -4,11 +4,14 @@ from botocore.awsrequest import AWSRequest
 from botocore.credentials import Credentials
 import json
 import os
-from requests import request
-import base64
-import io
-import sys
+import threading
+import time
+from functools import lru_cache
+import requests
+from requests.adapters import HTTPAdapter
 from lxml.html.clean import Cleaner
+from event_stream import iter_response_events
+from trace_timeline import TraceTimeline
 
 #For this to run on a local machine in VScode, you need to set the AWS_PROFILE environment variable to the name of the profile/credentials you want to use. 
 
@@ -25,134 +28,120 @@ os.environ["AWS_REGION"] = theRegion
 region = os.environ.get("AWS_REGION")
 llm_response = ""
 
-def sigv4_request(
-    url,
-    method='GET',
-    body=None,
-    params=None,
-    headers=None,
-    service='execute-api',
-    region=os.environ['AWS_REGION'],
-    credentials=Session().get_credentials().get_frozen_credentials()
-):
-    """Sends an HTTP request signed with SigV4
+AGENT_POOL_SIZE = int(os.environ.get("AGENT_POOL_SIZE", "32"))  # Concurrent agent calls sharing the pool
+AGENT_CONNECT_TIMEOUT = float(os.environ.get("AGENT_CONNECT_TIMEOUT", "5"))
+AGENT_READ_TIMEOUT = float(os.environ.get("AGENT_READ_TIMEOUT", "300"))
+
+
+@lru_cache(maxsize=1024)
+def session_url(base_url, session_id):
+    return f"{base_url}{session_id}/text"
+
+
+class AgentClient:
+    """Signed client for the bedrock-agent-runtime InvokeAgent API, shared by all Streamlit sessions.
     Args:
-    url: The request URL (e.g. 'https://www.example.com').
-    method: The request method (e.g. 'GET', 'POST', 'PUT', 'DELETE'). Defaults to 'GET'.
-    body: The request body (e.g. json.dumps({ 'foo': 'bar' })). Defaults to None.
-    params: The request query params (e.g. { 'foo': 'bar' }). Defaults to None.
-    headers: The request headers (e.g. { 'content-type': 'application/json' }). Defaults to None.
-    service: The AWS service name. Defaults to 'execute-api'.
-    region: The AWS region id. Defaults to the env var 'AWS_REGION'.
-    credentials: The AWS credentials. Defaults to the current boto3 session's credentials.
-    Returns:
-     The HTTP response
+    agent_id: The Bedrock agent id.
+    agent_alias_id: The agent alias id.
+    region: The AWS region id.
+    pool_size: The number of pooled keep-alive connections to the endpoint. Defaults to AGENT_POOL_SIZE.
+    boto_session: The boto3 session used to resolve credentials. Defaults to a new session.
     """
 
-    # sign request
-    req = AWSRequest(
-        method=method,
-        url=url,
-        data=body,
-        params=params,
-        headers=headers
-    )
-    SigV4Auth(credentials, service, region).add_auth(req)
-    req = req.prepare()
-
-    # send request
-    return request(
-        method=req.method,
-        url=req.url,
-        headers=req.headers,
-        data=req.body
-    )
-    
-    
-
-def askQuestion(question, url, endSession=False):
-    myobj = {
-        "inputText": question,   
-        "enableTrace": True,
-        "endSession": endSession
-    }
-    
-    # send request
-    response = sigv4_request(
-        url,
-        method='POST',
-        service='bedrock',
-        headers={
-            'content-type': 'application/json', 
-            'accept': 'application/json',
-        },
-        region=theRegion,
-        body=json.dumps(myobj)
-    )
-    
-    return decode_response(response)
-
-
-
-
-def decode_response(response):
-    # Create a StringIO object to capture print statements
-    captured_output = io.StringIO()
-    sys.stdout = captured_output
-
-    # Your existing logic
-    string = ""
-    for line in response.iter_content():
-        try:
-            string += line.decode(encoding='utf-8')
-        except:
-            continue
-
-    print("Decoded response", string)
-    split_response = string.split(":message-type")
-    print(f"Split Response: {split_response}")
-    print(f"length of split: {len(split_response)}")
-
-    for idx in range(len(split_response)):
-        if "bytes" in split_response[idx]:
-            #print(f"Bytes found index {idx}")
-            encoded_last_response = split_response[idx].split("\"")[3]
-            decoded = base64.b64decode(encoded_last_response)
-            final_response = decoded.decode('utf-8')
-            print(final_response)
-        else:
-            print(f"no bytes at index {idx}")
-            print(split_response[idx])
-            
-    last_response = split_response[-1]
-    print(f"Lst Response: {last_response}")
-    if "bytes" in last_response:
-        print("Bytes in last response")
-        encoded_last_response = last_response.split("\"")[3]
-        decoded = base64.b64decode(encoded_last_response)
-        final_response = decoded.decode('utf-8')
-    else:
-        print("no bytes in last response")
-        part1 = string[string.find('finalResponse')+len('finalResponse":'):] 
-        part2 = part1[:part1.find('"}')+2]
-        final_response = json.loads(part2)['text']
-
-    final_response = final_response.replace("\"", "")
-    final_response = final_response.replace("{input:{value:", "")
-    final_response = final_response.replace(",source:null}}", "")
-    llm_response = final_response
-
-    # Restore original stdout
-    sys.stdout = sys.__stdout__
-
-    # Get the string from captured output
-    captured_string = captured_output.getvalue()
-
-    # Return both the captured output and the final response
-    return captured_string, llm_response
-
-
-def lambda_handler(event, context):
+    def __init__(self, agent_id, agent_alias_id, region, pool_size=AGENT_POOL_SIZE, boto_session=None):
+        self.region = region
+        self.base_url = f'https://bedrock-agent-runtime.{region}.amazonaws.com/agents/{agent_id}/agentAliases/{agent_alias_id}/sessions/'
+        # Keep the refreshable credentials object; freezing it per request refreshes temporary
+        # credentials shortly before they expire instead of failing once they rotate
+        self.credentials = (boto_session or Session()).get_credentials()
+        self.http = requests.Session()
+        self.http.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    def sign(self, url, body):
+        req = AWSRequest(
+            method='POST',
+            url=url,
+            data=body,
+            headers={
+                'content-type': 'application/json',
+                'accept': 'application/json',
+            }
+        )
+        SigV4Auth(self.credentials.get_frozen_credentials(), 'bedrock', self.region).add_auth(req)
+        return req.prepare()
+
+    def ask(self, question, session_id, end_session=False, on_event=None):
+        body = json.dumps({
+            "inputText": question,
+            "enableTrace": True,
+            "endSession": end_session
+        })
+        req = self.sign(session_url(self.base_url, session_id), body)
+        timeline = TraceTimeline(time.monotonic())
+
+        # send request over the pooled connection, reading the event stream as it arrives
+        response = self.http.post(
+            req.url,
+            headers=dict(req.headers),
+            data=req.body,
+            stream=True,
+            timeout=(AGENT_CONNECT_TIMEOUT, AGENT_READ_TIMEOUT)
+        )
+        timeline.mark_first_byte()
+
+        if response.status_code != 200:
+            message = response.text
+            response.close()
+            raise Exception(f"Agent request failed with status {response.status_code}: {message}")
+
+        return decode_response(response, on_event, timeline)
+
+
+_agent_client = None
+_agent_client_lock = threading.Lock()
+
+
+def get_agent_client():
+    global _agent_client
+    if _agent_client is None:
+        with _agent_client_lock:
+            if _agent_client is None:
+                _agent_client = AgentClient(agentId, agentAliasId, theRegion)
+    return _agent_client
+
+
+def find_final_response(trace):
+    # The orchestration trace carries the final answer when no chunk event is sent
+    observation = trace.get('trace', {}).get('orchestrationTrace', {}).get('observation', {})
+    return observation.get('finalResponse', {}).get('text')
+
+
+def decode_response(response, on_event=None, timeline=None):
+    # Decode the InvokeAgent event stream; on_event is called with each event as it arrives
+    if timeline is None:
+        timeline = TraceTimeline()
+    trace_lines = []
+    answer_parts = []
+    final_response = None
+
+    for event in iter_response_events(response):
+        timeline.add(event)
+        if event['type'] == 'chunk':
+            answer_parts.append(event['text'])
+        elif event['type'] == 'trace':
+            trace_lines.append(json.dumps(event['trace']))
+            final_response = find_final_response(event['trace']) or final_response
+        if on_event is not None:
+            on_event(event)
+
+    timeline.finish()
+    llm_response = ''.join(answer_parts) or final_response or ''
+
+    # Return the trace output, the final response and the timed trace records
+    return '\n'.join(trace_lines), llm_response, timeline
+
+
+def lambda_handler(event, context, on_event=None):
     
     sessionId = event["sessionId"]
     question = event["question"]
@@ -160,17 +149,11 @@ def lambda_handler(event, context):
     
     print(f"Session: {sessionId} asked question: {question}")
     
-    try:
-        if (event["endSession"] == "true"):
-            endSession = True
-    except:
-        endSession = False
-    
-    url = f'https://bedrock-agent-runtime.{theRegion}.amazonaws.com/agents/{agentId}/agentAliases/{agentAliasId}/sessions/{sessionId}/text'
-
+    if event.get("endSession") in (True, "true"):
+        endSession = True
     
     try: 
-        response, trace_data = askQuestion(question, url, endSession)
+        response, trace_data, timeline = get_agent_client().ask(question, sessionId, endSession, on_event)
 
 
 
@@ -201,7 +184,7 @@ def lambda_handler(event, context):
         return {
             "status_code": 200,
             #"body": json.dumps({"response": response, "trace_data": trace_data})
-            "body": json.dumps({"response": response, "trace_data": trace_data})
+            "body": json.dumps({"response": response, "trace_data": trace_data, "timeline": timeline.to_dict()}, default=str)
         }
     except Exception as e:
         return {
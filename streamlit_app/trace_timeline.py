@@ -0,0 +1,156 @@
+import json
+import time
+
+# Structured view of the InvokeAgent trace. Each trace event is flattened into records
+# (orchestration steps, model invocations, action group and knowledge base invocations)
+# stamped with the time they arrived, and the per-turn latency is derived from them:
+# a model or action group invocation lasts from its input record until the next record.
+
+STAGES = {
+    'preProcessingTrace': 'pre_processing',
+    'orchestrationTrace': 'orchestration',
+    'postProcessingTrace': 'post_processing',
+    'failureTrace': 'failure'
+}
+DETAIL_CHARS = 300  # Rationale and observation text kept per record
+
+
+def short(text, limit=DETAIL_CHARS):
+    text = text or ''
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+def invocation_records(trace):
+    # Records for one stage trace, in the order the agent emits them
+    records = []
+    if 'modelInvocationInput' in trace:
+        model_input = trace['modelInvocationInput']
+        records.append({'kind': 'model_invocation', 'phase': 'start', 'step': model_input.get('traceId'),
+                        'type': model_input.get('type')})
+    if 'modelInvocationOutput' in trace:
+        model_output = trace['modelInvocationOutput']
+        usage = model_output.get('metadata', {}).get('usage', {})
+        records.append({'kind': 'model_invocation', 'phase': 'end', 'step': model_output.get('traceId'),
+                        'input_tokens': usage.get('inputTokens'), 'output_tokens': usage.get('outputTokens')})
+    if 'rationale' in trace:
+        rationale = trace['rationale']
+        records.append({'kind': 'orchestration_step', 'step': rationale.get('traceId'),
+                        'type': 'RATIONALE', 'detail': short(rationale.get('text'))})
+    if 'invocationInput' in trace:
+        invocation = trace['invocationInput']
+        invocation_type = invocation.get('invocationType')
+        record = {'step': invocation.get('traceId'), 'type': invocation_type}
+        if invocation_type == 'ACTION_GROUP':
+            action = invocation.get('actionGroupInvocationInput', {})
+            record.update(kind='action_group', phase='start', action_group=action.get('actionGroupName'),
+                          api_path=action.get('apiPath'), function=action.get('function'),
+                          parameters=action.get('parameters') or action.get('requestBody'))
+        elif invocation_type == 'KNOWLEDGE_BASE':
+            lookup = invocation.get('knowledgeBaseLookupInput', {})
+            record.update(kind='knowledge_base', phase='start', knowledge_base=lookup.get('knowledgeBaseId'))
+        else:
+            record['kind'] = 'orchestration_step'
+        records.append(record)
+    if 'observation' in trace:
+        observation = trace['observation']
+        observation_type = observation.get('type')
+        record = {'step': observation.get('traceId'), 'type': observation_type}
+        if observation_type == 'ACTION_GROUP':
+            output = observation.get('actionGroupInvocationOutput', {}).get('text') or ''
+            record.update(kind='action_group', phase='end', output_chars=len(output), detail=short(output))
+        elif observation_type == 'KNOWLEDGE_BASE':
+            references = observation.get('knowledgeBaseLookupOutput', {}).get('retrievedReferences', [])
+            record.update(kind='knowledge_base', phase='end', references=len(references))
+        elif observation_type == 'FINISH':
+            record.update(kind='final_response', detail=short(observation.get('finalResponse', {}).get('text')))
+        else:
+            record['kind'] = 'orchestration_step'
+        records.append(record)
+    if 'failureReason' in trace:
+        records.append({'kind': 'failure', 'step': trace.get('traceId'), 'detail': short(trace['failureReason'])})
+    return records
+
+
+def parse_trace(trace_event):
+    # Flatten one trace event (as yielded by event_stream.to_event) into records
+    trace = trace_event.get('trace', {})
+    records = []
+    for key, stage in STAGES.items():
+        if key in trace:
+            for record in invocation_records(trace[key]):
+                record['stage'] = stage
+                records.append(record)
+    if not records:
+        records.append({'kind': 'other', 'stage': 'unknown', 'keys': sorted(trace)})
+    if trace_event.get('eventTime'):
+        for record in records:
+            record['event_time'] = str(trace_event['eventTime'])
+    return records
+
+
+class TraceTimeline:
+    # Collects the records of one agent turn, timed from when the request was sent
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.monotonic()
+        self.started_at = time.time()
+        self.first_byte = None
+        self.first_event = None
+        self.finished = None
+        self.records = []
+
+    def offset(self):
+        return round(time.monotonic() - self.started, 3)
+
+    def mark_first_byte(self):
+        if self.first_byte is None:
+            self.first_byte = self.offset()
+
+    def add(self, event):
+        offset = self.offset()
+        if self.first_event is None:
+            self.first_event = offset
+        if event['type'] != 'trace':
+            return
+        for record in parse_trace(event['trace']):
+            record['seq'] = len(self.records)
+            record['offset'] = offset
+            record['timestamp'] = round(self.started_at + offset, 3)
+            self.records.append(record)
+
+    def finish(self):
+        self.finished = self.offset()
+
+    def spans(self, kind):
+        # Seconds from each start record of this kind until the record after it
+        total = 0.0
+        for index, record in enumerate(self.records):
+            if record['kind'] == kind and record.get('phase') == 'start':
+                if index + 1 < len(self.records):
+                    end = self.records[index + 1]['offset']
+                else:
+                    end = self.finished if self.finished is not None else record['offset']
+                total += end - record['offset']
+        return round(total, 3)
+
+    def latency(self):
+        total = self.finished if self.finished is not None else self.offset()
+        lambda_seconds = self.spans('action_group')
+        model_seconds = self.spans('model_invocation')
+        return {
+            'time_to_first_byte': self.first_byte,
+            'time_to_first_event': self.first_event,
+            'lambda_seconds': lambda_seconds,
+            'model_seconds': model_seconds,
+            'other_seconds': round(max(total - lambda_seconds - model_seconds, 0.0), 3),
+            'total_seconds': total,
+            'action_group_calls': sum(1 for r in self.records if r['kind'] == 'action_group' and r.get('phase') == 'start'),
+            'model_calls': sum(1 for r in self.records if r['kind'] == 'model_invocation' and r.get('phase') == 'start')
+        }
+
+    def to_dict(self):
+        return {'latency': self.latency(), 'records': self.records}
+
+
+def to_jsonl(records):
+    return '\n'.join(json.dumps(record, default=str) for record in records)
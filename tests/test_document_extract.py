@@ -0,0 +1,48 @@
+import os
+import sys
+import zlib
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'function'))
+
+from document_extract import PdfTextExtractor, UnsupportedContent  # noqa: E402
+
+
+def pdf_bytes(font, content):
+    # A one page PDF whose content stream shows text in the given font; the font comes last, as
+    # in most generated files, so it is only seen after the text
+    stream = zlib.compress(content)
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>',
+        b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(stream) + stream + b'\nendstream',
+        font
+    ]
+    body = b'%PDF-1.4\n'
+    for number, data in enumerate(objects, 1):
+        body += b'%d 0 obj\n' % number + data + b'\nendobj\n'
+    return body + b'trailer\n<< /Root 1 0 R >>\n%%EOF\n'
+
+
+def extract(data):
+    extractor = PdfTextExtractor(10000)
+    extractor.use_pypdf = False  # The builtin parser is what runs in the Lambda layer
+    for start in range(0, len(data), 64):
+        extractor.feed(data[start:start + 64])
+    extractor.close()
+    return extractor.text()
+
+
+def test_ligatures_from_differences_encoding():
+    font = b'<< /Type /Font /Subtype /Type1 /BaseFont /Times-Roman /Encoding << /Differences [2 /fi /fl] >> >>'
+    data = pdf_bytes(font, b'BT /F1 11 Tf 72 720 Td (The speci\\002cation \\003ags \\002les) Tj ET')
+    assert extract(data) == 'The specification flags files'
+
+
+def test_identity_encoded_fonts_are_refused():
+    font = b'<< /Type /Font /Subtype /Type0 /BaseFont /IPAexGothic /Encoding /Identity-H /DescendantFonts [6 0 R] >>'
+    data = pdf_bytes(font, b'BT /F1 11 Tf 72 720 Td <0a3f0b1200370052> Tj ET')
+    with pytest.raises(UnsupportedContent, match='not extractable'):
+        extract(data)
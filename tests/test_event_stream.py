@@ -0,0 +1,64 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'streamlit_app'))
+
+from event_stream import EventStreamError, iter_events, iter_file_events  # noqa: E402
+
+# A recorded InvokeAgent response: five orchestration trace events (model input, rationale,
+# action group call, its observation and the final response) followed by two chunk events
+RECORDED_STREAM = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'invoke_agent_stream.bin')
+ANSWER = 'AWS Lambda now supports response streaming and larger /tmp storage — up to 10 GB.'
+
+
+def recorded_bytes():
+    with open(RECORDED_STREAM, 'rb') as file:
+        return file.read()
+
+
+def pieces(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def test_replay_recorded_stream():
+    events = list(iter_file_events(RECORDED_STREAM))
+    assert [event['type'] for event in events] == ['trace'] * 5 + ['chunk'] * 2
+    assert ''.join(event['text'] for event in events if event['type'] == 'chunk') == ANSWER
+    orchestration = [event['trace']['trace']['orchestrationTrace'] for event in events[:5]]
+    assert 'rationale' in orchestration[1]
+    call = orchestration[2]['invocationInput']['actionGroupInvocationInput']
+    assert (call['actionGroupName'], call['apiPath']) == ('internet-search', '/search')
+    assert orchestration[4]['observation']['type'] == 'FINISH'
+
+
+@pytest.mark.parametrize('size', [1, 7, 100, 4096])
+def test_messages_split_across_reads(size):
+    # Messages are decoded the same whatever the read size, including one byte at a time
+    expected = list(iter_events([recorded_bytes()]))
+    assert list(iter_events(pieces(recorded_bytes(), size))) == expected
+
+
+def test_truncated_frame():
+    data = recorded_bytes()[:-5]
+    events = []
+    with pytest.raises(EventStreamError, match='middle of a message'):
+        for event in iter_events(pieces(data, 64)):
+            events.append(event)
+    # Every message before the cut was still delivered
+    assert [event['type'] for event in events] == ['trace'] * 5 + ['chunk']
+
+
+def test_message_crc_mismatch():
+    data = bytearray(recorded_bytes())
+    data[-10] ^= 0xFF  # A payload byte of the last message
+    with pytest.raises(EventStreamError, match='ChecksumMismatch'):
+        list(iter_events([bytes(data)]))
+
+
+def test_prelude_crc_mismatch():
+    data = bytearray(recorded_bytes())
+    data[3] ^= 0x01  # The first message's total length, covered by the prelude CRC
+    with pytest.raises(EventStreamError, match='ChecksumMismatch'):
+        list(iter_events([bytes(data)]))
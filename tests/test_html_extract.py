@@ -0,0 +1,56 @@
+import os
+import re
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'function'))
+
+from html_extract import FORMATS, MODE_MAIN, extract_html_text, is_boilerplate, select_markdown  # noqa: E402
+
+# Saved pages from the extraction benchmark; the mdBook ones carry class="light sidebar-visible" on <html>
+FIXTURES = os.path.join(ROOT, 'benchmarks', 'fixtures')
+MDBOOK_PAGES = [('rust_book_ownership.html', 'Ownership is a set of rules'),
+                ('rustc_platform_support.html', 'Support for different platforms')]
+
+
+def fixture_html(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as file:
+        return file.read()
+
+
+@pytest.mark.parametrize('output_format', FORMATS)
+@pytest.mark.parametrize('name, opening', MDBOOK_PAGES)
+def test_main_mode_keeps_mdbook_content(name, opening, output_format):
+    main = extract_html_text(fixture_html(name), 100000, MODE_MAIN, output_format=output_format)
+    assert opening in main
+    assert len(main) > 5000
+
+
+def test_boilerplate_matches_whole_tokens():
+    assert is_boilerplate('div', [('class', 'site sidebar')])
+    assert is_boilerplate('div', [('id', 'Footer')])
+    assert is_boilerplate('footer', [])
+    assert not is_boilerplate('div', [('class', 'sidebar-visible')])
+    assert not is_boilerplate('html', [('class', 'sidebar')])
+    assert not is_boilerplate('body', [('id', 'menu')])
+
+
+def test_main_mode_falls_back_to_the_whole_page():
+    # Every block sits in a boilerplate container: the page text comes back rather than nothing
+    html = '<body><div class="sidebar"><p>Only a <a href="/about">short note</a> about the site.</p></div></body>'
+    assert extract_html_text(html, 1000, MODE_MAIN) == 'Only a short note about the site.'
+    assert extract_html_text(html, 1000, MODE_MAIN, output_format='markdown', base_url='https://example.com/') == (
+        'Only a [short note][1] about the site.\n\n[1]: https://example.com/about')
+
+
+@pytest.mark.parametrize('max_chars', [300, 3000, 10000])
+def test_overlong_markdown_selection_is_cut_with_its_definitions(max_chars):
+    # A selector that ignores its budget: the cut falls back to a block boundary and keeps every
+    # definition the shortened text still cites
+    markdown = extract_html_text(fixture_html('rust_std_vec.html'), 100000, output_format='markdown',
+                                 base_url='https://doc.rust-lang.org/std/vec/')
+    selected = select_markdown(markdown, lambda body, budget: body, max_chars)
+    assert 0 < len(selected) <= max_chars
+    assert set(re.findall(r'\]\[(\d+)\]', selected)) <= set(re.findall(r'(?m)^\[(\d+)\]: ', selected))
@@ -0,0 +1,75 @@
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'function'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import politeness  # noqa: E402
+from fixture_server import start_server  # noqa: E402
+
+CORPUS = [('page.html', '<html><body><p>A small page for the politeness tests.</p></body></html>')]
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = start_server(CORPUS)
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(server):
+    # Buckets and robots rules live for the life of the container; every test starts without them
+    politeness._buckets.clear()
+    politeness._robots.clear()
+    server.reset_counters()
+
+
+def test_robots_disallow(server):
+    with pytest.raises(politeness.RobotsDisallowed):
+        politeness.polite_fetch(f'{server.base_url}/private/page.html')
+    assert server.requests == 1  # Only robots.txt was requested
+    assert politeness.polite_fetch(f'{server.base_url}/page/page.html').status_code == 200
+    assert server.requests == 2  # robots.txt is not downloaded again
+
+
+def test_retry_after_is_waited_out(server):
+    start = time.monotonic()
+    response = politeness.polite_fetch(f'{server.base_url}/limited/1/page.html?retry_after=1')
+    assert response.status_code == 200
+    assert time.monotonic() - start >= 1
+    # The 429 paused the host for every caller, not only the one that got it
+    assert politeness.get_bucket('127.0.0.1').paused_until > 0
+
+
+def test_retry_after_past_the_deadline_returns_the_429(server):
+    start = time.monotonic()
+    response = politeness.polite_fetch(f'{server.base_url}/limited/1/page.html?retry_after=5',
+                                       deadline=time.monotonic() + 2)
+    assert response.status_code == 429
+    assert time.monotonic() - start < 1
+
+
+def test_requests_to_a_host_are_spaced(server):
+    politeness._buckets['127.0.0.1'] = politeness.HostBucket(rate=5, burst=1)
+    start = time.monotonic()
+    for _ in range(3):
+        assert politeness.polite_fetch(f'{server.base_url}/page/page.html').status_code == 200
+    # One request at once, then one every 0.2 s
+    assert time.monotonic() - start >= 0.4
+    # Another host has its own bucket and is not held back
+    other = server.base_url.replace('127.0.0.1', 'localhost')
+    start = time.monotonic()
+    assert politeness.polite_fetch(f'{other}/page/page.html').status_code == 200
+    assert time.monotonic() - start < 0.2
+
+
+def test_spacing_that_misses_the_deadline_is_refused(server):
+    politeness._buckets['127.0.0.1'] = politeness.HostBucket(rate=0.5, burst=1)
+    politeness.polite_fetch(f'{server.base_url}/page/page.html')
+    with pytest.raises(politeness.RateLimited):
+        politeness.polite_fetch(f'{server.base_url}/page/page.html', deadline=time.monotonic() + 0.5)